@@ -1,7 +1,17 @@
-import mido, sounddevice
 import numpy as np
-import scipy.io.wavfile as wav
+import argparse
+import asyncio
+import collections
+import functools
+import json
 import os
+import platform
+import socket
+import struct
+import sys
+import threading
+import time
+import wave
 
 # **********************************************************************************************
 #   * Class:            synthTHIS
@@ -9,7 +19,9 @@ import os
 #   * Data Members:     osc_type            -> string holding which oscillator type is currently
 #                                              being used by the synthesizer
 #                                           ->  default - sine
-#                                           ->  options: sine, saw, square                      
+#                                           ->  options: sine, saw, square, wt_sine, wt_saw,
+#                                                        wt_square (band-limited wavetables),
+#                                                        sample (the sample instrument)
 #
 #                       log                 -> represents if verbose mode is activated
 #                                           ->  default - False
@@ -35,6 +47,78 @@ import os
 #                       volume              -> holds an integer representation of the volume
 #                                              knob for VMPK 
 #                                           -> default: 66
+#
+#                       polyphony           -> most voices that may sound at once, starting a
+#                                              note past it steals a voice
+#                                           ->  default - 32
+#                                           ->  options - 1 to MAX_POLYPHONY
+#
+#                       steal_policy        -> which voice is stolen when polyphony runs out
+#                                           ->  default - oldest
+#                                           ->  options - oldest, quietest, same-key
+#
+#                       latency             -> latency budget in seconds for rendering ahead
+#                                              of the device in larger internal quanta, 0
+#                                              renders every device block directly
+#                                           ->  default - 0.010
+#                                           ->  options - 0 to 0.050
+#
+#                       render_threads      -> worker threads the parts are rendered on, 1
+#                                              renders every part on the audio thread
+#                                           ->  default - up to 4, one per cpu core
+#                                           ->  options - 1 to MIDI_CHANNELS
+#
+#                       reverb_file         -> path of the .wav impulse response of the
+#                                              convolution reverb, None turns the reverb off
+#                                           ->  default - None
+#
+#                       reverb_level        -> gain of the reverb added to the dry signal
+#                                           ->  default - 0.3
+#                                           ->  options - 0 to 1
+#
+#                       delay_time          -> seconds between the echoes of the delay line, 0
+#                                              turns the delay off
+#                                           ->  default - 0
+#                                           ->  options - 0 to 2
+#
+#                       delay_feedback      -> share of each echo fed back into the delay line
+#                                           ->  default - 0.35
+#                                           ->  options - 0 to 0.95
+#
+#                       delay_level         -> gain of the echoes added to the dry signal
+#                                           ->  default - 0.3
+#                                           ->  options - 0 to 1
+#
+#                       filter_type         -> resonant filter every voice runs through
+#                                           ->  default - off
+#                                           ->  options - off, lowpass, highpass
+#
+#                       filter_cutoff       -> cutoff in hz of a note played at full velocity
+#                                              with the filter cc in its middle
+#                                           ->  default - 2000
+#
+#                       filter_resonance    -> q of the filter, higher rings more at the cutoff
+#                                           ->  default - 0.707
+#                                           ->  options - 0.5 to 20
+#
+#                       filter_velocity     -> octaves the cutoff falls from full velocity to
+#                                              the softest note
+#                                           ->  default - 2
+#                                           ->  options - 0 to 8
+#
+#                       filter_cc           -> midi cc moving the cutoff of its channel up or
+#                                              down by FILTER_CC_OCTAVES
+#                                           ->  default - 74 (brightness)
+#
+#                       lfo1_rate           -> rate in hz of the sine lfo
+#                                           ->  default - 5
+#
+#                       lfo2_rate           -> rate in hz of the triangle lfo
+#                                           ->  default - 0.25
+#
+#                       sample_file         -> path of the .wav sample or the .json zone map
+#                                              the sample oscillator plays, None for none
+#                                           ->  default - None
 # **********************************************************************************************
 class synthTHIS:
     # ******************************************************************************************
@@ -49,6 +133,23 @@ class synthTHIS:
         self.soft_toggle = False       
         self.sustain_toggle = False
         self.volume = 66
+        self.polyphony = 32
+        self.steal_policy = 'oldest'
+        self.latency = 0.010
+        self.render_threads = min(4, os.cpu_count() or 1)
+        self.reverb_file = None
+        self.reverb_level = 0.3
+        self.delay_time = 0.0
+        self.delay_feedback = 0.35
+        self.delay_level = 0.3
+        self.filter_type = 'off'
+        self.filter_cutoff = 2000.0
+        self.filter_resonance = 0.707
+        self.filter_velocity = 2.0
+        self.filter_cc = 74
+        self.lfo1_rate = 5.0
+        self.lfo2_rate = 0.25
+        self.sample_file = None
 
     # ******************************************************************************************
     # Purpose:          Print a cool ascii art method with the synth's name
@@ -78,6 +179,21 @@ class synthTHIS:
         print(f"\t4 -- Block Size:          {self.block_size}")
         print(f"\t5 -- Soft Toggle:         {self.soft_toggle}")
         print(f"\t6 -- Sustain Toggle:      {self.sustain_toggle}")
+        print(f"\t7 -- Polyphony:           {self.polyphony}")
+        print(f"\t8 -- Voice Stealing:      {self.steal_policy}")
+        print(f"\t9 -- Latency Budget:      {self.latency * 1000:g} ms")
+        print(f"\t10 -- Parts:              {part_summary()}")
+        print(f"\t11 -- Render Threads:     {self.render_threads}")
+        print(f"\t12 -- Reverb:             {self.reverb_file or 'off'}"
+              f"{'' if self.reverb_file is None else f' at {self.reverb_level:g}'}")
+        print(f"\t13 -- Delay:              " + ("off" if self.delay_time <= 0 else
+              f"{self.delay_time:g} s, feedback {self.delay_feedback:g} at {self.delay_level:g}"))
+        print(f"\t14 -- Filter:             " + ("off" if self.filter_type == 'off' else
+              f"{self.filter_type} {self.filter_cutoff:g} hz, q {self.filter_resonance:g}, "
+              f"velocity {self.filter_velocity:g} oct, cc {self.filter_cc}"))
+        print(f"\t15 -- Modulation:         {route_summary()}")
+        print(f"\t16 -- Samples:            {instrument.summary()}")
+        print(f"\t17 -- Envelope:           {envelope_summary()}")
         print("\n*******************************************************************************\n")
 
     # ******************************************************************************************
@@ -98,6 +214,28 @@ class synthTHIS:
             self.change_soft_toggle()
         elif option == 6:
             self.change_sustain_toggle()
+        elif option == 7:
+            self.change_polyphony()
+        elif option == 8:
+            self.change_steal_policy()
+        elif option == 9:
+            self.change_latency()
+        elif option == 10:
+            self.change_part()
+        elif option == 11:
+            self.change_render_threads()
+        elif option == 12:
+            self.change_reverb()
+        elif option == 13:
+            self.change_delay()
+        elif option == 14:
+            self.change_filter()
+        elif option == 15:
+            self.change_modulation()
+        elif option == 16:
+            self.change_samples()
+        elif option == 17:
+            self.change_envelope()
         else:
             print("Invalid input, please try again..")
             self.configuration_tree()
@@ -111,17 +249,13 @@ class synthTHIS:
         print("\n*******************************************************************************\n")
         print(f"Current oscillator type: {self.osc_type}")
         print("Options: sine, square, and saw")
+        print("Band-limited wavetable options: wt_sine, wt_square, and wt_saw")
+        print("Sampler option: sample, plays the instrument loaded from option 16")
         print("For example, to change to saw: type saw and hit enter")
         osc = input("Put your choice here: ")
-        if osc == 'sine':
-            print("Oscillator changed to sine!")
-            self.osc_type = 'sine'
-        elif osc == 'square':
-            print("Oscillator changed to square!")
-            self.osc_type = 'square'
-        elif osc == 'saw':
-            print("Oscillator changed to saw!")
-            self.osc_type = 'saw'
+        if osc in osc_ids:
+            print(f"Oscillator changed to {osc}!")
+            self.osc_type = osc
         else:
             print("Input was invalid, assigning default.")
             self.osc_type = 'sine'
@@ -158,6 +292,8 @@ class synthTHIS:
         if rate == 44100 or rate == 48000:
             print("Sample rate updated successfully!")
             self.sample_rate = rate
+            build_wavetables(rate)
+            effects.configure()
         else:
             print("Invalid sample rate, keeping the current value.")
         print("\n*******************************************************************************\n")
@@ -218,6 +354,251 @@ class synthTHIS:
             self.sustain_toggle = False
         print("\n*******************************************************************************\n")
 
+    # ******************************************************************************************
+    # Purpose:          Allow user to change the polyphony
+    # ******************************************************************************************
+    def change_polyphony(self):
+        print("\n*******************************************************************************\n")
+        print(f"Current polyphony: {self.polyphony}")
+        print(f"Options: any integer between 1 and {MAX_POLYPHONY}")
+        print("Hint: The limit is shared by every channel, changing to a lower value puts a")
+        print("      lower limit on the work done per block")
+        voices = int(input("Enter the desired polyphony: "))
+        if voices > 0 and voices <= MAX_POLYPHONY:
+            print("Polyphony updated successfully!")
+            self.polyphony = voices
+        else:
+            print("Invalid polyphony, keeping the current value.")
+        print("\n*******************************************************************************\n")
+
+    # ******************************************************************************************
+    # Purpose:          Allow user to change the voice stealing policy
+    # ******************************************************************************************
+    def change_steal_policy(self):
+        print("\n*******************************************************************************\n")
+        print(f"Current voice stealing policy: {self.steal_policy}")
+        print("Options: oldest, quietest, and same-key")
+        print("For example, to steal the quietest voice: type quietest and hit enter")
+        policy = input("Put your choice here: ")
+        if policy in ('oldest', 'quietest', 'same-key'):
+            print(f"Voice stealing changed to {policy}!")
+            self.steal_policy = policy
+        else:
+            print("Input was invalid, assigning default.")
+            self.steal_policy = 'oldest'
+        print("\n*******************************************************************************\n")
+
+    # ******************************************************************************************
+    # Purpose:          Allow user to change the latency budget
+    # ******************************************************************************************
+    def change_latency(self):
+        print("\n*******************************************************************************\n")
+        print(f"Current latency budget: {self.latency * 1000:g} ms")
+        print("Options: any number of milliseconds between 0 and 50")
+        print("Hint: A higher budget lets the synth render in larger, cheaper chunks,")
+        print("      0 renders every block directly. While playing the chunk size follows")
+        print("      the render load, the budget sets how far ahead the synth renders")
+        budget = float(input("Enter the desired latency budget in ms: "))
+        if budget >= 0 and budget <= 50:
+            print("Latency budget updated successfully!")
+            self.latency = budget / 1000
+            render_ahead.change(self.latency, self.block_size, self.sample_rate)
+        else:
+            print("Invalid latency budget, keeping the current value.")
+        print("\n*******************************************************************************\n")
+
+    # ******************************************************************************************
+    # Purpose:          Allow user to change the oscillator and envelope of one midi channel
+    # ******************************************************************************************
+    def change_part(self):
+        print("\n*******************************************************************************\n")
+        print(f"Parts: {part_summary()}")
+        channel = int(input(f"Enter the midi channel of the part (1 to {MIDI_CHANNELS}): ")) - 1
+        if channel < 0 or channel >= MIDI_CHANNELS:
+            print("Invalid midi channel, keeping the current parts.")
+            print("\n*******************************************************************************\n")
+            return
+        part = parts[channel]
+        print(f"Current oscillator type of channel {channel + 1}: {part.oscillator()}")
+        print("Leave empty to follow the synth oscillator")
+        osc = input("Put your choice here: ")
+        if osc in osc_ids:
+            part.osc_type = osc
+        else:
+            part.osc_type = None
+        print("Enter attack, decay, sustain and release separated by spaces, for example")
+        print("0.01 0.2 0.6 0.5, leave empty to follow the synth envelope")
+        values = input("Put your choice here: ").split()
+        if len(values) == 4:
+            part.adsr = (max(0.0, float(values[0])), max(0.0, float(values[1])),
+                         min(max(float(values[2]), 0.0), 1.0), max(0.0, float(values[3])))
+        else:
+            part.adsr = None
+        print(f"Channel {channel + 1} updated successfully!")
+        print("\n*******************************************************************************\n")
+
+    # ******************************************************************************************
+    # Purpose:          Allow user to change the number of render threads
+    # ******************************************************************************************
+    def change_render_threads(self):
+        print("\n*******************************************************************************\n")
+        print(f"Current render threads: {self.render_threads}")
+        print(f"Options: any integer between 1 and {MIDI_CHANNELS}")
+        print("Hint: More threads let several busy midi channels use more cpu cores")
+        threads = int(input("Enter the desired number of render threads: "))
+        if threads > 0 and threads <= MIDI_CHANNELS:
+            print("Render threads updated successfully!")
+            self.render_threads = threads
+            mixer.configure(threads)
+        else:
+            print("Invalid number of render threads, keeping the current value.")
+        print("\n*******************************************************************************\n")
+
+    # ******************************************************************************************
+    # Purpose:          Allow user to change the convolution reverb
+    # ******************************************************************************************
+    def change_reverb(self):
+        print("\n*******************************************************************************\n")
+        print(f"Current reverb impulse response: {self.reverb_file or 'off'}")
+        print("Options: path of a .wav impulse response, leave empty to turn the reverb off")
+        path = input("Put your choice here: ")
+        if path == '':
+            print("Reverb turned off!")
+            self.reverb_file = None
+        elif os.path.isfile(path):
+            level = float(input("Enter the reverb level (0 to 1): "))
+            self.reverb_file = path
+            self.reverb_level = min(max(level, 0.0), 1.0)
+            print("Reverb updated successfully!")
+        else:
+            print("File not found, keeping the current reverb.")
+        effects.configure()
+        print("\n*******************************************************************************\n")
+
+    # ******************************************************************************************
+    # Purpose:          Allow user to change the delay line
+    # ******************************************************************************************
+    def change_delay(self):
+        print("\n*******************************************************************************\n")
+        print(f"Current delay time: {self.delay_time:g} s")
+        print("Options: any number of seconds between 0 and 2, 0 turns the delay off")
+        seconds = float(input("Enter the delay time in seconds: "))
+        if seconds >= 0 and seconds <= 2:
+            self.delay_time = seconds
+            if seconds > 0:
+                feedback = float(input("Enter the feedback (0 to 0.95): "))
+                level = float(input("Enter the echo level (0 to 1): "))
+                self.delay_feedback = min(max(feedback, 0.0), 0.95)
+                self.delay_level = min(max(level, 0.0), 1.0)
+            print("Delay updated successfully!")
+            effects.configure()
+        else:
+            print("Invalid delay time, keeping the current value.")
+        print("\n*******************************************************************************\n")
+
+    # ******************************************************************************************
+    # Purpose:          Allow user to change the voice filter
+    # ******************************************************************************************
+    def change_filter(self):
+        print("\n*******************************************************************************\n")
+        print(f"Current filter type: {self.filter_type}")
+        print("Options: off, lowpass, and highpass")
+        kind = input("Put your choice here: ")
+        if kind not in ('off', 'lowpass', 'highpass'):
+            print("Input was invalid, keeping the current filter.")
+        elif kind == 'off':
+            print("Filter turned off!")
+            self.filter_type = 'off'
+        else:
+            cutoff = float(input("Enter the cutoff in hz at full velocity: "))
+            resonance = float(input("Enter the resonance (0.5 to 20): "))
+            octaves = float(input("Enter the octaves the cutoff falls at the softest velocity: "))
+            self.filter_cutoff = min(max(cutoff, FILTER_LOWEST), 20000.0)
+            self.filter_resonance = min(max(resonance, 0.5), 20.0)
+            self.filter_velocity = min(max(octaves, 0.0), 8.0)
+            load_filter(kind)
+            self.filter_type = kind
+            print("Filter updated successfully!")
+        print("\n*******************************************************************************\n")
+
+    # ******************************************************************************************
+    # Purpose:          Allow user to change the modulation routes and the lfo rates
+    # ******************************************************************************************
+    def change_modulation(self):
+        global modulation_routes
+
+        print("\n*******************************************************************************\n")
+        print(f"Current modulation routes: {route_summary()}")
+        print(f"LFO rates: lfo1 {self.lfo1_rate:g} hz (sine), "
+              f"lfo2 {self.lfo2_rate:g} hz (triangle)")
+        print(f"Sources: {', '.join(MOD_SOURCES)}")
+        print(f"Destinations: {', '.join(MOD_DESTINATIONS)}")
+        print("Enter a route to add as: source destination amount [via], for example")
+        print("lfo1 pitch 0.3 modwheel, or clear to remove every route, default to restore")
+        print("the default routes, or lfo1 6 to set the rate of an lfo")
+        words = input("Put your choice here: ").split()
+        if words == ['clear']:
+            modulation_routes = []
+        elif words == ['default']:
+            modulation_routes = list(DEFAULT_ROUTES)
+        elif len(words) == 2 and words[0] in ('lfo1', 'lfo2'):
+            setattr(self, words[0] + '_rate', min(max(float(words[1]), 0.0), 50.0))
+        elif len(words) in (3, 4) and words[0] in MOD_SOURCES and words[1] in MOD_DESTINATIONS \
+                and (len(words) == 3 or words[3] in MOD_SOURCES):
+            via = words[3] if len(words) == 4 else None
+            modulation_routes = modulation_routes + [(words[0], words[1], float(words[2]), via)]
+        else:
+            print("Input was invalid, keeping the current routes.")
+        print(f"Modulation routes: {route_summary()}")
+        print("\n*******************************************************************************\n")
+
+    # ******************************************************************************************
+    # Purpose:          Allow user to change the instrument the sample oscillator plays
+    # ******************************************************************************************
+    def change_samples(self):
+        print("\n*******************************************************************************\n")
+        print(f"Current sample instrument: {instrument.summary()}")
+        print("Options: path of a .wav sample or a .json zone map, leave empty to unload")
+        path = input("Put your choice here: ")
+        if path == '':
+            print("Sample instrument unloaded!")
+            self.sample_file = None
+        elif os.path.isfile(path):
+            self.sample_file = path
+        else:
+            print("File not found, keeping the current instrument.")
+        instrument.load(self.sample_file)
+        print(f"Sample instrument: {instrument.summary()}")
+        print("\n*******************************************************************************\n")
+
+    # ******************************************************************************************
+    # Purpose:          Allow user to change the envelope every part without its own follows,
+    #                   and the curve of every envelope
+    # ******************************************************************************************
+    def change_envelope(self):
+        global attack, decay, sustain, release, envelope_curve
+
+        print("\n*******************************************************************************\n")
+        print(f"Current envelope: {envelope_summary()}")
+        print("Enter attack, decay, sustain and release separated by spaces, for example")
+        print("0.01 0.2 0.6 0.5, leave empty to keep the current envelope")
+        values = input("Put your choice here: ").split()
+        if len(values) == 4:
+            attack, decay, sustain, release = (max(0.0, float(values[0])),
+                                               max(0.0, float(values[1])),
+                                               min(max(float(values[2]), 0.0), 1.0),
+                                               max(0.0, float(values[3])))
+        elif values:
+            print("Input was invalid, keeping the current envelope.")
+        print("Options: linear and exponential, leave empty to keep the current curve")
+        curve = input("Put your choice here: ")
+        if curve in ('linear', 'exponential'):
+            envelope_curve = curve
+        elif curve:
+            print("Input was invalid, keeping the current curve.")
+        print(f"Envelope: {envelope_summary()}")
+        print("\n*******************************************************************************\n")
+
 #               - - End Of synthTHIS Class --                #
 
 
@@ -227,20 +608,39 @@ class synthTHIS:
 #                           -> default - 0.020
 attack = 0.020
 
+# decay                     -> float holding the decay time for note synthesis
+#                           -> default - 0.10
+decay = 0.10
+
+# sustain                   -> float holding the sustain level for note synthesis
+#                           -> default - 1.0
+sustain = 1.0
+
 # release                   -> float holding the release time for note synthesis
 #                           -> default - 0.10
 release = 0.10
 
-# sample_clock              -> tracker of samples output to ensure correctly phased waveforms
+# envelope_curve            -> string holding the shape of the envelope segments
+#                           -> default - linear
+#                           -> options: linear, exponential
+envelope_curve = 'linear'
+
+# sample_clock              -> tracker of samples output since the stream started
 #                           -> default - none
 sample_clock = 0
 
-# out_keys                  -> dynamic dictionary of currently playing keys 
-#                           -> index by MIDI key number 
-out_keys = dict()
+# callback_clock            -> samples the device had played at the start of the most recent
+#                              output block, behind sample_clock by what is rendered ahead
+# callback_time             -> perf_counter time at the start of the most recent output block
+#                           -> used by the midi thread to timestamp events in samples
+callback_clock = 0
+callback_time = 0.0
 
-# --   midi startup  -- #
-keyboard = mido.open_input('loopMIDI Port 0')
+# count_voices              -> function render_voices hands the voice count of every rendered
+#                              piece to instead of scaling the piece by it, set in the workers
+#                              of a parallel render so the mixing process can scale the mix
+#                           -> default - none
+count_voices = None
 
 # --  create global synth  -- #
 synth = synthTHIS()
@@ -250,301 +650,4664 @@ synth = synthTHIS()
 
 # **********************************************************************************************
 #   * Class:            Note
-#   * Purpose:          Simple class to hold individual note data all in one object
-#   * Data Members:     frequency           -> holds an integer for the note's frequency
+#   * Purpose:          Simple class to hold the starting data of an individual note all in one
+#                       object, the voice bank copies it into its arrays when the note starts
+#   * Data Members:     key                 -> holds the midi key number of the note
+#                       frequency           -> holds an integer for the note's frequency
 #                       osc_type            -> holds the type of oscillator used for the note
 #                                               'sine' for a sin oscillator
 #                                               'square' for a square oscillator
 #                                               'saw' for a saw oscillator
-#                       playing             -> boolean representing if a note is on or off
-#                                               False for off
-#                                               True for on
-#                       attack_remaining    -> integer representing time in seconds of
-#                                              the remaining attack for this note
-#                       release_remaining   -> integer representing time in seconds of
-#                                              the remaining release time for this note
+#                                               'sample' for the sample instrument
+#                       velocity            -> how hard the note was struck, from 0 to 1
 # **********************************************************************************************
 class Note:
     # ******************************************************************************************
     # Purpose:          Note default constructor
     # Parameters:       key         -> object
     #                   osc         -> oscillator type for note
+    #                   velocity    -> how hard the note was struck, from 0 to 1
     # ******************************************************************************************
-    def __init__(self, key, osc):
+    def __init__(self, key, osc, velocity=1.0):
+        self.key = key
         self.frequency = key_to_frequency(key)
         self.osc_type = osc
-        self.playing = True
-        self.attack_remaining = attack
-        self.release_remaining = None
+        self.velocity = velocity
 
-    # ******************************************************************************************
-    # Purpose:          Set note's release time remaining
-    # ******************************************************************************************
-    def release(self):
-        self.release_remaining = release
+#               - - End Of Note Class --                #
 
-    # ******************************************************************************************
-    # Purpose:          Sample generator for note object to create and shape a wave
-    # Parameters:       linespace   -> object holding the linespace data for the note
-    # Return:           samples     -> numpy array with a wave to be played
-    # ******************************************************************************************
-    def samples(self, linespace):
-        if self.playing == False:
-            return None
-        
-        freq = self.frequency
-        count = len(linespace)
 
-        #determine oscillator type currently in use
-        if synth.osc_type == 'sine':
-            samples = sine_wave(freq, linespace)
-        elif synth.osc_type == 'square':
-            samples = square_wave(freq, linespace)
-        else:
-            samples = saw_wave(freq, linespace)
+# -- START - voice bank constants -- #
 
-        #calculate release 
-        if self.release_remaining is not None:
-            release_copy = self.release_remaining
-            if release_copy <= 0:
-                self.playing = False
-                return None
-            
-            start_gain = release_copy / release
-            end = count / synth.sample_rate
-            release_copy -= end
-            end_gain = release_copy / release
+# osc_ids                   -> maps an oscillator type onto the id stored in the voice bank,
+#                              ids from WAVETABLE_FIRST up to the sample id are read from the
+#                              wavetables
+osc_ids = {'sine': 0, 'saw': 1, 'square': 2, 'wt_sine': 3, 'wt_saw': 4, 'wt_square': 5,
+           'sample': 6}
+WAVETABLE_FIRST = 3
 
-            envelope = np.clip(np.linspace(start_gain, end_gain, count), 0.0, 1.0)
+# WAVETABLE_SIZE            -> samples in one cycle of a wavetable
+WAVETABLE_SIZE = 2048
 
-            samples *= envelope
+# WAVETABLE_BASE            -> highest fundamental in hz of the lowest wavetable octave, each
+#                              following octave doubles it and keeps half the harmonics
+WAVETABLE_BASE = 20.0
 
-            self.release_remaining = max(0, release_copy)
+# envelope stages           -> stage of the envelope a voice is currently in, held voices run
+#                              through attack and decay and stay on the sustain level, faded
+#                              voices were stolen and are quickly fading out
+STAGE_HELD = 0
+STAGE_RELEASE = 1
+STAGE_FADE = 2
 
-        #calculate attack
-        elif self.attack_remaining > 0.0:
-            attack_copy = self.attack_remaining
-            if attack_copy <= 0:
-                self.playing = False
-                return None
-            
-            start_gain = 1.0 - attack_copy / attack
-            end = count / synth.sample_rate
-            attack_copy -= end
-            end_gain = 1.0 - attack_copy / attack
+# MAX_POLYPHONY             -> largest polyphony the voice bank has room for
+MAX_POLYPHONY = 128
 
-            envelope = np.clip(np.linspace(start_gain, end_gain, count), 0.0, 1.0)
+# FADE_VOICES               -> extra room in the voice bank for stolen voices fading out
+FADE_VOICES = 16
 
-            samples *= envelope
+# FADE_TIME                 -> seconds a stolen voice takes to fade out
+FADE_TIME = 0.005
 
-            self.attack_remaining = max(0, attack_copy)
+# VOICE_CAPACITY            -> entries in the voice bank of each part
+VOICE_CAPACITY = MAX_POLYPHONY + FADE_VOICES
 
-        return samples
+# MIDI_CHANNELS             -> number of parts, one per midi channel
+MIDI_CHANNELS = 16
 
-#               - - End Of Note Class --                #
+# THREAD_WORK               -> least voices times samples in a block worth splitting across the
+#                              worker threads
+THREAD_WORK = 4096
 
+# FILTER_LOWEST             -> lowest cutoff in hz of the voice filter
+FILTER_LOWEST = 20.0
 
-# *********************************************************************************************
-# Purpose:      Sine wave generator. 
-# Parameters:   frequency   -> holds an integer representation of the frequency requested
-#               time        -> holds an integer representation of the time requested'
-# Returns:      wave        -> numpy array holding a sine wave
-# *********************************************************************************************
-def sine_wave(frequency, time):
-    wave = np.sin(2 * np.pi * frequency * time)
-    return wave
+# FILTER_STEPS              -> cutoffs per octave the voice filter is quantized to, voices whose
+#                              cutoffs land on the same step are filtered in one call
+FILTER_STEPS = 12
 
-# *********************************************************************************************
-# Purpose:      Saw wave generator. 
-# Parameters:   frequency   -> holds an integer representation of the frequency requested
-#               time        -> holds an integer representation of the time requested'
-# Returns:      wave        -> numpy array holding a saw wave
-# *********************************************************************************************
-def saw_wave(frequency, time):
-    wave = (frequency * time) % 2.0 - 1.0
-    return wave
+# FILTER_CC_OCTAVES         -> octaves the filter cc moves the cutoff up or down from its middle
+FILTER_CC_OCTAVES = 3.0
 
-# *********************************************************************************************
-# Purpose:      Square wave generator. 
-# Parameters:   frequency   -> holds an integer representation of the frequency requested
-#               time        -> holds an integer representation of the time requested'
-# Returns:      wave        -> numpy array holding a square wave
-# *********************************************************************************************
-def square_wave(frequency, time):
-    wave = np.sign((frequency * time) % 2.0 - 1.0)
-    return wave
+# CONTROL_RATE              -> samples between the points the modulation matrix is evaluated at,
+#                              voices ramp linearly from one point to the next
+CONTROL_RATE = 32
 
+# MOD_SOURCES               -> sources of the modulation matrix, bend and the lfos run from -1 to
+#                              1, the others from 0 to 1
+MOD_SOURCES = ('bend', 'velocity', 'volume', 'modwheel', 'lfo1', 'lfo2')
 
-# *********************************************************************************************
-# Purpose:      Converts a midi key into a frequency 
-# Parameters:   key         -> holds an integer representation of the midi key
-# Returns:      {float}     -> float representation of the frequency of the key passed in
-# *********************************************************************************************
-def key_to_frequency(key):
-    return 440 * 2**((key - 69) / 12)
+# MOD_DESTINATIONS          -> destinations of the modulation matrix, pitch in semitones, cutoff
+#                              in octaves, and amp pulling the gain down by amount * (1 - source),
+#                              the amount being scaled by the via source first
+MOD_DESTINATIONS = ('pitch', 'amp', 'cutoff')
 
+# DEFAULT_ROUTES            -> routes of a fresh modulation matrix, a two semitone pitch bend,
+#                              velocity and cc 7 volume on the gain, and mod wheel vibrato
+DEFAULT_ROUTES = (('bend', 'pitch', 2.0, None),
+                  ('velocity', 'amp', 1.0, None),
+                  ('volume', 'amp', 1.0, None),
+                  ('lfo1', 'pitch', 0.5, 'modwheel'))
 
-# *********************************************************************************************
-# Purpose:      Generates a numpy linespace given a frame count 
-# Parameters:   frames          -> hold the number of frames in to generate in a sample
-# Returns:      {np.linespace}  -> object holding an array of sample times starting at clock
-# *********************************************************************************************
-def linespace_generator(frames):
-    line = np.linspace(sample_clock / synth.sample_rate,
-                       (sample_clock + frames) / synth.sample_rate,
-                       frames,
-                       dtype=np.float32)
-    return line
+# modulation_routes         -> list of (source, destination, amount, via) routes of the
+#                              modulation matrix, via is a second source the first is scaled by
+#                              or None. The list is only ever replaced, never changed in place,
+#                              so the audio thread always sees a whole matrix
+#                           -> default - DEFAULT_ROUTES
+modulation_routes = list(DEFAULT_ROUTES)
 
-# *********************************************************************************************
-# Purpose:      Callback for the purpose of playing audio through sounddevice 
-# Parameters:   data            -> data to output
-#               frames          -> frame count 
-#               time_info       -> info about sample clock
-#               status          -> status of callback
-# *********************************************************************************************
-def output_callback(data, frames, time_info, status):
+# -- END - voice bank constants -- #
 
-    global sample_clock
 
-    if status:
-        print("output callback:", status)
+# **********************************************************************************************
+#   * Class:            SampleZone
+#   * Purpose:          One sample of a multisampled instrument and the keys and velocities it
+#                       plays. The sample data stays memory-mapped from its wav file, so only the
+#                       pages a voice actually reads are ever loaded into memory
+#   * Data Members:     data                -> memory-mapped sample data as stored in the wav
+#                                              file, (samples) for mono or (samples, channels)
+#                       length              -> number of samples
+#                       offset              -> value of silence in the stored samples
+#                       gain                -> scale from the stored samples to -1 to 1, with
+#                                              the channels averaged
+#                       root                -> midi key the sample plays at its own pitch
+#                       keys                -> (lowest, highest) midi keys the zone plays
+#                       velocities          -> (lowest, highest) midi velocities the zone plays
+#                       loop                -> (start, end) samples of the sustain loop, end
+#                                              excluded, or None to play the sample once
+#                       speed               -> samples of the sample read per cycle of a voice,
+#                                              the sample rate of the file over the frequency of
+#                                              the root key
+# **********************************************************************************************
+class SampleZone:
+    # ******************************************************************************************
+    # Purpose:          SampleZone default constructor
+    # Parameters:       data        -> sample data of the wav file
+    #                   rate        -> sample rate of the wav file in sps
+    #                   root        -> midi key the sample plays at its own pitch
+    #                   keys        -> (lowest, highest) midi keys
+    #                   velocities  -> (lowest, highest) midi velocities
+    #                   loop        -> (start, end) of the sustain loop, or None
+    # ******************************************************************************************
+    def __init__(self, data, rate, root=60, keys=(0, 127), velocities=(0, 127), loop=None):
+        channels = 1 if data.ndim == 1 else data.shape[1]
+        self.data = data[:, 0] if channels == 1 and data.ndim > 1 else data
+        self.length = len(data)
+        self.offset = 128.0 * channels if data.dtype == np.uint8 else 0.0
+        if data.dtype == np.uint8:
+            self.gain = 1.0 / (128 * channels)
+        elif np.issubdtype(data.dtype, np.integer):
+            self.gain = 1.0 / (np.iinfo(data.dtype).max * channels)
+        else:
+            self.gain = 1.0 / channels
+        self.root = root
+        self.keys = (int(keys[0]), int(keys[1]))
+        self.velocities = (int(velocities[0]), int(velocities[1]))
+        self.loop = None
+        if loop is not None and 0 <= loop[0] < loop[1] <= self.length:
+            self.loop = (int(loop[0]), int(loop[1]))
+        self.speed = rate / key_to_frequency(root)
 
+    # ******************************************************************************************
+    # Purpose:          Read the sample at fractional positions by linear interpolation,
+    #                   positions past the loop end are wrapped back into the loop and positions
+    #                   past the end of a sample without a loop read silence
+    # Parameters:       position    -> numpy array of positions in samples, wrapped in place
+    # Returns:          wave        -> numpy array of the same shape holding the sample
+    # ******************************************************************************************
+    def read(self, position):
+        if self.loop is not None:
+            start, end = self.loop
+            past = position >= end
+            if past.any():
+                position[past] = start + np.remainder(position[past] - start, end - start)
+        first = np.floor(position).astype(np.intp)
+        fraction = position - first
+        following = first + 1
+        if self.loop is not None:
+            following[following >= end] -= end - start
+        else:
+            fraction[first >= self.length - 1] = 0.0
+        np.clip(first, 0, self.length - 1, out=first)
+        np.clip(following, 0, self.length - 1, out=following)
 
-    samples = np.zeros(frames, dtype=np.float32)
+        # the gathers only touch the pages of the memory map around the positions read
+        wave = self.data[first].astype(np.float64)
+        after = self.data[following].astype(np.float64)
+        if wave.ndim > position.ndim:
+            wave = wave.sum(axis=-1)
+            after = after.sum(axis=-1)
+        after -= wave
+        after *= fraction
+        wave += after
+        if self.offset:
+            wave -= self.offset
+        wave *= self.gain
+        if self.loop is None:
+            wave[position >= self.length - 1] = 0.0
+        return wave
 
-    if out_keys:
-        line = linespace_generator(frames)
+#               - - End Of SampleZone Class --                #
 
-        on = list(out_keys.keys())
-        off = set()
 
-        for key in on:
-            note = out_keys[key]
-            note_samples = note.samples(line)
-            if note_samples is None:
-                off.add(key)
-                continue
-            samples += note_samples
+# **********************************************************************************************
+#   * Class:            SampleInstrument
+#   * Purpose:          Multisampled instrument the sample oscillator plays, a list of zones
+#                       mapping keys and velocities onto memory-mapped samples. An instrument is
+#                       loaded from a single .wav file, played over every key from middle c, or
+#                       from a .json zone map listing the zones, for example
+#                           {"zones": [{"file": "piano-c4.wav", "root": 60, "keys": [0, 66],
+#                                       "velocities": [0, 90], "loop": [12000, 48000]}]}
+#                       where every field but file is optional and paths are relative to the
+#                       map
+#   * Data Members:     path                -> path the instrument was loaded from, or None
+#                       zones               -> list of SampleZone objects, earlier zones win
+#                                              where zones overlap. The list is only ever
+#                                              replaced so the audio thread always sees a whole
+#                                              instrument
+# **********************************************************************************************
+class SampleInstrument:
+    # ******************************************************************************************
+    # Purpose:          SampleInstrument default constructor
+    # ******************************************************************************************
+    def __init__(self):
+        self.path = None
+        self.zones = []
 
-        for key in off:
-            del out_keys[key]
+    # ******************************************************************************************
+    # Purpose:          Load the instrument from a .wav sample or a .json zone map, the wav files
+    #                   are memory-mapped so even a large library loads at once
+    # Parameters:       path        -> path of the .wav or .json file, None unloads
+    # ******************************************************************************************
+    def load(self, path):
+        if path is None:
+            self.path = None
+            self.zones = []
+            return
+        if not path.lower().endswith('.json'):
+            zones = [SampleZone(*read_sample(path))]
+        else:
+            with open(path) as file:
+                entries = json.load(file)['zones']
+            folder = os.path.dirname(path)
+            files = dict()
+            zones = []
+            for entry in entries:
+                name = os.path.join(folder, entry['file'])
+                if name not in files:
+                    files[name] = read_sample(name)
+                zones.append(SampleZone(*files[name], root=entry.get('root', 60),
+                                        keys=entry.get('keys', (0, 127)),
+                                        velocities=entry.get('velocities', (0, 127)),
+                                        loop=entry.get('loop')))
+        self.path = path
+        self.zones = zones
 
-    nkeys = len(out_keys)
-    if nkeys <= 8:
-        samples *= 1.0 / 8.0
-    else:
-        samples *= 1.0 / len(out_keys)
+    # ******************************************************************************************
+    # Purpose:          Find the zone a note plays
+    # Parameters:       key         -> midi key of the note
+    #                   velocity    -> velocity of the note, from 0 to 1
+    # Returns:          {int}       -> index of the zone, -1 when no zone plays the note
+    # ******************************************************************************************
+    def find(self, key, velocity):
+        velocity = int(round(velocity * 127))
+        for index, zone in enumerate(self.zones):
+            if zone.keys[0] <= key <= zone.keys[1] \
+                    and zone.velocities[0] <= velocity <= zone.velocities[1]:
+                return index
+        return -1
 
-    data[:] = np.reshape(samples, (frames, 1))
+    # ******************************************************************************************
+    # Purpose:          Short description of the instrument for the configuration menu
+    # Returns:          {string}    -> the description
+    # ******************************************************************************************
+    def summary(self):
+        if self.path is None:
+            return 'none'
+        return f"{self.path} ({len(self.zones)} zone{'' if len(self.zones) == 1 else 's'})"
 
-    sample_clock += frames
+#               - - End Of SampleInstrument Class --                #
 
+# --  create global sample instrument  -- #
+instrument = SampleInstrument()
 
-# *********************************************************************************************
-# Purpose:      Process midi events as they are happening
-# *********************************************************************************************
-def process_midi_event():
-    global out_keys, out_osc, synth
 
-    # wait and grab any message that comes in
-    mesg = keyboard.receive()
+# **********************************************************************************************
+#   * Class:            BufferPool
+#   * Purpose:          Scratch buffers the voice bank renders into, allocated once per stream
+#                       configuration so steady state rendering allocates nothing
+#   * Data Members:     voices              -> number of voices the buffers have room for
+#                       frames              -> number of samples the buffers have room for
+#                       ramp                -> 0, 1, 2, ... sample offsets within a block
+#                       steps               -> 0, 1, 2, ... sample offsets as table indexes
+#                       phase, wave, envelope, table, fraction, following, index
+#                                           -> (voices, frames) buffers for one block of every
+#                                              voice
+#                       modulation, slope   -> (voices, frames) buffers the control rate ramps
+#                                              are expanded in
+#                       increment, scale, row_value, row, limit, shape, rows, releasing,
+#                       ended, cutoff, step, frequency, flags, offset
+#                                           -> (voices) buffers holding one value per voice
+#                       points              -> 1, 2, 3, ... control point offsets within a block
+#                       semitones, level, shift, control, carrier, difference
+#                                           -> (voices, points) buffers the modulation matrix is
+#                                              summed in, one value per control point
+#                       ratio, gain, same   -> (voices, points + 1) buffers holding the
+#                                              modulation ramps of every voice
+#                       lfo                 -> (2, points) buffer the lfos are evaluated in
+#                       mix                 -> (frames) buffer holding the mixed block of one
+#                                              voice bank
+#                       output              -> (frames) buffer holding the mixed block of every
+#                                              part rendered with this pool
+# **********************************************************************************************
+class BufferPool:
+    # ******************************************************************************************
+    # Purpose:          BufferPool default constructor
+    # Parameters:       voices      -> number of voices to allocate room for
+    #                   frames      -> number of samples to allocate room for
+    # ******************************************************************************************
+    def __init__(self, voices, frames):
+        self.voices = voices
+        self.frames = frames
+        self.ramp = np.arange(frames, dtype=np.float64)
+        self.steps = np.arange(frames, dtype=np.intp)
+        self.phase = np.zeros((voices, frames), dtype=np.float64)
+        self.wave = np.zeros((voices, frames), dtype=np.float64)
+        self.envelope = np.zeros((voices, frames), dtype=np.float64)
+        self.table = np.zeros((voices, frames), dtype=np.float64)
+        self.fraction = np.zeros((voices, frames), dtype=np.float64)
+        self.following = np.zeros((voices, frames), dtype=np.float64)
+        self.index = np.zeros((voices, frames), dtype=np.intp)
+        self.modulation = np.zeros((voices, frames), dtype=np.float64)
+        self.slope = np.zeros((voices, frames), dtype=np.float64)
+        self.increment = np.zeros(voices, dtype=np.float64)
+        self.scale = np.zeros(voices, dtype=np.float64)
+        self.row_value = np.zeros(voices, dtype=np.float64)
+        self.row = np.zeros(voices, dtype=np.intp)
+        self.limit = np.zeros(voices, dtype=np.intp)
+        self.shape = np.zeros(voices, dtype=np.intp)
+        self.rows = np.zeros(voices, dtype=bool)
+        self.releasing = np.zeros(voices, dtype=bool)
+        self.ended = np.zeros(voices, dtype=bool)
+        self.cutoff = np.zeros(voices, dtype=np.float64)
+        self.step = np.zeros(voices, dtype=np.intp)
+        self.frequency = np.zeros(voices, dtype=np.float64)
+        self.flags = np.zeros(voices, dtype=bool)
+        self.offset = np.zeros(voices, dtype=np.float64)
+        points = -(-frames // CONTROL_RATE)
+        self.points = np.arange(1, points + 1, dtype=np.float64)
+        self.semitones = np.zeros((voices, points), dtype=np.float64)
+        self.level = np.zeros((voices, points), dtype=np.float64)
+        self.shift = np.zeros((voices, points), dtype=np.float64)
+        self.control = np.zeros((voices, points), dtype=np.float64)
+        self.carrier = np.zeros((voices, points), dtype=np.float64)
+        self.difference = np.zeros((voices, points), dtype=np.float64)
+        self.ratio = np.zeros((voices, points + 1), dtype=np.float64)
+        self.gain = np.zeros((voices, points + 1), dtype=np.float64)
+        self.same = np.zeros((voices, points + 1), dtype=bool)
+        self.lfo = np.zeros((2, points), dtype=np.float64)
+        self.mix = np.zeros(frames, dtype=np.float64)
+        self.output = np.zeros(frames, dtype=np.float64)
 
-    mesg_type = mesg.type
+#               - - End Of BufferPool Class --                #
 
-    # when a note is being pressed
-    #   add a note to the dictionary
-    if mesg_type == 'note_on':
-        key = mesg.note
-        velocity = mesg.velocity / 127
-        if synth.log is True: print('note on', key, mesg.velocity, round(velocity, 2))
-        out_keys[key] = Note(key, synth.osc_type)
 
-    # when a note is no longer being pressed
-    #   call its release method to end it
-    elif mesg_type == 'note_off':
-        key = mesg.note
-        velocity = round(mesg.velocity / 127, 2)
-        if synth.log is True: print('note off', key, mesg.velocity, velocity)
-        if key in out_keys:
-            out_keys[key].release()
-    
-    # for Virtual MIDI Piano Keyboard:
-    #   this is called 'bender' but it acts as a pitchwheel
-    elif mesg.type == 'pitchwheel':
-        pitch = round(mesg.pitch / 127, 2)
-        if synth.log is True: print('bender', mesg.pitch, pitch)
-    
-    elif mesg.type == 'control_change':
-        # for Virtual MIDI Piano Keyboard:
-        #   this is the 'Value' knob for the 'Control' dropdown
-        #   specifically when '7-Volume' is selected
-        if mesg.control == 7:
-            synth.volume = round(mesg.value / 127, 2)
-            if synth.log is True: print('volume', mesg.value, synth.volume)
-        
-        # for Virtual MIDI Piano Keyboard:
-        #   this is the 'soft' toggle button
-        elif mesg.control == 64:
-            if synth.sustain_toggle == True:
-                if synth.log is True: print("sustain_toggle off")
-                synth.sustain_toggle = False
+# **********************************************************************************************
+#   * Class:            VoiceBank
+#   * Purpose:          Fixed-capacity pool holding every active voice of one part as a set of
+#                       numpy arrays (one entry per voice) so a whole block can be rendered for
+#                       all voices in a few array ops instead of walking a python loop of Note
+#                       objects. At most synth.polyphony voices of every part together sound at
+#                       once, past that the mixer steals a voice of any part by
+#                       synth.steal_policy and fades it out, so the work per block has a hard
+#                       upper bound
+#   * Data Members:     part                -> Part the voices belong to, it supplies their
+#                                              envelope and volume
+#                       count               -> number of active voices, active voices are always
+#                                              packed into the first count entries
+#                       slots               -> dictionary mapping a held midi key to its voice
+#                       key                 -> midi key of each voice
+#                       started             -> serial number of each voice from the mixer, lower
+#                                              is older in every part
+#                       frequency           -> frequency of each voice
+#                       phase               -> phase accumulator of each voice in cycles,
+#                                              carried across blocks and wrapped into [0, 1),
+#                                              sample voices keep counting and are wrapped by
+#                                              the loop of their zone instead
+#                       osc                 -> oscillator id of each voice (see osc_ids)
+#                       zone                -> index of the sample zone of each sample voice in
+#                                              instrument.zones, -1 for the other voices
+#                       stage               -> envelope stage of each voice
+#                       env_index           -> position of each voice in the envelope table at
+#                                              the start of the next block
+#                       env_end             -> position each released or faded voice ends at
+#                       env_scale           -> gain the envelope table is scaled by for each
+#                                              voice, the level a release or fade started from
+#                       gain                -> output gain of each voice
+#                       velocity            -> velocity of each voice, from 0 to 1
+#                       filter_state        -> (voices, 2) state of the filter of each voice,
+#                                              carried across blocks
+#                       mod_ratio           -> pitch ratio the modulation ramp of each voice
+#                                              reached at the end of the last block, nan for a
+#                                              voice that has not rendered yet
+#                       mod_gain            -> gain the modulation ramp of each voice reached at
+#                                              the end of the last block, nan likewise
+#                       bent, gained        -> whether any voice ended the last block with its
+#                                              pitch or its gain away from 1
+#                       fresh               -> whether any voice has not rendered yet
+# **********************************************************************************************
+class VoiceBank:
+    # ******************************************************************************************
+    # Purpose:          VoiceBank default constructor
+    # Parameters:       part        -> Part the voices belong to
+    #                   capacity    -> number of voices to allocate room for, never grown
+    # ******************************************************************************************
+    def __init__(self, part, capacity=VOICE_CAPACITY):
+        self.part = part
+        self.count = 0
+        self.slots = dict()
+        self.key = np.zeros(capacity, dtype=np.int16)
+        self.started = np.zeros(capacity, dtype=np.int64)
+        self.frequency = np.zeros(capacity, dtype=np.float64)
+        self.phase = np.zeros(capacity, dtype=np.float64)
+        self.osc = np.zeros(capacity, dtype=np.int8)
+        self.zone = np.full(capacity, -1, dtype=np.int32)
+        self.stage = np.zeros(capacity, dtype=np.int8)
+        self.env_index = np.zeros(capacity, dtype=np.intp)
+        self.env_end = np.zeros(capacity, dtype=np.intp)
+        self.env_scale = np.zeros(capacity, dtype=np.float64)
+        self.gain = np.ones(capacity, dtype=np.float64)
+        self.velocity = np.ones(capacity, dtype=np.float64)
+        self.filter_state = np.zeros((capacity, 2), dtype=np.float64)
+        self.mod_ratio = np.ones(capacity, dtype=np.float64)
+        self.mod_gain = np.ones(capacity, dtype=np.float64)
+        self.bent = False
+        self.gained = False
+        self.fresh = False
+
+    # ******************************************************************************************
+    # Purpose:          Start a voice for a note. A key that is already held lets its old voice
+    #                   ring out through its release, and when polyphony has run out the mixer
+    #                   steals a voice of some part first
+    # Parameters:       note        -> Note object holding the data of the new voice
+    # ******************************************************************************************
+    def note_on(self, note):
+        osc = osc_ids.get(note.osc_type, osc_ids['saw'])
+        zone = -1
+        if osc == osc_ids['sample']:
+            # a note no sample zone plays stays silent, like on a hardware sampler
+            zone = instrument.find(note.key, note.velocity)
+            if zone < 0:
+                return
+        self.note_off(note.key)
+
+        if self.count == len(self.key):
+            # every spare entry is fading, cut the fade closest to its end
+            fading = np.flatnonzero(self.stage[:self.count] == STAGE_FADE)
+            self.remove(fading[np.argmax(self.env_index[fading])])
+        mixer.make_room(self, note.key)
+
+        slot = self.count
+        self.count += 1
+        self.slots[note.key] = slot
+        mixer.serial += 1
+
+        self.key[slot] = note.key
+        self.started[slot] = mixer.serial
+        self.frequency[slot] = note.frequency
+        self.phase[slot] = 0.0
+        self.osc[slot] = osc
+        self.zone[slot] = zone
+        self.stage[slot] = STAGE_HELD
+        self.env_index[slot] = 0
+        self.env_scale[slot] = 1.0
+        self.gain[slot] = 1.0
+        self.velocity[slot] = note.velocity
+        self.filter_state[slot] = 0.0
+        self.mod_ratio[slot] = np.nan
+        self.mod_gain[slot] = np.nan
+        self.fresh = True
+
+    # ******************************************************************************************
+    # Purpose:          Move the held voice of a key into its release stage, the release starts
+    #                   from whatever level the envelope has reached
+    # Parameters:       key         -> midi key of the voice to release
+    # ******************************************************************************************
+    def note_off(self, key):
+        slot = self.slots.pop(key, None)
+        if slot is None:
+            return
+        table, sustain_at, release_end, fade_end = self.part.envelope()
+        self.env_scale[slot] = self.level(slot)
+        self.env_index[slot] = sustain_at + 1
+        self.env_end[slot] = release_end
+        self.stage[slot] = STAGE_RELEASE
+
+    # ******************************************************************************************
+    # Purpose:          Current envelope level of a voice
+    # Parameters:       slot        -> entry of the voice
+    # Returns:          {float}     -> the level
+    # ******************************************************************************************
+    def level(self, slot):
+        table, sustain_at, release_end, fade_end = self.part.envelope()
+        limit = sustain_at if self.stage[slot] == STAGE_HELD else self.env_end[slot]
+        index = min(int(self.env_index[slot]), int(limit), len(table) - 1)
+        return self.env_scale[slot] * table[index]
+
+    # ******************************************************************************************
+    # Purpose:          Number of voices that count against polyphony, every voice that is not
+    #                   already fading out
+    # ******************************************************************************************
+    def sounding(self):
+        if self.count == 0:
+            return 0
+        return int(np.count_nonzero(self.stage[:self.count] != STAGE_FADE))
+
+    # ******************************************************************************************
+    # Purpose:          Voice of this part synth.steal_policy would steal first
+    # Parameters:       key         -> only consider the voices of this midi key, every key
+    #                                  when None
+    # Returns:          {tuple}     -> (score, slot) of the voice, the lowest score across the
+    #                                  parts is stolen, None when no voice can be
+    # ******************************************************************************************
+    def victim(self, key=None):
+        count = self.count
+        candidates = self.stage[:count] != STAGE_FADE
+        if key is not None:
+            candidates &= self.key[:count] == key
+        slots = np.flatnonzero(candidates)
+        if len(slots) == 0:
+            return None
+
+        if synth.steal_policy == 'quietest':
+            # a held voice counts as at least its sustain level so fresh attacks are spared
+            table, sustain_at, release_end, fade_end = self.part.envelope()
+            levels = [self.level(slot) if self.stage[slot] != STAGE_HELD
+                      else max(self.level(slot), table[sustain_at] * self.env_scale[slot])
+                      for slot in slots]
+            scores = np.array(levels) * self.gain[slots]
+        else:
+            scores = self.started[slots]
+        index = np.argmin(scores)
+        return float(scores[index]), int(slots[index])
+
+    # ******************************************************************************************
+    # Purpose:          Start the short fade out of a stolen voice from its current level
+    # Parameters:       slot        -> entry of the voice to fade
+    # ******************************************************************************************
+    def fade(self, slot):
+        key = int(self.key[slot])
+        if self.slots.get(key) == slot:
+            del self.slots[key]
+        table, sustain_at, release_end, fade_end = self.part.envelope()
+        self.env_scale[slot] = self.level(slot)
+        self.env_index[slot] = release_end + 1
+        self.env_end[slot] = fade_end
+        self.stage[slot] = STAGE_FADE
+
+    # ******************************************************************************************
+    # Purpose:          Silence and drop every voice at once
+    # ******************************************************************************************
+    def clear(self):
+        self.count = 0
+        self.slots.clear()
+
+    # ******************************************************************************************
+    # Purpose:          Remove a voice by moving the last active voice into its entry
+    # Parameters:       slot        -> entry of the voice to remove
+    # ******************************************************************************************
+    def remove(self, slot):
+        last = self.count - 1
+        key = int(self.key[slot])
+        if self.slots.get(key) == slot:
+            del self.slots[key]
+        if slot != last:
+            for array in (self.key, self.started, self.frequency, self.phase, self.osc,
+                          self.zone, self.stage, self.env_index, self.env_end, self.env_scale,
+                          self.gain, self.velocity, self.filter_state, self.mod_ratio,
+                          self.mod_gain):
+                array[slot] = array[last]
+            key = int(self.key[slot])
+            if self.slots.get(key) == last:
+                self.slots[key] = int(slot)
+        self.count = last
+
+    # ******************************************************************************************
+    # Purpose:          Render one block of every active voice and mix them together, every
+    #                   intermediate result is written in place into the buffer pool
+    # Parameters:       frames      -> number of samples to render
+    #                   out         -> numpy array the mixed block is added into
+    #                   pool        -> BufferPool with room for the voices and the block
+    #                   clock       -> sample time of the start of the block
+    # ******************************************************************************************
+    def render(self, frames, out, pool, clock=0):
+        count = self.count
+        if count == 0:
+            return
+        ramp = pool.ramp[:frames]
+        ratio, gain, cutoff = self.modulate(frames, clock, pool)
+
+        # oscillators, each voice's phase accumulator is advanced by its frequency in cycles
+        # per sample
+        increment = pool.increment[:count]
+        np.divide(self.frequency[:count], synth.sample_rate, out=increment)
+        start = self.phase[:count]
+        phase = pool.phase[:count, :frames]
+        frequency = self.frequency[:count]
+        if ratio is not None:
+            frequency = pool.frequency[:count]
+            np.multiply(self.frequency[:count], ratio[:, -1], out=frequency)
+            self.mod_ratio[:count] = ratio[:, -1]
+            self.bent = bool(np.not_equal(ratio[:, -1], 1.0, out=pool.flags[:count]).any())
+            # a pitch that holds still over the block only scales the increments
+            if np.equal(ratio, ratio[:, :1], out=pool.same[:count, :ratio.shape[1]]).all():
+                increment *= ratio[:, 0]
+                ratio = None
+        if ratio is None:
+            np.multiply(increment[:, None], ramp, out=phase)
+            phase += start[:, None]
+            increment *= frames
+            start += increment
+        else:
+            # modulated pitch, the phase is the running sum of the ramped increments
+            bend = pool.modulation[:count, :frames]
+            expand_controls(ratio, frames, bend, pool.slope[:count, :frames],
+                            pool.difference[:count, :ratio.shape[1] - 1])
+            self.mod_ratio[:count] = bend[:, frames - 1]
+            np.multiply(bend, increment[:, None], out=phase)
+            np.cumsum(phase, axis=1, out=bend)
+            np.subtract(bend, phase, out=phase)
+            phase += start[:, None]
+            start += bend[:, frames - 1]
+        osc = self.osc[:count]
+        low = osc.min()
+        high = osc.max()
+        if high == osc_ids['sample']:
+            # sample voices keep counting, the loops of their zones wrap them instead
+            cycling = pool.rows[:count]
+            np.not_equal(osc, osc_ids['sample'], out=cycling)
+            np.remainder(start, 1.0, out=start, where=cycling)
+        else:
+            np.remainder(start, 1.0, out=start)
+
+        # one batched op per oscillator type in use, masked when voices use different types
+        waves = pool.wave[:count, :frames]
+        ended = None
+        for osc_id in range(low, high + 1):
+            if low == high:
+                rows = True
             else:
-                if synth.log is True: print("sustain_toggle on")
-                synth.sustain_toggle = True
+                rows = pool.rows[:count]
+                np.equal(osc, osc_id, out=rows)
+                if not rows.any():
+                    continue
+                rows = rows[:, None]
 
-        # for Virtual MIDI Piano Keyboard:
-        #   this is the 'soft' toggle button
-        elif mesg.control == 67:
-            if synth.soft_toggle == True:
-                if synth.log is True: print("soft_toggle off")
-                synth.soft_toggle = False
+            if osc_id == osc_ids['sample']:
+                ended = self.sample(phase, waves, count, pool)
+            elif osc_id >= WAVETABLE_FIRST:
+                shape = pool.shape[:count]
+                np.subtract(osc, WAVETABLE_FIRST, out=shape, casting='unsafe')
+                np.clip(shape, 0, osc_ids['sample'] - WAVETABLE_FIRST - 1, out=shape)
+                if rows is True:
+                    wavetable_wave(phase, frequency, shape, waves, pool)
+                else:
+                    table = pool.table[:count, :frames]
+                    wavetable_wave(phase, frequency, shape, table, pool)
+                    np.copyto(waves, table, where=rows)
+            elif osc_id == osc_ids['sine']:
+                sine_wave(phase, waves, rows)
+            elif osc_id == osc_ids['square']:
+                square_wave(phase, waves, rows)
             else:
-                if synth.log is True: print("soft_toggle on")
-                synth.soft_toggle = True
+                saw_wave(phase, waves, rows)
 
-        # for Virtual MIDI Piano Keyboard: 
-        #   this is the stop button (aka 'panic' button)
-        elif mesg.control == 123:
-            print("Panic No Longer!")
-            return False
+        if synth.filter_type != 'off':
+            self.filter(waves, count, pool, cutoff)
 
-    else:
-        print('unknown MIDI message', mesg)
-    return True
+        # envelopes, every voice reads its stretch of the shared adsr table, held voices stop
+        # on the sustain sample and released or faded voices run on to their silent end
+        table, sustain_at, release_end, fade_end = self.part.envelope()
+        releasing = pool.releasing[:count]
+        np.not_equal(self.stage[:count], STAGE_HELD, out=releasing)
+        limit = pool.limit[:count]
+        limit.fill(sustain_at)
+        np.copyto(limit, self.env_end[:count], where=releasing)
+        position = self.env_index[:count]
+        index = pool.index[:count, :frames]
+        np.add(position[:, None], pool.steps[:frames], out=index)
+        np.minimum(index, limit[:, None], out=index)
+        envelope = pool.envelope[:count, :frames]
+        table.take(index, out=envelope, mode='clip')
+        scale = pool.scale[:count]
+        np.multiply(self.env_scale[:count], self.gain[:count], out=scale)
+        if gain is not None:
+            self.gained = bool(np.not_equal(gain[:, -1], 1.0, out=pool.flags[:count]).any())
+            if np.equal(gain, gain[:, :1], out=pool.same[:count, :gain.shape[1]]).all():
+                # a gain that holds still over the block joins the per voice scale
+                scale *= gain[:, 0]
+                self.mod_gain[:count] = gain[:, 0]
+                gain = None
+        envelope *= scale[:, None]
+        if gain is not None:
+            level = pool.modulation[:count, :frames]
+            expand_controls(gain, frames, level, pool.slope[:count, :frames],
+                            pool.difference[:count, :gain.shape[1] - 1])
+            self.mod_gain[:count] = level[:, frames - 1]
+            envelope *= level
 
+        waves *= envelope
+        mix = pool.mix[:frames]
+        np.add.reduce(waves, axis=0, out=mix)
+        out += mix
 
-# ***************************************************************************
-#   Main function for calling methods and printing results
-# ***************************************************************************
-synth.startup_display()
-synth.current_setup()
-
-# output stream setup
-output_stream = sounddevice.OutputStream(
-    samplerate=synth.sample_rate,
-    channels=1,
-    blocksize=synth.block_size,
-    callback=output_callback,
-)
-output_stream.start()
-
-run = True
-while run is True:
-    print("Would you like to:")
-    print("\t1 - start synth")
-    print("\t2 - check synth configuration")
-    print("\t3 - change synth configuration")
-    print("\t4 - exit program")
-    option = int(input("Enter the number of the desired option: "))
-
-    if option == 1:
-        while process_midi_event():
+        # advance the envelopes and drop voices whose release has finished
+        position += frames
+        np.minimum(position, limit, out=position)
+        done = pool.rows[:count]
+        np.greater_equal(position, limit, out=done)
+        done &= releasing
+        if ended is not None:
+            done |= ended
+        if done.any():
+            for slot in np.flatnonzero(done)[::-1]:
+                self.remove(slot)
+
+    # ******************************************************************************************
+    # Purpose:          Read one block of every sample voice from the zone it plays. The phase
+    #                   of a sample voice counts cycles of its frequency, so scaling it by the
+    #                   speed of the zone gives the position in the sample and pitch changes and
+    #                   modulation resample it for free. Voices sharing a zone are read together
+    # Parameters:       phase       -> (count, frames) phase of every voice over the block
+    #                   waves       -> (count, frames) buffer the sample voices are written to
+    #                   count       -> number of active voices
+    #                   pool        -> BufferPool with room for the voices
+    # Returns:          ended       -> (count) whether each voice reached the end of a sample
+    #                                  without a loop
+    # ******************************************************************************************
+    def sample(self, phase, waves, count, pool):
+        zones = instrument.zones
+        zone = self.zone[:count]
+        start = self.phase[:count]
+        ended = pool.ended[:count]
+        ended.fill(False)
+        for index in np.unique(zone):
+            if index < 0:
+                continue
+            voices = np.flatnonzero(zone == index)
+            if index >= len(zones):
+                # the instrument was replaced while the voice was playing
+                waves[voices] = 0.0
+                ended[voices] = True
+                continue
+            sample = zones[index]
+            waves[voices] = sample.read(phase[voices] * sample.speed)
+
+            # carry the position into the next block, wrapped back into the loop
+            position = start[voices] * sample.speed
+            if sample.loop is None:
+                ended[voices] = position >= sample.length - 1
+            else:
+                first, end = sample.loop
+                past = position >= end
+                if past.any():
+                    position = position[past]
+                    start[voices[past]] = (first + np.remainder(position - first, end - first)) \
+                        / sample.speed
+        return ended
+
+    # ******************************************************************************************
+    # Purpose:          Evaluate the modulation matrix at the control points of a block, one
+    #                   every CONTROL_RATE samples from the start of the block. Each voice ramps
+    #                   from the value it reached at the end of the last block towards the
+    #                   points, so a change of any source is spread over CONTROL_RATE samples.
+    #                   Routes are summed in place into the buffer pool
+    # Parameters:       frames      -> number of samples in the block
+    #                   clock       -> sample time of the start of the block
+    #                   pool        -> BufferPool with room for the voices and the block
+    # Returns:          ratio       -> (count, points + 1) pitch ratios starting with the value
+    #                                  each voice reached, None when no voice is bent
+    #                   gain        -> (count, points + 1) gains likewise, None when every
+    #                                  gain stays at 1
+    #                   cutoff      -> (count) octaves added to the filter cutoffs at the end of
+    #                                  the block, None when no route reaches the cutoff
+    # ******************************************************************************************
+    def modulate(self, frames, clock, pool):
+        count = self.count
+        points = -(-frames // CONTROL_RATE)
+        semitones = 0.0
+        gain = 1.0
+        cutoff = 0.0
+        shifted = False
+        control = pool.control[:count, :points]
+
+        # sources that hold still over the block stay scalars or one value per voice, only the
+        # lfos are evaluated at every control point
+        for source, destination, amount, via in modulation_routes:
+            scale = amount
+            if via is not None:
+                carrier = self.mod_source(via, count, clock, points, pool, 1)
+                if isinstance(carrier, float):
+                    scale = amount * carrier
+                else:
+                    scale = pool.carrier[:count, :points]
+                    np.multiply(carrier, amount, out=scale)
+            if isinstance(scale, float) and scale == 0.0:
+                continue
+            value = self.mod_source(source, count, clock, points, pool, 0)
+
+            # 1 - scale * (1 - source) for the gain, so a route scaled to nothing is neutral
+            if isinstance(value, float) and isinstance(scale, float):
+                term = 1.0 - scale * (1.0 - value) if destination == 'amp' else scale * value
+            elif destination == 'amp':
+                np.subtract(1.0, value, out=control)
+                control *= scale
+                np.subtract(1.0, control, out=control)
+                term = control
+            else:
+                np.multiply(value, scale, out=control)
+                term = control
+
+            if destination == 'pitch':
+                semitones = combine_controls(semitones, term, pool.semitones[:count, :points],
+                                             np.add)
+            elif destination == 'amp':
+                gain = combine_controls(gain, term, pool.level[:count, :points], np.multiply)
+            elif destination == 'cutoff':
+                cutoff = combine_controls(cutoff, term, pool.shift[:count, :points], np.add)
+                shifted = True
+
+        ratio = None
+        if isinstance(semitones, np.ndarray):
+            moving = semitones.any()
+        else:
+            moving = semitones != 0.0
+        if self.bent or moving:
+            ratio = pool.ratio[:count, :points + 1]
+            np.divide(semitones, 12, out=ratio[:, 1:])
+            np.exp2(ratio[:, 1:], out=ratio[:, 1:])
+            ratio[:, 0] = self.mod_ratio[:count]
+        if isinstance(gain, np.ndarray):
+            changed = np.not_equal(gain, 1.0, out=pool.same[:count, :points]).any()
+        else:
+            changed = gain != 1.0
+        if self.gained or changed:
+            values = pool.gain[:count, :points + 1]
+            values[:, 1:] = gain
+            values[:, 0] = self.mod_gain[:count]
+            gain = values
+        else:
+            gain = None
+        if not shifted:
+            cutoff = None
+        elif isinstance(cutoff, np.ndarray):
+            cutoff = cutoff[:, -1]
+        else:
+            offset = pool.offset[:count]
+            offset.fill(cutoff)
+            cutoff = offset
+
+        # new voices start right on their targets, or on no modulation at all
+        if self.fresh:
+            for values, carried in ((ratio, self.mod_ratio), (gain, self.mod_gain)):
+                if values is None:
+                    np.nan_to_num(carried[:count], copy=False, nan=1.0)
+                else:
+                    fresh = pool.flags[:count]
+                    np.isnan(values[:, 0], out=fresh)
+                    np.copyto(values[:, 0], values[:, 1], where=fresh)
+            self.fresh = False
+        return ratio, gain, cutoff
+
+    # ******************************************************************************************
+    # Purpose:          Value of a modulation source over a block
+    # Parameters:       source      -> name of the source, see MOD_SOURCES
+    #                   count       -> number of active voices
+    #                   clock       -> sample time of the start of the block
+    #                   points      -> number of control points in the block
+    #                   pool        -> BufferPool the lfos are evaluated in
+    #                   row         -> row of the pool lfo buffer to use, so a route can read
+    #                                  two lfos at once
+    # Returns:          {float or numpy array}  -> value broadcastable to (count, points)
+    # ******************************************************************************************
+    def mod_source(self, source, count, clock, points, pool, row):
+        if source == 'velocity':
+            return self.velocity[:count, None]
+        elif source == 'bend':
+            return self.part.bend
+        elif source == 'volume':
+            return self.part.volume
+        elif source == 'modwheel':
+            return self.part.modwheel
+        elif source in ('lfo1', 'lfo2'):
+            rate = synth.lfo1_rate if source == 'lfo1' else synth.lfo2_rate
+            position = pool.lfo[row, :points]
+            np.multiply(pool.points[:points], CONTROL_RATE, out=position)
+            position += clock
+            position *= rate / synth.sample_rate
+            np.remainder(position, 1.0, out=position)
+            if source == 'lfo1':
+                position *= 2 * np.pi
+                return np.sin(position, out=position)
+            position -= 0.5
+            np.abs(position, out=position)
+            position *= 4.0
+            return np.subtract(1.0, position, out=position)
+        return 0.0
+
+    # ******************************************************************************************
+    # Purpose:          Run one block of every voice through its resonant filter. Cutoffs follow
+    #                   the velocity of each voice and the filter cc of the part and are
+    #                   quantized to FILTER_STEPS per octave, the voices sharing a step are
+    #                   filtered together in one lfilter call with their state carried in and
+    #                   out, so the calls grow with the number of distinct cutoffs instead of
+    #                   with the number of voices
+    # Parameters:       waves       -> (count, frames) block of the voices, filtered in place
+    #                   count       -> number of active voices
+    #                   pool        -> BufferPool with room for the voices
+    #                   offset      -> octaves the modulation matrix moves each cutoff by, or
+    #                                  None
+    # ******************************************************************************************
+    def filter(self, waves, count, pool, offset=None):
+        from scipy.signal import lfilter
+
+        # cutoff of each voice in octaves above FILTER_LOWEST
+        cutoff = pool.cutoff[:count]
+        np.subtract(self.velocity[:count], 1.0, out=cutoff)
+        cutoff *= synth.filter_velocity
+        cutoff += np.log2(synth.filter_cutoff / FILTER_LOWEST)
+        cutoff += FILTER_CC_OCTAVES * (2.0 * self.part.brightness - 1.0)
+        if offset is not None:
+            cutoff += offset
+        cutoff *= FILTER_STEPS
+        highest = int(np.log2(0.45 * synth.sample_rate / FILTER_LOWEST) * FILTER_STEPS)
+        np.clip(cutoff, 0, highest, out=cutoff)
+        step = pool.step[:count]
+        np.rint(cutoff, out=cutoff)
+        step[:] = cutoff
+
+        state = self.filter_state[:count]
+        low = step.min()
+        if low == step.max():
+            b, a = filter_coefficients(int(low), synth.filter_resonance, synth.filter_type,
+                                       synth.sample_rate)
+            waves[:], state[:] = lfilter(b, a, waves, axis=1, zi=state)
+            return
+
+        for value in np.unique(step):
+            rows = np.flatnonzero(step == value)
+            b, a = filter_coefficients(int(value), synth.filter_resonance, synth.filter_type,
+                                       synth.sample_rate)
+            waves[rows], state[rows] = lfilter(b, a, waves[rows], axis=1, zi=state[rows])
+
+#               - - End Of VoiceBank Class --                #
+
+
+# **********************************************************************************************
+#   * Class:            Part
+#   * Purpose:          One of the MIDI_CHANNELS independent parts of the synth, every midi
+#                       channel plays its own part with its own oscillator, envelope, volume and
+#                       voice bank
+#   * Data Members:     channel             -> midi channel of the part, 0 to 15
+#                       osc_type            -> oscillator type of the part, None follows
+#                                              synth.osc_type
+#                       adsr                -> (attack, decay, sustain, release) of the part,
+#                                              shaped by envelope_curve, None follows the
+#                                              envelope globals
+#                       volume              -> output gain of the part, set by cc 7
+#                       brightness          -> position of the filter cc of the part, from 0 to
+#                                              1, the middle leaves the cutoff where it is
+#                       bend                -> pitch wheel of the part, from -1 to 1
+#                       modwheel            -> mod wheel (cc 1) of the part, from 0 to 1
+#                       voices              -> VoiceBank holding the active voices of the part
+# **********************************************************************************************
+class Part:
+    # ******************************************************************************************
+    # Purpose:          Part default constructor
+    # Parameters:       channel     -> midi channel of the part
+    # ******************************************************************************************
+    def __init__(self, channel):
+        self.channel = channel
+        self.osc_type = None
+        self.adsr = None
+        self.volume = 1.0
+        self.brightness = 0.5
+        self.bend = 0.0
+        self.modwheel = 0.0
+        self.voices = VoiceBank(self)
+
+    # ******************************************************************************************
+    # Purpose:          Oscillator type new notes of the part start with
+    # ******************************************************************************************
+    def oscillator(self):
+        return synth.osc_type if self.osc_type is None else self.osc_type
+
+    # ******************************************************************************************
+    # Purpose:          Envelope table of the part
+    # Returns:          {tuple}     -> table, sustain_at, release_end and fade_end, see
+    #                                  envelope_table
+    # ******************************************************************************************
+    def envelope(self):
+        if self.adsr is None:
+            return current_envelope()
+        return envelope_table(*self.adsr, envelope_curve, synth.sample_rate)
+
+    # ******************************************************************************************
+    # Purpose:          Drop the settings of the part so it follows the synth again
+    # ******************************************************************************************
+    def reset(self):
+        self.osc_type = None
+        self.adsr = None
+        self.volume = 1.0
+        self.brightness = 0.5
+        self.bend = 0.0
+        self.modwheel = 0.0
+
+#               - - End Of Part Class --                #
+
+# --  create global parts, one per midi channel  -- #
+parts = [Part(channel) for channel in range(MIDI_CHANNELS)]
+
+
+# **********************************************************************************************
+#   * Class:            MixerLayout
+#   * Purpose:          Worker threads and scratch buffers the part mixer renders with, built
+#                       whole and swapped into the mixer with one assignment so the audio thread
+#                       always sees a layout that belongs together
+#   * Data Members:     threads             -> number of groups rendered at once, 1 renders
+#                                              every part inline
+#                       executor            -> ThreadPoolExecutor of the worker threads, None
+#                                              when rendering inline
+#                       pools               -> one BufferPool per group, sized for the voice
+#                                              capacity and the largest block of the stream
+#                                              configuration
+#                       groups              -> list of the parts each group renders
+#                       loads               -> number of voices each group renders
+# **********************************************************************************************
+class MixerLayout:
+    # ******************************************************************************************
+    # Purpose:          MixerLayout default constructor
+    # Parameters:       threads     -> number of groups to render at once
+    #                   frames      -> largest block to allocate the buffer pools for
+    #                   executor    -> executor to share with an older layout, a new one is
+    #                                  started when None
+    # ******************************************************************************************
+    def __init__(self, threads, frames, executor=None):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.threads = max(1, threads)
+        if executor is None and self.threads > 1:
+            executor = ThreadPoolExecutor(self.threads, thread_name_prefix='part')
+        self.executor = executor
+        self.pools = [BufferPool(VOICE_CAPACITY, frames) for group in range(self.threads)]
+        self.groups = [[] for group in range(self.threads)]
+        self.loads = [0] * self.threads
+
+#               - - End Of MixerLayout Class --                #
+
+
+# **********************************************************************************************
+#   * Class:            PartMixer
+#   * Purpose:          Renders the parts and sums them into the output. When more than one part
+#                       is playing and the block holds enough work, the playing parts are split
+#                       into groups of about the same number of voices and every group renders
+#                       on a worker thread with its own buffer pool, numpy releases the gil
+#                       during the large array ops so the groups run on separate cores. Small
+#                       blocks render inline since handing them to a thread costs more than it
+#                       saves
+#   * Data Members:     layout              -> MixerLayout currently rendered with, only ever
+#                                              replaced whole
+#                       entered             -> number of renders started
+#                       left                -> number of renders finished, a layout replaced
+#                                              once left catches up with entered can no longer
+#                                              be in use
+#                       lock                -> serializes replacing the layout, so a resize on
+#                                              the audio thread never puts back a layout whose
+#                                              worker threads are being shut down
+#                       serial              -> number of voices started so far in every part
+# **********************************************************************************************
+class PartMixer:
+    # ******************************************************************************************
+    # Purpose:          PartMixer default constructor
+    # ******************************************************************************************
+    def __init__(self):
+        self.layout = MixerLayout(1, 0)
+        self.entered = 0
+        self.left = 0
+        self.lock = threading.Lock()
+        self.serial = 0
+
+    # ******************************************************************************************
+    # Purpose:          Number of groups rendered at once
+    # ******************************************************************************************
+    @property
+    def threads(self):
+        return self.layout.threads
+
+    # ******************************************************************************************
+    # Purpose:          Change the number of worker threads, safe while the stream is rendering.
+    #                   The new layout is built aside and swapped in, and the old worker threads
+    #                   are only shut down once every render that could still see them is done
+    # Parameters:       threads     -> number of groups to render at once
+    # ******************************************************************************************
+    def configure(self, threads):
+        with self.lock:
+            old = self.layout
+            self.layout = MixerLayout(threads, old.pools[0].frames, None)
+            target = self.entered
+        while self.left < target:
+            time.sleep(0.001)
+        if old.executor is not None:
+            old.executor.shutdown()
+
+    # ******************************************************************************************
+    # Purpose:          Preallocate the render scratch buffers for a stream configuration, so
+    #                   rendering blocks of up to frames samples never allocates
+    # Parameters:       frames      -> largest block the stream will render
+    # ******************************************************************************************
+    def prepare(self, frames):
+        with self.lock:
+            layout = self.layout
+            if frames > layout.pools[0].frames:
+                self.layout = MixerLayout(layout.threads, frames, layout.executor)
+
+    # ******************************************************************************************
+    # Purpose:          Number of voices sounding in every part together
+    # ******************************************************************************************
+    def active_voices(self):
+        count = 0
+        for part in parts:
+            count += part.voices.count
+        return count
+
+    # ******************************************************************************************
+    # Purpose:          Hold the voices of every part together to synth.polyphony, when a new
+    #                   voice would go past it a voice is picked by synth.steal_policy from
+    #                   whichever part holds it and faded out. same-key first looks for the key
+    #                   in the part of the new note and otherwise steals the oldest voice
+    # Parameters:       bank        -> VoiceBank the new voice starts in
+    #                   key         -> midi key of the new voice
+    # ******************************************************************************************
+    def make_room(self, bank, key):
+        sounding = 0
+        for part in parts:
+            sounding += part.voices.sounding()
+        if sounding < max(1, synth.polyphony):
+            return
+
+        choice = None
+        owner = bank
+        if synth.steal_policy == 'same-key':
+            choice = bank.victim(key)
+        if choice is None:
+            for part in parts:
+                candidate = part.voices.victim()
+                if candidate is not None and (choice is None or candidate[0] < choice[0]):
+                    choice = candidate
+                    owner = part.voices
+        if choice is not None:
+            owner.fade(choice[1])
+
+    # ******************************************************************************************
+    # Purpose:          Move every held voice of every part into its release stage, as if every
+    #                   key still down were let go
+    # ******************************************************************************************
+    def release(self):
+        for part in parts:
+            for key in list(part.voices.slots):
+                part.voices.note_off(key)
+
+    # ******************************************************************************************
+    # Purpose:          Longest time a released or stolen voice of any part can still sound
+    # Returns:          {int}       -> number of samples
+    # ******************************************************************************************
+    def release_tail(self):
+        tail = 0
+        for part in parts:
+            table, sustain_at, release_end, fade_end = part.envelope()
+            tail = max(tail, fade_end - sustain_at)
+        return tail
+
+    # ******************************************************************************************
+    # Purpose:          Silence and drop every voice of every part at once
+    # ******************************************************************************************
+    def clear(self):
+        for part in parts:
+            part.voices.clear()
+
+    # ******************************************************************************************
+    # Purpose:          Render one block of every part and add it into the output
+    # Parameters:       frames      -> number of samples to render
+    #                   out         -> numpy array the mixed block is added into
+    #                   clock       -> sample time of the start of the block
+    # ******************************************************************************************
+    def render(self, frames, out, clock=0):
+        self.entered += 1
+        try:
+            if frames > self.layout.pools[0].frames:
+                self.prepare(frames)
+            self.render_layout(self.layout, frames, out, clock)
+        finally:
+            self.left += 1
+
+    # ******************************************************************************************
+    # Purpose:          Render one block with one layout, read once so a layout swapped in by
+    #                   another thread never mixes with the one in use
+    # Parameters:       layout      -> MixerLayout to render with
+    #                   frames      -> number of samples to render
+    #                   out         -> numpy array the mixed block is added into
+    #                   clock       -> sample time of the start of the block
+    # ******************************************************************************************
+    def render_layout(self, layout, frames, out, clock):
+        # spread the playing parts over the groups, each part onto the idlest group
+        groups = layout.groups
+        loads = layout.loads
+        for group in range(len(groups)):
+            groups[group].clear()
+            loads[group] = 0
+        playing = 0
+        for part in parts:
+            if part.voices.count:
+                group = loads.index(min(loads))
+                groups[group].append(part)
+                loads[group] += part.voices.count
+                playing += 1
+
+        if layout.executor is None or playing < 2 or sum(loads) * frames < THREAD_WORK:
+            pool = layout.pools[0]
+            for group in groups:
+                for part in group:
+                    part.voices.render(frames, out, pool, clock)
+            return
+
+        busy = [group for group in range(len(groups)) if groups[group]]
+        for group in layout.executor.map(self.render_group, [layout] * len(busy), busy,
+                                         [frames] * len(busy), [clock] * len(busy)):
+            out += layout.pools[group].output[:frames]
+
+    # ******************************************************************************************
+    # Purpose:          Render the parts of one group into the output buffer of its pool, run
+    #                   on a worker thread
+    # Parameters:       layout      -> MixerLayout the group belongs to
+    #                   group       -> index of the group
+    #                   frames      -> number of samples to render
+    #                   clock       -> sample time of the start of the block
+    # Returns:          group       -> index of the group
+    # ******************************************************************************************
+    def render_group(self, layout, group, frames, clock):
+        pool = layout.pools[group]
+        output = pool.output[:frames]
+        output.fill(0.0)
+        for part in layout.groups[group]:
+            part.voices.render(frames, output, pool, clock)
+        return group
+
+#               - - End Of PartMixer Class --                #
+
+# --  create global part mixer  -- #
+mixer = PartMixer()
+
+
+# *********************************************************************************************
+# Purpose:      Describe the parts that have settings of their own
+# Returns:      {str}           -> one entry per such part, or a note that every part follows
+#                                  the synth
+# *********************************************************************************************
+def part_summary():
+    entries = []
+    for part in parts:
+        if part.osc_type is not None or part.adsr is not None:
+            adsr = 'synth envelope' if part.adsr is None else 'adsr ' + ' '.join(
+                f"{value:g}" for value in part.adsr[:4])
+            entries.append(f"ch {part.channel + 1} {part.oscillator()} {adsr}")
+    if not entries:
+        return "every channel follows the synth"
+    return ', '.join(entries)
+
+
+# *********************************************************************************************
+# Purpose:      Describe the synth envelope
+# Returns:      {str}           -> the adsr values and the curve
+# *********************************************************************************************
+def envelope_summary():
+    return f"adsr {attack:g} {decay:g} {sustain:g} {release:g}, {envelope_curve}"
+
+
+# *********************************************************************************************
+# Purpose:      Describe the routes of the modulation matrix
+# Returns:      {str}           -> one entry per route
+# *********************************************************************************************
+def route_summary():
+    if not modulation_routes:
+        return "no routes"
+    return ', '.join(f"{source}{'' if via is None else ' x ' + via} -> {destination} {amount:g}"
+                     for source, destination, amount, via in modulation_routes)
+
+
+# *********************************************************************************************
+# Purpose:      Set up a modulation route from the command line
+# Parameters:   text            -> 'source:destination:amount' or
+#                                  'source:destination:amount:via', or 'none' for no routes
+# Returns:      {tuple}         -> the route, None for 'none'
+# *********************************************************************************************
+def parse_route(text):
+    if text == 'none':
+        return None
+    fields = text.split(':')
+    if len(fields) not in (3, 4) or fields[0] not in MOD_SOURCES \
+            or fields[1] not in MOD_DESTINATIONS \
+            or (len(fields) == 4 and fields[3] not in MOD_SOURCES):
+        raise argparse.ArgumentTypeError(f"invalid route '{text}', expected "
+                                         "source:destination:amount or "
+                                         "source:destination:amount:via")
+    return (fields[0], fields[1], float(fields[2]), fields[3] if len(fields) == 4 else None)
+
+
+# *********************************************************************************************
+# Purpose:      Set up a part from the command line
+# Parameters:   text            -> 'channel:osc' or 'channel:osc:attack:decay:sustain:release',
+#                                  channels count from 1
+# *********************************************************************************************
+def configure_part(text):
+    fields = text.split(':')
+    channel = int(fields[0]) - 1
+    if len(fields) not in (2, 6) or channel < 0 or channel >= MIDI_CHANNELS \
+            or fields[1] not in osc_ids:
+        raise argparse.ArgumentTypeError(f"invalid part '{text}', expected "
+                                         "channel:osc or channel:osc:attack:decay:sustain:release")
+    part = parts[channel]
+    part.osc_type = fields[1]
+    if len(fields) == 6:
+        part.adsr = parse_adsr(':'.join(fields[2:]))
+    return text
+
+
+# *********************************************************************************************
+# Purpose:      Read an envelope from the command line
+# Parameters:   text            -> 'attack:decay:sustain:release', times in seconds and the
+#                                  sustain level from 0 to 1
+# Returns:      {tuple}         -> (attack, decay, sustain, release)
+# *********************************************************************************************
+def parse_adsr(text):
+    try:
+        values = [float(field) for field in text.split(':')]
+    except ValueError:
+        values = []
+    if len(values) != 4:
+        raise argparse.ArgumentTypeError(f"invalid envelope '{text}', expected "
+                                         "attack:decay:sustain:release")
+    return (max(0.0, values[0]), max(0.0, values[1]), min(max(values[2], 0.0), 1.0),
+            max(0.0, values[3]))
+
+
+# -- START - event constants -- #
+
+# event types               -> kinds of events passed from the midi thread to the audio thread
+EVENT_NOTE_ON = 0
+EVENT_NOTE_OFF = 1
+EVENT_CONTROL = 2
+EVENT_BEND = 3
+
+# -- END - event constants -- #
+
+
+# **********************************************************************************************
+#   * Class:            EventQueue
+#   * Purpose:          Lock-free single-producer/single-consumer ring buffer of timestamped
+#                       events. Only the midi thread pushes and only the audio callback pops,
+#                       each side only ever writes its own index and an event is stored before
+#                       the write index that publishes it moves, so neither side takes a lock
+#   * Data Members:     mask                -> capacity - 1, used to wrap indexes into the ring
+#                       time                -> sample time each event should be applied at
+#                       kind                -> type of each event (see event types)
+#                       channel             -> midi channel of each event
+#                       data1               -> first data value of each event (midi key)
+#                       data2               -> second data value of each event (velocity)
+#                       write_index         -> count of events pushed, only moved by producer
+#                       read_index          -> count of events popped, only moved by consumer
+# **********************************************************************************************
+class EventQueue:
+    # ******************************************************************************************
+    # Purpose:          EventQueue default constructor
+    # Parameters:       capacity    -> number of events the ring holds, a power of two
+    # ******************************************************************************************
+    def __init__(self, capacity=1024):
+        self.mask = capacity - 1
+        self.time = np.zeros(capacity, dtype=np.int64)
+        self.kind = np.zeros(capacity, dtype=np.int8)
+        self.channel = np.zeros(capacity, dtype=np.int8)
+        self.data1 = np.zeros(capacity, dtype=np.int16)
+        self.data2 = np.zeros(capacity, dtype=np.int16)
+        self.write_index = 0
+        self.read_index = 0
+
+    # ******************************************************************************************
+    # Purpose:          Number of events that can still be pushed
+    # ******************************************************************************************
+    def space(self):
+        return self.mask + 1 - (self.write_index - self.read_index)
+
+    # ******************************************************************************************
+    # Purpose:          Add an event to the ring, only called from the producer
+    # Parameters:       when        -> sample time to apply the event at
+    #                   kind        -> type of the event
+    #                   channel     -> midi channel of the event
+    #                   data1       -> first data value of the event
+    #                   data2       -> second data value of the event
+    # Returns:          {bool}      -> False when the ring is full and the event was dropped
+    # ******************************************************************************************
+    def push(self, when, kind, channel, data1, data2):
+        write = self.write_index
+        if write - self.read_index > self.mask:
+            return False
+        slot = write & self.mask
+        self.time[slot] = when
+        self.kind[slot] = kind
+        self.channel[slot] = channel
+        self.data1[slot] = data1
+        self.data2[slot] = data2
+        self.write_index = write + 1
+        return True
+
+    # ******************************************************************************************
+    # Purpose:          Find the next event due before a sample time, only called from the
+    #                   consumer
+    # Parameters:       end         -> sample time the event has to be due before
+    # Returns:          slot        -> ring entry of the event, None when no event is due
+    # ******************************************************************************************
+    def peek(self, end):
+        read = self.read_index
+        if read == self.write_index:
+            return None
+        slot = read & self.mask
+        if self.time[slot] >= end:
+            return None
+        return slot
+
+    # ******************************************************************************************
+    # Purpose:          Drop the event returned by peek, only called from the consumer
+    # ******************************************************************************************
+    def pop(self):
+        self.read_index += 1
+
+#               - - End Of EventQueue Class --                #
+
+# --  create global event queue  -- #
+event_queue = EventQueue()
+
+
+# -- START - render ahead constants -- #
+
+# QUANTUM_SMALLEST          -> smallest quantum rendered ahead in samples
+QUANTUM_SMALLEST = 64
+
+# QUANTUM_LARGEST           -> largest quantum rendered ahead in samples, the engine scratch
+#                              buffers of a live stream are sized for it so the quantum can
+#                              change while the stream runs without allocating
+QUANTUM_LARGEST = 512
+
+# ADAPT_HIGH, ADAPT_LOW     -> largest render load over the last telemetry interval above which
+#                              the quantum is halved and below which it is doubled again, the
+#                              gap is over a factor of two so one step never undoes the last
+ADAPT_HIGH = 0.75
+ADAPT_LOW = 0.3
+
+# -- END - render ahead constants -- #
+
+
+# **********************************************************************************************
+#   * Class:            RenderAhead
+#   * Purpose:          Ring buffer the engine renders into ahead of the device in quanta larger
+#                       than the device block, so the per-render python overhead is paid once
+#                       per quantum instead of once per device block. While a stream runs a
+#                       producer thread renders the quanta and keeps the ring filled to the
+#                       depth the latency budget allows, the audio callback only copies its
+#                       block out of the ring so no callback ever does a whole quantum of work.
+#                       The quantum follows the load of the renders, a render has to finish
+#                       before the device drains what was left in the ring, so the quantum
+#                       shrinks when the slowest renders near that and grows back to save cpu
+#                       once they have room again.
+#                       Without the producer thread, as when benchmarking, the callback renders
+#                       the quanta itself whenever the ring runs short
+#   * Data Members:     buffer              -> samples rendered ahead of the device
+#                       mask                -> capacity - 1, used to wrap indexes into the ring
+#                       quantum             -> samples rendered at a time, 0 when rendering
+#                                              every device block directly. Owned by the
+#                                              producer thread while it is not 0 and by the
+#                                              audio thread while it is
+#                       target              -> quantum to switch to, set by the other threads
+#                       choices             -> quanta the latency budget allows, smallest first
+#                       depth               -> samples the producer keeps rendered ahead
+#                       write_index         -> count of samples rendered into the ring
+#                       read_index          -> count of samples handed to the device
+#                       worst               -> largest render load since the last adaptation,
+#                                              render time over the time the device took to
+#                                              drain what was left in the ring
+#                       running             -> False once the producer has been told to stop
+#                       thread              -> producer thread, None when the callback renders
+#                       wake                -> set by the callback after every block it takes
+#                       interval            -> interpreter switch interval before the producer
+#                                              started
+#                       lock                -> keeps a budget change and an adaptation step
+#                                              from mixing, never taken by the audio thread
+# **********************************************************************************************
+class RenderAhead:
+    # ******************************************************************************************
+    # Purpose:          RenderAhead default constructor
+    # Parameters:       capacity    -> samples the ring holds, a power of two large enough for
+    #                                  the largest budget and one more quantum
+    # ******************************************************************************************
+    def __init__(self, capacity=8192):
+        self.buffer = np.zeros(capacity, dtype=np.float32)
+        self.mask = capacity - 1
+        self.quantum = 0
+        self.target = 0
+        self.choices = [0]
+        self.depth = 0
+        self.write_index = 0
+        self.read_index = 0
+        self.worst = 0.0
+        self.running = False
+        self.thread = None
+        self.wake = threading.Event()
+        self.interval = sys.getswitchinterval()
+        self.lock = threading.Lock()
+
+    # ******************************************************************************************
+    # Purpose:          Depth and quanta a latency budget allows, the budget left over after the
+    #                   device block is the depth and every power of two from 64 to 512 samples
+    #                   larger than the device block is a quantum if two of it fit in the depth,
+    #                   so a render always starts with at least a quantum left in the ring
+    # Parameters:       latency     -> latency budget in seconds
+    #                   block_size  -> device block size in samples
+    #                   sample_rate -> sample rate in sps
+    # Returns:          choices     -> list of 0 and the quanta, smallest first
+    #                   depth       -> samples to keep rendered ahead
+    # ******************************************************************************************
+    def plan(self, latency, block_size, sample_rate):
+        depth = min(int(latency * sample_rate) - block_size, self.mask + 1 - QUANTUM_LARGEST)
+        choices = [0]
+        quantum = QUANTUM_SMALLEST
+        while 2 * quantum <= min(depth, 2 * QUANTUM_LARGEST):
+            if quantum > block_size:
+                choices.append(quantum)
+            quantum *= 2
+        return choices, max(depth, 0)
+
+    # ******************************************************************************************
+    # Purpose:          Start on the largest quantum of a latency budget, only called while the
+    #                   stream and the producer are not running. Rendering ahead is turned off
+    #                   when no quantum larger than the device block fits
+    # Parameters:       latency     -> latency budget in seconds
+    #                   block_size  -> device block size in samples
+    #                   sample_rate -> sample rate in sps
+    # ******************************************************************************************
+    def configure(self, latency, block_size, sample_rate):
+        self.choices, self.depth = self.plan(latency, block_size, sample_rate)
+        self.quantum = self.choices[-1]
+        self.target = self.quantum
+        self.read_index = self.write_index
+        self.worst = 0.0
+
+    # ******************************************************************************************
+    # Purpose:          Change the latency budget while the stream is rendering, the renderer
+    #                   moves to the largest quantum of the new budget at its next render
+    # Parameters:       latency     -> latency budget in seconds
+    #                   block_size  -> device block size in samples
+    #                   sample_rate -> sample rate in sps
+    # ******************************************************************************************
+    def change(self, latency, block_size, sample_rate):
+        choices, depth = self.plan(latency, block_size, sample_rate)
+        with self.lock:
+            self.choices = choices
+            self.depth = depth
+            self.target = choices[-1]
+
+    # ******************************************************************************************
+    # Purpose:          Step the quantum one choice down or up from the largest render load of
+    #                   the last telemetry interval, called from the telemetry reporter. The
+    #                   quantum never steps down to 0, that would hand the renders back to the
+    #                   audio callback
+    # ******************************************************************************************
+    def adapt(self):
+        load = self.worst
+        self.worst = 0.0
+        if load == 0.0:
+            return
+        with self.lock:
+            choices = self.choices
+            if self.target not in choices:
+                return
+            index = choices.index(self.target)
+            if load > ADAPT_HIGH and index > 1:
+                self.target = choices[index - 1]
+            elif load < ADAPT_LOW and 0 < index < len(choices) - 1:
+                self.target = choices[index + 1]
+
+    # ******************************************************************************************
+    # Purpose:          Number of rendered samples the device has not taken yet
+    # ******************************************************************************************
+    def available(self):
+        return self.write_index - self.read_index
+
+    # ******************************************************************************************
+    # Purpose:          Render up to the next multiple of the quantum into the ring, so every
+    #                   render lands in one piece of the ring even right after the quantum
+    #                   changed, and note its load when the producer renders it
+    # ******************************************************************************************
+    def render(self):
+        start = self.write_index & self.mask
+        frames = self.quantum - (self.write_index & (self.quantum - 1))
+        ahead = self.available()
+        began = time.perf_counter()
+        render_engine(self.buffer[start:start + frames])
+        self.write_index += frames
+        if self.running and ahead > 0:
+            load = (time.perf_counter() - began) * synth.sample_rate / ahead
+            if load > self.worst:
+                self.worst = load
+
+    # ******************************************************************************************
+    # Purpose:          Render quanta until the ring holds the depth, switching to the target
+    #                   quantum first. Only called by whichever thread owns the quantum
+    # ******************************************************************************************
+    def fill(self):
+        if self.quantum and self.target != self.quantum:
+            self.quantum = self.target
+        while self.quantum and self.running and self.available() + self.quantum <= self.depth:
+            self.render()
+
+    # ******************************************************************************************
+    # Purpose:          Producer thread, keeps the ring filled and waits for the callback to
+    #                   take another block
+    # ******************************************************************************************
+    def run(self):
+        while self.running:
+            self.wake.clear()
+            self.fill()
+            self.wake.wait(0.1)
+
+    # ******************************************************************************************
+    # Purpose:          Fill the ring and start the producer thread before the stream starts.
+    #                   The interpreter switch interval is cut to a quarter of a device block
+    #                   so the callback never waits long for the producer to let go of the
+    #                   interpreter
+    # ******************************************************************************************
+    def start(self):
+        if self.thread is not None:
+            return
+        self.interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self.interval, synth.block_size / synth.sample_rate / 4))
+        self.running = True
+        self.fill()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # ******************************************************************************************
+    # Purpose:          Stop the producer thread once the stream has stopped
+    # ******************************************************************************************
+    def stop(self):
+        if self.thread is None:
+            return
+        self.running = False
+        self.wake.set()
+        self.thread.join()
+        self.thread = None
+        sys.setswitchinterval(self.interval)
+
+    # ******************************************************************************************
+    # Purpose:          Copy the next samples of the ring into a device block. With the
+    #                   producer running a ring that ran short is played out and the rest of
+    #                   the block left silent, without it quanta are rendered first when there
+    #                   are not enough. With rendering ahead turned off whatever is left in the
+    #                   ring is played first and the rest of the block is rendered directly
+    # Parameters:       samples     -> numpy array view of the device block
+    # Returns:          {bool}      -> True when the block ran short of rendered samples
+    # ******************************************************************************************
+    def read(self, samples):
+        frames = len(samples)
+        if self.thread is None:
+            self.quantum = self.target
+            while self.quantum and self.available() < frames:
+                self.render()
+
+        count = min(frames, self.available())
+        start = self.read_index & self.mask
+        first = min(count, self.mask + 1 - start)
+        samples[:first] = self.buffer[start:start + first]
+        if first < count:
+            samples[first:count] = self.buffer[:count - first]
+        self.read_index += count
+
+        starved = False
+        if count < frames:
+            if self.quantum:
+                samples[count:] = 0.0
+                starved = True
+            else:
+                render_engine(samples[count:])
+        if self.thread is not None:
+            # a new budget with room for quanta hands the renders back to the producer
+            if not self.quantum:
+                self.quantum = self.target
+            self.wake.set()
+        return starved
+
+#               - - End Of RenderAhead Class --                #
+
+# --  create global render ahead ring  -- #
+render_ahead = RenderAhead()
+
+
+# **********************************************************************************************
+#   * Class:            ConvolutionReverb
+#   * Purpose:          Convolution reverb that adds no latency of its own. The first two
+#                       partitions of the impulse response are applied directly in the time
+#                       domain, every later partition through uniformly partitioned overlap-save
+#                       fft convolution. The spectra of the partitions are computed once when
+#                       the reverb is built and each partition of input is transformed once into
+#                       a frequency domain delay line. Since the direct part covers two
+#                       partitions, the output of the later ones is only needed a whole
+#                       partition after their newest input is complete, so the multiply-adds of
+#                       the next tail are spread evenly over the blocks of that partition and
+#                       only one fft and one inverse fft are left at each partition boundary
+#   * Data Members:     level               -> gain of the reverb added to the dry signal
+#                       size                -> samples in one partition, the power of two
+#                                              closest to the square root of the impulse
+#                                              response length from 64 to 1024, which balances
+#                                              the direct partitions against the spectral ones
+#                       length              -> samples in the impulse response
+#                       head                -> first two partitions of the impulse response
+#                       history             -> last 2 * size - 1 input samples followed by room
+#                                              for one block
+#                       spectra             -> (partitions, size + 1) spectra of the later
+#                                              partitions
+#                       spectra_line        -> (partitions, size + 1) spectra of the latest
+#                                              input partitions, newest first from row newest
+#                                              and wrapping around
+#                       newest              -> row of spectra_line holding the newest spectrum
+#                       window              -> last two partitions of input, transformed for
+#                                              each new spectrum
+#                       fill                -> input samples collected into the current
+#                                              partition
+#                       tail                -> output of the later partitions for the current
+#                                              partition
+#                       spectrum            -> summed spectrum of the next tail
+#                       product             -> scratch spectrum a run of partitions is summed
+#                                              into before adding it to spectrum
+#                       summed              -> partitions already summed into spectrum
+#                       wet                 -> scratch buffer the reverb of a block is built in
+# **********************************************************************************************
+class ConvolutionReverb:
+    # ******************************************************************************************
+    # Purpose:          ConvolutionReverb default constructor
+    # Parameters:       impulse     -> numpy array holding the impulse response
+    #                   level       -> gain of the reverb added to the dry signal
+    # ******************************************************************************************
+    def __init__(self, impulse, level=0.3):
+        length = len(impulse)
+        size = 2**int(round(np.log2(np.sqrt(max(length, 1)))))
+        size = min(1024, max(64, size))
+        partitions = max(1, -(-(length - 2 * size) // size))
+
+        self.level = level
+        self.size = size
+        self.length = length
+        self.head = np.zeros(2 * size, dtype=np.float64)
+        self.head[:min(2 * size, length)] = impulse[:2 * size]
+        self.history = np.zeros(2 * size - 1, dtype=np.float64)
+
+        # each later partition is zero padded to two partitions for overlap-save
+        padded = np.zeros((partitions, 2 * size), dtype=np.float64)
+        rest = np.zeros(partitions * size, dtype=np.float64)
+        rest[:max(0, length - 2 * size)] = impulse[2 * size:]
+        padded[:, :size] = rest.reshape(partitions, size)
+        self.spectra = np.fft.rfft(padded, axis=1)
+        self.spectra_line = np.zeros_like(self.spectra)
+        self.newest = 0
+
+        self.window = np.zeros(2 * size, dtype=np.float64)
+        self.fill = 0
+        self.tail = np.zeros(size, dtype=np.float64)
+        self.spectrum = np.zeros(size + 1, dtype=np.complex128)
+        self.product = np.zeros(size + 1, dtype=np.complex128)
+        self.summed = 0
+        self.wet = np.zeros(0, dtype=np.float64)
+
+    # ******************************************************************************************
+    # Purpose:          Preallocate the scratch buffers for blocks of up to frames samples
+    # Parameters:       frames      -> largest block the reverb will process
+    # ******************************************************************************************
+    def prepare(self, frames):
+        if frames > len(self.wet):
+            reach = 2 * self.size - 1
+            history = np.zeros(reach + frames, dtype=np.float64)
+            history[:reach] = self.history[:reach]
+            self.history = history
+            self.wet = np.zeros(frames, dtype=np.float64)
+
+    # ******************************************************************************************
+    # Purpose:          Add the reverb of a block to it in place
+    # Parameters:       samples     -> numpy array view of the block
+    # ******************************************************************************************
+    def process(self, samples):
+        frames = len(samples)
+        if frames > len(self.wet):
+            self.prepare(frames)
+        size = self.size
+        reach = 2 * size - 1
+        wet = self.wet[:frames]
+
+        # first two partitions, straight convolution with the latest input
+        history = self.history
+        history[reach:reach + frames] = samples
+        wet[:] = np.convolve(history[:reach + frames], self.head, 'valid')
+        history[:reach] = history[frames:frames + reach]
+
+        # later partitions, read from the tail summed over the last partition, and sum the
+        # share of the next tail that the input so far has paid for
+        position = 0
+        while position < frames:
+            count = min(frames - position, size - self.fill)
+            start = size + self.fill
+            self.window[start:start + count] = samples[position:position + count]
+            wet[position:position + count] += self.tail[self.fill:self.fill + count]
+            self.fill += count
+            position += count
+            if self.fill == size:
+                self.advance()
+            else:
+                self.accumulate(len(self.spectra) * self.fill // size)
+
+        wet *= self.level
+        samples += wet
+
+    # ******************************************************************************************
+    # Purpose:          Sum the next partitions of the impulse response, each met with the
+    #                   input from as many partitions ago, into the spectrum of the next tail
+    # Parameters:       last        -> partitions that should be summed once this returns
+    # ******************************************************************************************
+    def accumulate(self, last):
+        partitions = len(self.spectra)
+        while self.summed < last:
+            first = self.summed
+            row = (self.newest + first) % partitions
+            count = min(last - first, partitions - row)
+            np.einsum('pk,pk->k', self.spectra[first:first + count],
+                      self.spectra_line[row:row + count], out=self.product)
+            self.spectrum += self.product
+            self.summed += count
+
+    # ******************************************************************************************
+    # Purpose:          Finish the tail of the next partition, then transform the completed
+    #                   partition of input into the spectra line to start summing the one after
+    # ******************************************************************************************
+    def advance(self):
+        size = self.size
+        partitions = len(self.spectra)
+        self.accumulate(partitions)
+        self.tail[:] = np.fft.irfft(self.spectrum, 2 * size)[size:]
+
+        newest = (self.newest - 1) % partitions
+        self.newest = newest
+        self.spectra_line[newest] = np.fft.rfft(self.window)
+        self.spectrum.fill(0.0)
+        self.summed = 0
+
+        self.window[:size] = self.window[size:]
+        self.fill = 0
+
+#               - - End Of ConvolutionReverb Class --                #
+
+
+# **********************************************************************************************
+#   * Class:            DelayLine
+#   * Purpose:          Feedback delay, each block is handled in stretches no longer than the
+#                       delay so every stretch is one slice of the ring
+#   * Data Members:     buffer              -> ring holding one delay time of the line
+#                       index               -> position in the ring of the next sample
+#                       feedback            -> share of each echo fed back into the line
+#                       level               -> gain of the echoes added to the dry signal
+#                       wet                 -> scratch buffer the echoes of a stretch are
+#                                              copied into
+# **********************************************************************************************
+class DelayLine:
+    # ******************************************************************************************
+    # Purpose:          DelayLine default constructor
+    # Parameters:       seconds     -> seconds between the echoes
+    #                   feedback    -> share of each echo fed back into the line
+    #                   level       -> gain of the echoes added to the dry signal
+    #                   sample_rate -> sample rate in sps
+    # ******************************************************************************************
+    def __init__(self, seconds, feedback, level, sample_rate):
+        self.buffer = np.zeros(max(1, int(round(seconds * sample_rate))), dtype=np.float64)
+        self.index = 0
+        self.feedback = feedback
+        self.level = level
+        self.wet = np.zeros(len(self.buffer), dtype=np.float64)
+
+    # ******************************************************************************************
+    # Purpose:          Samples the echoes take to fall below -60 dB
+    # ******************************************************************************************
+    def ring_out(self):
+        passes = 1
+        if self.feedback > 0:
+            passes += int(np.ceil(np.log(0.001) / np.log(self.feedback)))
+        return len(self.buffer) * passes
+
+    # ******************************************************************************************
+    # Purpose:          Add the echoes of a block to it in place
+    # Parameters:       samples     -> numpy array view of the block
+    # ******************************************************************************************
+    def process(self, samples):
+        frames = len(samples)
+        position = 0
+        while position < frames:
+            count = min(frames - position, len(self.buffer) - self.index)
+            delayed = self.buffer[self.index:self.index + count]
+            wet = self.wet[:count]
+            block = samples[position:position + count]
+            wet[:] = delayed
+            delayed *= self.feedback
+            delayed += block
+            wet *= self.level
+            block += wet
+            self.index = (self.index + count) % len(self.buffer)
+            position += count
+
+#               - - End Of DelayLine Class --                #
+
+
+# **********************************************************************************************
+#   * Class:            EffectsBus
+#   * Purpose:          Effects applied in order to the mixed output of the engine, the delay
+#                       line first so its echoes are sent into the reverb
+#   * Data Members:     effects             -> list of the effects in use
+#                       tail                -> samples the effects keep sounding after the
+#                                              input falls silent
+# **********************************************************************************************
+class EffectsBus:
+    # ******************************************************************************************
+    # Purpose:          EffectsBus default constructor
+    # ******************************************************************************************
+    def __init__(self):
+        self.effects = []
+        self.tail = 0
+
+    # ******************************************************************************************
+    # Purpose:          Rebuild the effects from the synth settings, the new effects are swapped
+    #                   in at once and already prepared for the largest block of a live stream,
+    #                   so the audio thread never sees a half built bus or has to allocate
+    # ******************************************************************************************
+    def configure(self):
+        built = []
+        tail = 0
+        if synth.delay_time > 0 and synth.delay_level > 0:
+            delay = DelayLine(synth.delay_time, synth.delay_feedback, synth.delay_level,
+                              synth.sample_rate)
+            built.append(delay)
+            tail += delay.ring_out()
+        if synth.reverb_file is not None and synth.reverb_level > 0:
+            impulse = load_impulse(synth.reverb_file, synth.sample_rate)
+            built.append(ConvolutionReverb(impulse, synth.reverb_level))
+            tail += len(impulse)
+        for effect in built:
+            if isinstance(effect, ConvolutionReverb):
+                effect.prepare(max(synth.block_size, QUANTUM_LARGEST))
+        self.tail = tail
+        self.effects = built
+
+    # ******************************************************************************************
+    # Purpose:          Preallocate the scratch buffers for blocks of up to frames samples
+    # Parameters:       frames      -> largest block the stream will render
+    # ******************************************************************************************
+    def prepare(self, frames):
+        for effect in self.effects:
+            if isinstance(effect, ConvolutionReverb):
+                effect.prepare(frames)
+
+    # ******************************************************************************************
+    # Purpose:          Run a block of the mixed output through every effect in place
+    # Parameters:       samples     -> numpy array view of the block
+    # ******************************************************************************************
+    def process(self, samples):
+        for effect in self.effects:
+            effect.process(samples)
+
+#               - - End Of EffectsBus Class --                #
+
+# --  create global effects bus  -- #
+effects = EffectsBus()
+
+
+# -- START - telemetry constants -- #
+
+# callback flags            -> bits recorded for the status sounddevice hands the callback
+FLAG_UNDERFLOW = 1
+FLAG_OVERFLOW = 2
+
+# FLAG_STARVED              -> bit recorded for a block the render ahead ring ran short in, the
+#                              rest of the block was left silent
+FLAG_STARVED = 4
+
+# -- END - telemetry constants -- #
+
+
+# **********************************************************************************************
+#   * Class:            CallbackTelemetry
+#   * Purpose:          Fixed-size lock-free ring buffer the audio callback records every block
+#                       into. Only the callback writes and only the reporter thread reads, the
+#                       writer never waits and overwrites the oldest records when the reader
+#                       falls a full ring behind
+#   * Data Members:     mask                -> capacity - 1, used to wrap indexes into the ring
+#                       duration            -> seconds the callback took for each block
+#                       deadline            -> seconds of audio in each block
+#                       voices              -> number of active voices after each block
+#                       flags               -> status flags of each block (see callback flags)
+#                       write_index         -> count of blocks recorded, only moved by writer
+# **********************************************************************************************
+class CallbackTelemetry:
+    # ******************************************************************************************
+    # Purpose:          CallbackTelemetry default constructor
+    # Parameters:       capacity    -> number of blocks the ring holds, a power of two
+    # ******************************************************************************************
+    def __init__(self, capacity=8192):
+        self.mask = capacity - 1
+        self.duration = np.zeros(capacity, dtype=np.float64)
+        self.deadline = np.zeros(capacity, dtype=np.float64)
+        self.voices = np.zeros(capacity, dtype=np.int32)
+        self.flags = np.zeros(capacity, dtype=np.uint8)
+        self.write_index = 0
+
+    # ******************************************************************************************
+    # Purpose:          Record one block, only called from the audio callback
+    # Parameters:       duration    -> seconds the callback took
+    #                   deadline    -> seconds of audio in the block
+    #                   voices      -> number of active voices
+    #                   flags       -> status flags of the block
+    # ******************************************************************************************
+    def record(self, duration, deadline, voices, flags):
+        write = self.write_index
+        slot = write & self.mask
+        self.duration[slot] = duration
+        self.deadline[slot] = deadline
+        self.voices[slot] = voices
+        self.flags[slot] = flags
+        self.write_index = write + 1
+
+#               - - End Of CallbackTelemetry Class --                #
+
+# --  create global callback telemetry  -- #
+telemetry = CallbackTelemetry()
+
+
+# **********************************************************************************************
+#   * Class:            TelemetryReporter
+#   * Purpose:          Non real-time thread that drains the callback telemetry ring, keeps a
+#                       history of the most recent blocks and summarizes it as percentiles and
+#                       deadline miss and xrun counts
+#   * Data Members:     telemetry           -> CallbackTelemetry being drained
+#                       interval            -> seconds between drains
+#                       read_index          -> count of blocks drained from the ring
+#                       history             -> number of recent blocks kept for percentiles
+#                       duration, deadline, voices, flags
+#                                           -> history of the most recent blocks
+#                       kept                -> number of blocks written into the history
+#                       blocks              -> total blocks seen
+#                       misses              -> total blocks that took longer than their audio
+#                       underflows          -> total blocks flagged with an output underflow
+#                       overflows           -> total blocks flagged with an output overflow
+#                       starved             -> total blocks the render ahead ring ran short in
+#                       dropped             -> total blocks overwritten before being drained
+#                       lock                -> guards the history between the thread and
+#                                              summary calls, never taken by the callback
+# **********************************************************************************************
+class TelemetryReporter(threading.Thread):
+    # ******************************************************************************************
+    # Purpose:          TelemetryReporter default constructor
+    # Parameters:       telemetry   -> CallbackTelemetry to drain
+    #                   interval    -> seconds between drains
+    #                   history     -> number of recent blocks to keep for percentiles
+    # ******************************************************************************************
+    def __init__(self, telemetry, interval=0.5, history=65536):
+        super().__init__(daemon=True)
+        self.telemetry = telemetry
+        self.interval = interval
+        self.read_index = telemetry.write_index
+        self.history = history
+        self.duration = np.zeros(history, dtype=np.float64)
+        self.deadline = np.zeros(history, dtype=np.float64)
+        self.voices = np.zeros(history, dtype=np.int32)
+        self.flags = np.zeros(history, dtype=np.uint8)
+        self.kept = 0
+        self.blocks = 0
+        self.misses = 0
+        self.underflows = 0
+        self.overflows = 0
+        self.starved = 0
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    # ******************************************************************************************
+    # Purpose:          Drain the ring every interval and let the render ahead quantum follow the
+    #                   render load, with verbose mode on new deadline misses and xruns are
+    #                   printed here instead of inside the callback
+    # ******************************************************************************************
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            misses, xruns = self.collect()
+            render_ahead.adapt()
+            if synth.log is True and (misses or xruns):
+                print('output callback:', misses, 'deadline misses,', xruns, 'xruns')
+
+    # ******************************************************************************************
+    # Purpose:          Move every new block from the ring into the history
+    # Returns:          misses      -> number of new blocks that missed their deadline
+    #                   xruns       -> number of new blocks flagged with an underflow/overflow
+    #                                  or starved of rendered samples
+    # ******************************************************************************************
+    def collect(self):
+        ring = self.telemetry
+        write = ring.write_index
+        capacity = ring.mask + 1
+        with self.lock:
+            if write - self.read_index > capacity:
+                self.dropped += write - self.read_index - capacity
+                self.read_index = write - capacity
+            slots = np.arange(self.read_index, write) & ring.mask
+            self.read_index = write
+
+            duration = ring.duration[slots]
+            deadline = ring.deadline[slots]
+            flags = ring.flags[slots]
+            kept = (np.arange(self.kept, self.kept + len(slots))) % self.history
+            self.duration[kept] = duration
+            self.deadline[kept] = deadline
+            self.voices[kept] = ring.voices[slots]
+            self.flags[kept] = flags
+            self.kept += len(slots)
+
+            misses = int(np.count_nonzero(duration > deadline))
+            underflows = int(np.count_nonzero(flags & FLAG_UNDERFLOW))
+            overflows = int(np.count_nonzero(flags & FLAG_OVERFLOW))
+            starved = int(np.count_nonzero(flags & FLAG_STARVED))
+            self.blocks += len(slots)
+            self.misses += misses
+            self.underflows += underflows
+            self.overflows += overflows
+            self.starved += starved
+        return misses, underflows + overflows + starved
+
+    # ******************************************************************************************
+    # Purpose:          Summarize the history and the totals
+    # Returns:          summary     -> dictionary of percentiles and counts
+    # ******************************************************************************************
+    def summary(self):
+        self.collect()
+        with self.lock:
+            kept = min(self.kept, self.history)
+            summary = {
+                'blocks': self.blocks,
+                'deadline_misses': self.misses,
+                'underflows': self.underflows,
+                'overflows': self.overflows,
+                'starved': self.starved,
+                'dropped': self.dropped,
+                'recent_blocks': kept,
+            }
+            if kept:
+                duration = self.duration[:kept] * 1e6
+                load = self.duration[:kept] / self.deadline[:kept]
+                for percent in (50, 90, 99, 99.9):
+                    summary[f'p{percent}_us'] = float(np.percentile(duration, percent))
+                    summary[f'p{percent}_load'] = float(np.percentile(load, percent))
+                summary['max_us'] = float(duration.max())
+                summary['max_load'] = float(load.max())
+                summary['max_voices'] = int(self.voices[:kept].max())
+                summary['mean_voices'] = float(self.voices[:kept].mean())
+        return summary
+
+    # ******************************************************************************************
+    # Purpose:          Print the summary
+    # ******************************************************************************************
+    def report(self):
+        summary = self.summary()
+        print("\n*******************************************************************************\n")
+        print(" Output callback telemetry:")
+        print(f"\tBlocks:                {summary['blocks']}")
+        print(f"\tDeadline misses:       {summary['deadline_misses']}")
+        print(f"\tUnderflows:            {summary['underflows']}")
+        print(f"\tOverflows:             {summary['overflows']}")
+        print(f"\tStarved blocks:        {summary['starved']}")
+        if summary['recent_blocks']:
+            print(f" Over the last {summary['recent_blocks']} blocks:")
+            for percent in (50, 90, 99, 99.9):
+                print(f"\tp{percent:<5} callback time: {summary[f'p{percent}_us']:9.1f} us "
+                      f"({summary[f'p{percent}_load']:.1%} of deadline)")
+            print(f"\tmax    callback time: {summary['max_us']:9.1f} us "
+                  f"({summary['max_load']:.1%} of deadline)")
+            print(f"\tVoices:                mean {summary['mean_voices']:.1f}, "
+                  f"max {summary['max_voices']}")
+        print("\n*******************************************************************************\n")
+
+    # ******************************************************************************************
+    # Purpose:          Save the summary and the recent blocks to a json file
+    # Parameters:       path        -> path of the json file to write
+    # ******************************************************************************************
+    def dump(self, path):
+        summary = self.summary()
+        with self.lock:
+            kept = min(self.kept, self.history)
+            order = np.arange(self.kept - kept, self.kept) % self.history
+            summary['recent'] = {
+                'duration_us': (self.duration[order] * 1e6).round(2).tolist(),
+                'deadline_us': (self.deadline[order] * 1e6).round(2).tolist(),
+                'voices': self.voices[order].tolist(),
+                'flags': self.flags[order].tolist(),
+            }
+        with open(path, 'w') as file:
+            json.dump(summary, file)
+
+#               - - End Of TelemetryReporter Class --                #
+
+
+# *********************************************************************************************
+# Purpose:      Sine wave generator. 
+# Parameters:   phase       -> numpy array holding the phase of each sample in cycles
+#               out         -> numpy array to write the wave into, a new array when None
+#               where       -> mask of the entries of out to write, all when True
+# Returns:      wave        -> numpy array holding a sine wave
+# *********************************************************************************************
+def sine_wave(phase, out=None, where=True):
+    wave = np.multiply(phase, 2 * np.pi, out=out, where=where)
+    np.sin(wave, out=wave, where=where)
+    return wave
+
+# *********************************************************************************************
+# Purpose:      Saw wave generator. 
+# Parameters:   phase       -> numpy array holding the phase of each sample in cycles
+#               out         -> numpy array to write the wave into, a new array when None
+#               where       -> mask of the entries of out to write, all when True
+# Returns:      wave        -> numpy array holding a saw wave
+# *********************************************************************************************
+def saw_wave(phase, out=None, where=True):
+    wave = np.remainder(phase, 1.0, out=out, where=where)
+    np.multiply(wave, 2.0, out=wave, where=where)
+    np.subtract(wave, 1.0, out=wave, where=where)
+    return wave
+
+# *********************************************************************************************
+# Purpose:      Square wave generator. 
+# Parameters:   phase       -> numpy array holding the phase of each sample in cycles
+#               out         -> numpy array to write the wave into, a new array when None
+#               where       -> mask of the entries of out to write, all when True
+# Returns:      wave        -> numpy array holding a square wave
+# *********************************************************************************************
+def square_wave(phase, out=None, where=True):
+    wave = saw_wave(phase, out, where)
+    np.sign(wave, out=wave, where=where)
+    return wave
+
+
+# *********************************************************************************************
+# Purpose:      Builds the mip-mapped band-limited wavetables for a sample rate, one table per
+#               octave for each of sine, saw and square. Tables are summed from harmonics that
+#               stay under the nyquist frequency for the highest fundamental of their octave and
+#               are cached so they are only built once per sample rate
+# Parameters:   sample_rate -> sample rate in sps the tables are band-limited for
+# Returns:      tables      -> numpy array of shape (shapes, octaves, WAVETABLE_SIZE + 1), the
+#                              extra sample repeats the first one for interpolation
+# *********************************************************************************************
+@functools.lru_cache(maxsize=None)
+def build_wavetables(sample_rate):
+    nyquist = sample_rate / 2
+    octaves = int(np.ceil(np.log2(nyquist / WAVETABLE_BASE))) + 1
+    tables = np.zeros((3, octaves, WAVETABLE_SIZE + 1), dtype=np.float64)
+    harmonic = np.arange(WAVETABLE_SIZE // 2 + 1)
+
+    for octave in range(octaves):
+        top = WAVETABLE_BASE * 2**octave
+        harmonics = max(1, min(int(nyquist // top), WAVETABLE_SIZE // 2 - 1))
+        inside = (harmonic >= 1) & (harmonic <= harmonics)
+        odd = inside & (harmonic % 2 == 1)
+
+        # sine amplitude of every harmonic, matching the polarity of the naive oscillators
+        amplitudes = np.zeros((3, len(harmonic)), dtype=np.float64)
+        amplitudes[0, 1] = 1.0
+        amplitudes[1, inside] = -2.0 / (np.pi * harmonic[inside])
+        amplitudes[2, odd] = -4.0 / (np.pi * harmonic[odd])
+
+        cycle = np.fft.irfft(-0.5j * WAVETABLE_SIZE * amplitudes, WAVETABLE_SIZE)
+        tables[:, octave, :-1] = cycle
+        tables[:, octave, -1] = cycle[:, 0]
+
+    return tables
+
+# *********************************************************************************************
+# Purpose:      Wavetable oscillator, reads every voice from the octave table that is
+#               band-limited for its frequency with linear interpolation
+# Parameters:   phase       -> numpy array of shape (voices, samples) holding phase in cycles
+#               frequency   -> numpy array holding the frequency of each voice
+#               shape       -> numpy array holding the table of each voice, 0 sine, 1 saw and
+#                              2 square
+#               out         -> numpy array to write the wave into, a new array when None
+#               pool        -> BufferPool holding scratch buffers, new buffers when None
+# Returns:      wave        -> numpy array holding the wavetable output of each voice
+# *********************************************************************************************
+def wavetable_wave(phase, frequency, shape, out=None, pool=None):
+    tables = build_wavetables(synth.sample_rate)
+    octaves = tables.shape[1]
+    voices, frames = phase.shape
+    if pool is None:
+        pool = BufferPool(voices, frames)
+    if out is None:
+        out = np.empty(phase.shape, dtype=np.float64)
+
+    # table row of each voice, picked from the octave its frequency falls into
+    octave = pool.row_value[:voices]
+    np.maximum(frequency, WAVETABLE_BASE, out=octave)
+    octave /= WAVETABLE_BASE
+    np.log2(octave, out=octave)
+    np.ceil(octave, out=octave)
+    np.minimum(octave, octaves - 1, out=octave)
+    row = pool.row[:voices]
+    np.copyto(row, shape, casting='unsafe')
+    row *= octaves
+    np.add(row, octave, out=row, casting='unsafe')
+    row *= WAVETABLE_SIZE + 1
+
+    # split the position in the table into a whole index and a fraction to interpolate by
+    fraction = pool.fraction[:voices, :frames]
+    np.remainder(phase, 1.0, out=fraction)
+    fraction *= WAVETABLE_SIZE
+    index = pool.index[:voices, :frames]
+    np.copyto(index, fraction, casting='unsafe')
+    fraction -= index
+    index += row[:, None]
+
+    flat = tables.reshape(-1)
+    flat.take(index, out=out)
+    index += 1
+    following = pool.following[:voices, :frames]
+    flat.take(index, out=following)
+    following -= out
+    following *= fraction
+    out += following
+    return out
+
+
+# *********************************************************************************************
+# Purpose:      Shape of an envelope segment rising from 0 towards 1
+# Parameters:   count       -> number of samples in the segment
+#               curve       -> 'linear' or 'exponential'
+# Returns:      shape       -> numpy array holding the segment
+# *********************************************************************************************
+def envelope_shape(count, curve):
+    shape = np.arange(count, dtype=np.float64) / max(count, 1)
+    if curve == 'exponential':
+        shape = (1.0 - np.exp(-5.0 * shape)) / (1.0 - np.exp(-5.0))
+    return shape
+
+# *********************************************************************************************
+# Purpose:      Builds an adsr envelope as one table of samples, attack and decay lead up to a
+#               single sustain sample, followed by a release that falls from 1 to a silent
+#               sample and a FADE_TIME fade from 1 to a silent last sample for stolen voices.
+#               Both are scaled by the level they start from. Tables are cached by their
+#               settings and the least recently used ones are dropped
+# Parameters:   attack      -> attack time in seconds
+#               decay       -> decay time in seconds
+#               sustain     -> sustain level from 0 to 1
+#               release     -> release time in seconds
+#               curve       -> 'linear' or 'exponential' segments
+#               sample_rate -> sample rate in sps of the table
+# Returns:      table       -> numpy array holding the envelope
+#               sustain_at  -> index of the sustain sample, the release starts right after it
+#               release_end -> index of the silent end of the release, the fade starts right
+#                              after it
+#               fade_end    -> index of the silent last sample
+# *********************************************************************************************
+@functools.lru_cache(maxsize=32)
+def envelope_table(attack, decay, sustain, release, curve, sample_rate):
+    attack_count = int(round(attack * sample_rate))
+    decay_count = int(round(decay * sample_rate))
+    release_count = int(round(release * sample_rate))
+    fade_count = int(round(FADE_TIME * sample_rate))
+    sustain_at = attack_count + decay_count
+    release_end = sustain_at + release_count + 1
+    fade_end = release_end + fade_count + 1
+
+    table = np.empty(fade_end + 1, dtype=np.float64)
+    table[:attack_count] = envelope_shape(attack_count, curve)
+    table[attack_count:sustain_at] = 1.0 - (1.0 - sustain) * envelope_shape(decay_count, curve)
+    table[sustain_at] = sustain
+    table[sustain_at + 1:release_end] = 1.0 - envelope_shape(release_count, curve)
+    table[release_end] = 0.0
+    table[release_end + 1:fade_end] = 1.0 - envelope_shape(fade_count, 'linear')
+    table[fade_end] = 0.0
+
+    return table, sustain_at, release_end, fade_end
+
+# *********************************************************************************************
+# Purpose:      Envelope table for the current adsr settings
+# Returns:      {tuple}     -> table, sustain_at, release_end and fade_end, see envelope_table
+# *********************************************************************************************
+def current_envelope():
+    return envelope_table(attack, decay, sustain, release, envelope_curve, synth.sample_rate)
+
+
+# *********************************************************************************************
+# Purpose:      Control point each sample of a block ramps from and how far along the ramp to
+#               the next point it is, cached by block size
+# Parameters:   frames      -> number of samples in the block
+# Returns:      index       -> numpy array holding the control point each sample ramps from
+#               fraction    -> numpy array holding how far along the ramp each sample is
+# *********************************************************************************************
+@functools.lru_cache(maxsize=64)
+def control_ramp(frames):
+    steps = np.arange(frames)
+    return steps // CONTROL_RATE, (steps % CONTROL_RATE + 1) / CONTROL_RATE
+
+
+# *********************************************************************************************
+# Purpose:      Expand values at control points into linear ramps at audio rate, each sample
+#               lies between the point before it and the point after it
+# Parameters:   values      -> (voices, points + 1) values at the control points, starting with
+#                              the value each voice ramps from
+#               frames      -> number of samples in the block
+#               out         -> (voices, frames) numpy array the ramps are written into
+#               slope       -> (voices, frames) scratch numpy array
+#               difference  -> (voices, points) scratch numpy array
+# *********************************************************************************************
+def expand_controls(values, frames, out, slope, difference):
+    index, fraction = control_ramp(frames)
+    values.take(index, axis=1, out=out, mode='clip')
+    np.subtract(values[:, 1:], values[:, :-1], out=difference)
+    difference.take(index, axis=1, out=slope, mode='clip')
+    slope *= fraction
+    out += slope
+
+
+# *********************************************************************************************
+# Purpose:      Combine one route of the modulation matrix into a running total, the total stays
+#               a float while every route so far was one and moves into a pool buffer after
+# Parameters:   total       -> float or numpy array holding the routes so far
+#               term        -> float or numpy array holding the route to add in
+#               out         -> (voices, points) numpy array the total moves into
+#               operation   -> np.add or np.multiply
+# Returns:      total       -> float or numpy array holding the new total
+# *********************************************************************************************
+def combine_controls(total, term, out, operation):
+    if isinstance(total, np.ndarray):
+        return operation(total, term, out=total)
+    if isinstance(term, np.ndarray):
+        return operation(term, total, out=out)
+    return total + term if operation is np.add else total * term
+
+
+# *********************************************************************************************
+# Purpose:      Coefficients of a resonant biquad filter (rbj audio eq cookbook) for one of the
+#               quantized cutoffs of the voice filter, cached by their settings
+# Parameters:   step        -> cutoff as FILTER_STEPS per octave above FILTER_LOWEST
+#               resonance   -> q of the filter
+#               kind        -> 'lowpass' or 'highpass'
+#               sample_rate -> sample rate in sps
+# Returns:      b           -> numpy array holding the feed forward coefficients
+#               a           -> numpy array holding the feedback coefficients
+# *********************************************************************************************
+@functools.lru_cache(maxsize=1024)
+def filter_coefficients(step, resonance, kind, sample_rate):
+    frequency = FILTER_LOWEST * 2**(step / FILTER_STEPS)
+    omega = 2 * np.pi * frequency / sample_rate
+    cosine = np.cos(omega)
+    alpha = np.sin(omega) / (2 * resonance)
+
+    if kind == 'highpass':
+        b = np.array([(1 + cosine) / 2, -(1 + cosine), (1 + cosine) / 2])
+    else:
+        b = np.array([(1 - cosine) / 2, 1 - cosine, (1 - cosine) / 2])
+    a = np.array([1 + alpha, -2 * cosine, 1 - alpha])
+    return b / a[0], a / a[0]
+
+
+# *********************************************************************************************
+# Purpose:      Import scipy.signal for a voice filter type, the import takes long enough that
+#               it must never happen on the audio thread, so it runs before the type is set
+# Parameters:   kind            -> filter type about to be used
+# *********************************************************************************************
+def load_filter(kind):
+    if kind != 'off':
+        import scipy.signal
+
+
+# *********************************************************************************************
+# Purpose:      Read an impulse response for the convolution reverb from a wav file, the
+#               channels are averaged, the sample rate is converted to the synth's by linear
+#               interpolation and the response is scaled to unit energy
+# Parameters:   path        -> path of the .wav file
+#               sample_rate -> sample rate in sps to convert to
+# Returns:      impulse     -> numpy array holding the impulse response
+# *********************************************************************************************
+def load_impulse(path, sample_rate):
+    import scipy.io.wavfile as wav
+
+    rate, data = wav.read(path)
+    impulse = np.asarray(data, dtype=np.float64)
+    if data.dtype == np.uint8:
+        impulse = (impulse - 128) / 128
+    elif np.issubdtype(data.dtype, np.integer):
+        impulse /= np.iinfo(data.dtype).max
+    if impulse.ndim > 1:
+        impulse = impulse.mean(axis=1)
+
+    if rate != sample_rate and len(impulse) > 1:
+        positions = np.arange(int(len(impulse) * sample_rate / rate)) * (rate / sample_rate)
+        impulse = np.interp(positions, np.arange(len(impulse)), impulse)
+
+    energy = np.sqrt(np.sum(impulse * impulse))
+    if energy > 0:
+        impulse /= energy
+    return impulse
+
+
+# *********************************************************************************************
+# Purpose:      Open a wav file for the sample oscillator, memory-mapped so only the pages a
+#               voice reads are loaded. 24 bit files can not be mapped and are read whole
+# Parameters:   path        -> path of the .wav file
+# Returns:      data        -> numpy array or memory map holding the samples as stored
+#               rate        -> sample rate of the file in sps
+# *********************************************************************************************
+def read_sample(path):
+    import scipy.io.wavfile as wav
+
+    try:
+        rate, data = wav.read(path, mmap=True)
+    except ValueError:
+        rate, data = wav.read(path)
+    return data, rate
+
+
+# *********************************************************************************************
+# Purpose:      Converts a midi key into a frequency 
+# Parameters:   key         -> holds an integer representation of the midi key
+# Returns:      {float}     -> float representation of the frequency of the key passed in
+# *********************************************************************************************
+def key_to_frequency(key):
+    return 440 * 2**((key - 69) / 12)
+
+
+# *********************************************************************************************
+# Purpose:      Callback for the purpose of playing audio through sounddevice 
+# Parameters:   data            -> data to output
+#               frames          -> frame count 
+#               time_info       -> info about sample clock
+#               status          -> status of callback
+# *********************************************************************************************
+def output_callback(data, frames, time_info, status):
+
+    global callback_clock, callback_time
+
+    callback_clock = sample_clock - render_ahead.available()
+    callback_time = time.perf_counter()
+
+    # status flags are recorded in the telemetry, printing here could cause more underruns
+    flags = 0
+    if status:
+        if status.output_underflow:
+            flags |= FLAG_UNDERFLOW
+        if status.output_overflow:
+            flags |= FLAG_OVERFLOW
+
+    # take the block from the render ahead ring, or mix straight into the device buffer
+    samples = data[:, 0]
+    if render_ahead.read(samples):
+        flags |= FLAG_STARVED
+
+    telemetry.record(time.perf_counter() - callback_time, frames / synth.sample_rate,
+                     mixer.active_voices(), flags)
+
+
+# *********************************************************************************************
+# Purpose:      Render the next samples of the engine, applying every queued event at its sample
+# Parameters:   samples         -> numpy array view to render into
+# *********************************************************************************************
+def render_engine(samples):
+
+    global sample_clock
+
+    frames = len(samples)
+    samples.fill(0.0)
+
+    # render up to each event due in this block, then apply it at its sample
+    position = 0
+    slot = event_queue.peek(sample_clock + frames)
+    while slot is not None:
+        offset = min(max(int(event_queue.time[slot]) - sample_clock, position), frames)
+        if offset > position:
+            render_voices(samples[position:offset], sample_clock + position)
+            position = offset
+        apply_event(event_queue.kind[slot], event_queue.channel[slot], event_queue.data1[slot],
+                    event_queue.data2[slot])
+        event_queue.pop()
+        slot = event_queue.peek(sample_clock + frames)
+
+    render_voices(samples[position:], sample_clock + position)
+    if effects.effects:
+        effects.process(samples)
+
+    sample_clock += frames
+
+
+# *********************************************************************************************
+# Purpose:      Render the active voices of every part into part of an output block and scale
+#               the mix by the number of voices
+# Parameters:   samples         -> numpy array view of the block to render into
+#               clock           -> sample time of the start of the block
+# *********************************************************************************************
+def render_voices(samples, clock=0):
+    if len(samples) == 0:
+        return
+
+    mixer.render(len(samples), samples, clock)
+
+    nkeys = mixer.active_voices()
+    if count_voices is not None:
+        count_voices(len(samples), nkeys)
+    elif nkeys <= 8:
+        samples *= 1.0 / 8.0
+    else:
+        samples *= 1.0 / nkeys
+
+
+# *********************************************************************************************
+# Purpose:      Apply an event taken off the event queue to the voice bank of its part, only
+#               called from the audio callback
+# Parameters:   kind            -> type of the event
+#               channel         -> midi channel of the event
+#               data1           -> first data value of the event
+#               data2           -> second data value of the event
+# *********************************************************************************************
+def apply_event(kind, channel, data1, data2):
+    part = parts[channel]
+    if kind == EVENT_NOTE_ON:
+        part.voices.note_on(Note(int(data1), part.oscillator(), int(data2) / 127))
+    elif kind == EVENT_NOTE_OFF:
+        part.voices.note_off(int(data1))
+    elif kind == EVENT_BEND:
+        part.bend = int(data2) / 8192
+    elif kind == EVENT_CONTROL:
+        control = int(data1)
+        if control == 7:
+            part.volume = int(data2) / 127
+        elif control == 1:
+            part.modwheel = int(data2) / 127
+        elif control == synth.filter_cc:
+            part.brightness = int(data2) / 127
+
+
+# *********************************************************************************************
+# Purpose:      Estimate the sample time for an event happening now, one block and the render
+#               ahead depth after the block the audio callback is currently playing so every event
+#               gets the same latency instead of snapping to whichever block happens to be
+#               rendering.
+#               The time since the last block is capped at a tenth of a second so a stalled
+#               or stopped stream can not push events far into the future
+# Returns:      {int}           -> sample time to apply the event at
+# *********************************************************************************************
+def event_time():
+    if callback_time == 0.0:
+        return callback_clock
+    elapsed = min(time.perf_counter() - callback_time, 0.1)
+    ahead = render_ahead.depth if render_ahead.quantum else 0
+    return callback_clock + int(elapsed * synth.sample_rate) + synth.block_size + ahead
+
+
+# *********************************************************************************************
+# Purpose:      Pass an event to the audio callback through the event queue
+# Parameters:   kind            -> type of the event
+#               channel         -> midi channel of the event
+#               data1           -> first data value of the event
+#               data2           -> second data value of the event
+#               when            -> sample time to apply the event at, now when None
+# *********************************************************************************************
+def queue_event(kind, channel, data1, data2, when=None):
+    if when is None:
+        when = event_time()
+    if not event_queue.push(when, kind, channel, data1, data2):
+        if synth.log is True: print('event queue full, dropped event', kind, data1)
+
+
+# *********************************************************************************************
+# Purpose:      Process midi events as they are happening
+# Parameters:   midi_input      -> midi input backend to wait on
+# Returns:      {bool}          -> False when the panic button was pressed or the input ended
+# *********************************************************************************************
+def process_midi_event(midi_input):
+    # wait and grab any message that comes in
+    mesg = midi_input.receive()
+    if mesg is None:
+        return False
+
+    # the message is stamped on arrival but only written once the synth has it queued
+    received = time.perf_counter_ns()
+    running = handle_midi_message(mesg)
+    if midi_capture is not None:
+        midi_capture.record(mesg, received)
+    return running
+
+
+# *********************************************************************************************
+# Purpose:      Apply a single midi message to the synth, notes are queued for the audio
+#               callback to apply at their sample time
+# Parameters:   mesg            -> mido message to apply
+#               when            -> sample time of the message, now when None
+# Returns:      {bool}          -> False when the panic button was pressed, True otherwise
+# *********************************************************************************************
+def handle_midi_message(mesg, when=None):
+    global synth
+
+    mesg_type = mesg.type
+
+    # a note on with no velocity is how most midi files end a note
+    if mesg_type == 'note_on' and mesg.velocity == 0:
+        mesg_type = 'note_off'
+
+    # when a note is being pressed
+    #   queue a note to start a voice
+    if mesg_type == 'note_on':
+        key = mesg.note
+        velocity = mesg.velocity / 127
+        if synth.log is True: print('note on', mesg.channel, key, mesg.velocity, round(velocity, 2))
+        queue_event(EVENT_NOTE_ON, mesg.channel, key, mesg.velocity, when)
+
+    # when a note is no longer being pressed
+    #   move its voice into the release stage
+    elif mesg_type == 'note_off':
+        key = mesg.note
+        velocity = round(mesg.velocity / 127, 2)
+        if synth.log is True: print('note off', mesg.channel, key, mesg.velocity, velocity)
+        queue_event(EVENT_NOTE_OFF, mesg.channel, key, mesg.velocity, when)
+    
+    # for Virtual MIDI Piano Keyboard:
+    #   this is called 'bender' but it acts as a pitchwheel
+    #   queued for the modulation matrix of its channel
+    elif mesg.type == 'pitchwheel':
+        pitch = round(mesg.pitch / 8192, 2)
+        if synth.log is True: print('bender', mesg.channel, mesg.pitch, pitch)
+        queue_event(EVENT_BEND, mesg.channel, 0, mesg.pitch, when)
+    
+    elif mesg.type == 'control_change':
+        # for Virtual MIDI Piano Keyboard:
+        #   this is the 'Value' knob for the 'Control' dropdown
+        #   specifically when '7-Volume' is selected
+        #   every channel sets the volume of its own part
+        if mesg.control == 7:
+            synth.volume = round(mesg.value / 127, 2)
+            if synth.log is True: print('volume', mesg.channel, mesg.value, synth.volume)
+            queue_event(EVENT_CONTROL, mesg.channel, 7, mesg.value, when)
+
+        # the mod wheel, routed to vibrato by default
+        elif mesg.control == 1:
+            if synth.log is True: print('modwheel', mesg.channel, mesg.value)
+            queue_event(EVENT_CONTROL, mesg.channel, 1, mesg.value, when)
+        
+        # for Virtual MIDI Piano Keyboard:
+        #   this is the 'soft' toggle button
+        elif mesg.control == 64:
+            if synth.sustain_toggle == True:
+                if synth.log is True: print("sustain_toggle off")
+                synth.sustain_toggle = False
+            else:
+                if synth.log is True: print("sustain_toggle on")
+                synth.sustain_toggle = True
+
+        # for Virtual MIDI Piano Keyboard:
+        #   this is the 'soft' toggle button
+        elif mesg.control == 67:
+            if synth.soft_toggle == True:
+                if synth.log is True: print("soft_toggle off")
+                synth.soft_toggle = False
+            else:
+                if synth.log is True: print("soft_toggle on")
+                synth.soft_toggle = True
+
+        # for Virtual MIDI Piano Keyboard: 
+        #   this is the stop button (aka 'panic' button)
+        elif mesg.control == 123:
+            print("Panic No Longer!")
+            return False
+
+        # moves the filter cutoff of the channel
+        elif mesg.control == synth.filter_cc:
+            if synth.log is True: print('brightness', mesg.channel, mesg.value)
+            queue_event(EVENT_CONTROL, mesg.channel, mesg.control, mesg.value, when)
+
+    else:
+        print('unknown MIDI message', mesg)
+    return True
+
+
+# *********************************************************************************************
+# Purpose:      Apply a batch of midi messages that arrived together. Pitch bends and the
+#               controllers that set a level (volume, mod wheel, filter cc) only matter for their
+#               latest value, so a burst of them is coalesced to the last message of each
+#               channel and controller and the notes in the batch never wait behind it. Every
+#               message of the batch is queued for the same sample
+# Parameters:   batch           -> list of mido messages in the order they arrived
+# Returns:      {bool}          -> False when the panic button was pressed
+# *********************************************************************************************
+def handle_midi_batch(batch):
+    keys = []
+    latest = dict()
+    for index, mesg in enumerate(batch):
+        key = None
+        if mesg.type == 'pitchwheel':
+            key = (mesg.channel, -1)
+        elif mesg.type == 'control_change' and mesg.control in (1, 7, synth.filter_cc):
+            key = (mesg.channel, mesg.control)
+        keys.append(key)
+        if key is not None:
+            latest[key] = index
+
+    when = event_time()
+    for index, mesg in enumerate(batch):
+        if keys[index] is not None and latest[keys[index]] != index:
+            continue
+        if not handle_midi_message(mesg, when):
+            return False
+    return True
+
+
+# *********************************************************************************************
+# Purpose:      Parse the midi messages of a udp datagram, either raw midi bytes or an osc
+#               message or bundle whose midi ('m') arguments carry the messages, the other
+#               standard osc arguments are skipped wherever they come
+# Parameters:   data            -> bytes of the datagram
+# Returns:      messages        -> list of mido messages
+# *********************************************************************************************
+def parse_datagram(data):
+    import mido
+
+    if data[:1] not in (b'/', b'#'):
+        return mido.parse_all(data)
+    if data.startswith(b'#bundle\0'):
+        # a bundle is a time tag followed by size prefixed elements, its timing is not used
+        messages = []
+        position = 16
+        while position + 4 <= len(data):
+            size = int.from_bytes(data[position:position + 4], 'big')
+            messages += parse_datagram(data[position + 4:position + 4 + size])
+            position += 4 + size
+        return messages
+
+    # the address and the type tags are null terminated and padded to 4 bytes
+    end = data.find(b'\0')
+    position = (end // 4 + 1) * 4
+    end = data.find(b'\0', position)
+    if end < 0 or data[position:position + 1] != b',':
+        return []
+    tags = data[position + 1:end]
+    position = (end // 4 + 1) * 4
+    midi = bytearray()
+    for tag in tags.decode('ascii', 'replace'):
+        if tag == 'm' and position + 4 <= len(data):
+            # an osc midi argument is a port id followed by the status and two data bytes
+            midi += data[position + 1:position + 4]
+            position += 4
+        elif tag in 'ifcr':
+            position += 4
+        elif tag in 'htd':
+            position += 8
+        elif tag in 'sS':
+            end = data.find(b'\0', position)
+            if end < 0:
+                break
+            position = (end // 4 + 1) * 4
+        elif tag == 'b':
+            size = int.from_bytes(data[position:position + 4], 'big')
+            position += 4 + -(-size // 4) * 4
+        elif tag not in 'TFNI[]':
+            # the size of an unknown argument is unknown, so nothing after it can be read
+            break
+    return mido.parse_all(midi)
+
+
+# **********************************************************************************************
+#   * Class:            PortMidiInput
+#   * Purpose:          Midi input backend reading a real midi device or an existing virtual
+#                       port (such as loopMIDI) through mido
+#   * Data Members:     port                -> open mido input port
+# **********************************************************************************************
+class PortMidiInput:
+    # ******************************************************************************************
+    # Purpose:          PortMidiInput default constructor
+    # Parameters:       name        -> name of the midi port to open
+    #                   virtual     -> True to create a new virtual port with that name instead,
+    #                                  which is not supported by the Windows midi api
+    # ******************************************************************************************
+    def __init__(self, name='loopMIDI Port 0', virtual=False):
+        import mido
+
+        self.port = mido.open_input(name, virtual=virtual)
+
+    # ******************************************************************************************
+    # Purpose:          Wait for the next midi message
+    # Returns:          {mido.Message}  -> message received
+    # ******************************************************************************************
+    def receive(self):
+        return self.port.receive()
+
+    # ******************************************************************************************
+    # Purpose:          Close the port
+    # ******************************************************************************************
+    def close(self):
+        self.port.close()
+
+#               - - End Of PortMidiInput Class --                #
+
+
+# **********************************************************************************************
+#   * Class:            FileMidiInput
+#   * Purpose:          Midi input backend playing the messages of a midi file in real time
+#   * Data Members:     messages            -> generator of the file's messages, sleeping
+#                                              between them like a live performance
+# **********************************************************************************************
+class FileMidiInput:
+    # ******************************************************************************************
+    # Purpose:          FileMidiInput default constructor
+    # Parameters:       path        -> path of the .mid file to play
+    # ******************************************************************************************
+    def __init__(self, path):
+        import mido
+
+        self.messages = mido.MidiFile(path).play()
+
+    # ******************************************************************************************
+    # Purpose:          Wait for the next midi message
+    # Returns:          {mido.Message}  -> message received, None once the file has ended
+    # ******************************************************************************************
+    def receive(self):
+        return next(self.messages, None)
+
+    # ******************************************************************************************
+    # Purpose:          Stop playing the file
+    # ******************************************************************************************
+    def close(self):
+        self.messages.close()
+
+#               - - End Of FileMidiInput Class --                #
+
+
+# **********************************************************************************************
+#   * Class:            NullMidiInput
+#   * Purpose:          Midi input backend that never produces a message
+# **********************************************************************************************
+class NullMidiInput:
+    # ******************************************************************************************
+    # Purpose:          There is never a next message
+    # Returns:          None
+    # ******************************************************************************************
+    def receive(self):
+        return None
+
+    # ******************************************************************************************
+    # Purpose:          Nothing to close
+    # ******************************************************************************************
+    def close(self):
+        pass
+
+#               - - End Of NullMidiInput Class --                #
+
+
+# -- START - midi capture constants -- #
+
+# CAPTURE_DTYPE             -> record of a midi capture file, the nanoseconds since the capture
+#                              started, the number of midi bytes and the bytes themselves. A
+#                              capture file is nothing but these records back to back, so it can
+#                              be appended to one message at a time and memory-mapped to read
+CAPTURE_DTYPE = np.dtype([('time', '<i8'), ('size', 'u1'), ('data', 'u1', (3,))])
+
+# -- END - midi capture constants -- #
+
+
+# **********************************************************************************************
+#   * Class:            MidiCapture
+#   * Purpose:          Appends every midi message the synth receives to a capture file with a
+#                       high resolution timestamp, so a live session can be replayed exactly.
+#                       Messages longer than 3 bytes (system exclusive) are not captured
+#   * Data Members:     path                -> path of the capture file
+#                       file                -> capture file open for writing
+#                       start               -> perf_counter_ns time the capture started
+#                       entry               -> one record reused for every message
+#                       count               -> number of messages captured
+#                       skipped             -> number of messages too long to capture
+# **********************************************************************************************
+class MidiCapture:
+    # ******************************************************************************************
+    # Purpose:          MidiCapture default constructor, starts a new capture file
+    # Parameters:       path        -> path of the capture file to write
+    # ******************************************************************************************
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.start = time.perf_counter_ns()
+        self.entry = np.zeros(1, dtype=CAPTURE_DTYPE)
+        self.count = 0
+        self.skipped = 0
+
+    # ******************************************************************************************
+    # Purpose:          Append a message stamped with the time it was received, every record is
+    #                   flushed so a capture survives the synth crashing
+    # Parameters:       mesg        -> mido message to append
+    #                   received    -> time.perf_counter_ns() when the message arrived, None
+    #                                  for now
+    # ******************************************************************************************
+    def record(self, mesg, received=None):
+        if received is None:
+            received = time.perf_counter_ns()
+        stamp = received - self.start
+        data = mesg.bytes()
+        if len(data) > 3:
+            self.skipped += 1
+            return
+        entry = self.entry[0]
+        entry['time'] = stamp
+        entry['size'] = len(data)
+        entry['data'] = data + [0] * (3 - len(data))
+        self.file.write(self.entry.tobytes())
+        self.file.flush()
+        self.count += 1
+
+    # ******************************************************************************************
+    # Purpose:          Close the capture file
+    # ******************************************************************************************
+    def close(self):
+        self.file.close()
+
+#               - - End Of MidiCapture Class --                #
+
+# --  create global midi capture, None unless a capture was asked for  -- #
+midi_capture = None
+
+
+# **********************************************************************************************
+#   * Class:            CaptureMidiInput
+#   * Purpose:          Midi input backend replaying a capture file in real time, every message
+#                       is handed out as long after the first one as it was captured
+#   * Data Members:     records             -> memory-mapped records of the capture file
+#                       position            -> index of the next record
+#                       start               -> perf_counter_ns time the first record maps to,
+#                                              None until the first message
+# **********************************************************************************************
+class CaptureMidiInput:
+    # ******************************************************************************************
+    # Purpose:          CaptureMidiInput default constructor
+    # Parameters:       path        -> path of the capture file to replay
+    # ******************************************************************************************
+    def __init__(self, path):
+        self.records = read_capture(path)
+        self.position = 0
+        self.start = None
+
+    # ******************************************************************************************
+    # Purpose:          Wait until the next message is due
+    # Returns:          {mido.Message}  -> message received, None once the capture has ended
+    # ******************************************************************************************
+    def receive(self):
+        if self.position >= len(self.records):
+            return None
+        record = self.records[self.position]
+        self.position += 1
+        stamp = int(record['time'])
+        if self.start is None:
+            self.start = time.perf_counter_ns() - stamp
+        delay = (self.start + stamp - time.perf_counter_ns()) / 1e9
+        if delay > 0:
+            time.sleep(delay)
+        return capture_message(record)
+
+    # ******************************************************************************************
+    # Purpose:          Stop replaying and let go of the memory map
+    # ******************************************************************************************
+    def close(self):
+        self.records = np.zeros(0, dtype=CAPTURE_DTYPE)
+
+#               - - End Of CaptureMidiInput Class --                #
+
+
+# **********************************************************************************************
+#   * Class:            MidiDatagramProtocol
+#   * Purpose:          asyncio protocol of the udp midi endpoint, every datagram is parsed into
+#                       midi messages and handed to the ingest on the event loop thread
+#   * Data Members:     ingest              -> MidiIngest the messages are handed to
+# **********************************************************************************************
+class MidiDatagramProtocol(asyncio.DatagramProtocol):
+    # ******************************************************************************************
+    # Purpose:          MidiDatagramProtocol default constructor
+    # Parameters:       ingest      -> MidiIngest to hand the messages to
+    # ******************************************************************************************
+    def __init__(self, ingest):
+        self.ingest = ingest
+
+    # ******************************************************************************************
+    # Purpose:          Parse a datagram and wake the ingest
+    # Parameters:       data        -> bytes of the datagram
+    #                   address     -> address of the sender
+    # ******************************************************************************************
+    def datagram_received(self, data, address):
+        received = time.perf_counter_ns()
+        self.ingest.pending.extend((received, mesg) for mesg in parse_datagram(data))
+        self.ingest.wakeup.set()
+
+#               - - End Of MidiDatagramProtocol Class --                #
+
+
+# **********************************************************************************************
+#   * Class:            MidiIngest
+#   * Purpose:          asyncio input layer listening to several midi inputs and a local udp
+#                       endpoint at once. Every midi input backend is read by its own thread
+#                       that only forwards messages, the event loop wakes once for whatever has
+#                       arrived since it last ran and applies it all as one batch, so a burst
+#                       from one device costs one wakeup instead of one loop per message and the
+#                       other devices are never stuck behind a blocking receive
+#   * Data Members:     inputs              -> list of midi input backends
+#                       endpoint            -> (host, port) the udp endpoint listens on, or None
+#                       pending             -> deque of (time.perf_counter_ns() on arrival,
+#                                              message) pairs waiting for the event loop,
+#                                              appended by the reader threads
+#                       ended               -> number of inputs that have run out of messages
+#                       lock                -> guards ended between the reader threads
+#                       threads             -> reader threads, started on the first run
+#                       loop                -> event loop while running, None otherwise
+#                       wakeup              -> asyncio.Event set when messages are pending
+#                       signalled           -> whether a wakeup is already on its way, so a burst
+#                                              wakes the loop once
+# **********************************************************************************************
+class MidiIngest:
+    # ******************************************************************************************
+    # Purpose:          MidiIngest default constructor, nothing is started until the first run
+    # Parameters:       inputs      -> list of midi input backends to listen to
+    #                   endpoint    -> (host, port) to listen for udp midi on, or None
+    # ******************************************************************************************
+    def __init__(self, inputs, endpoint=None):
+        self.inputs = inputs
+        self.endpoint = endpoint
+        self.pending = collections.deque()
+        self.ended = 0
+        self.lock = threading.Lock()
+        self.threads = []
+        self.loop = None
+        self.wakeup = None
+        self.signalled = False
+
+    # ******************************************************************************************
+    # Purpose:          Forward every message of one input to the event loop until it ends, runs
+    #                   on a reader thread
+    # Parameters:       midi_input  -> midi input backend to read
+    # ******************************************************************************************
+    def forward(self, midi_input):
+        while True:
+            mesg = midi_input.receive()
+            if mesg is None:
+                break
+            self.pending.append((time.perf_counter_ns(), mesg))
+            self.notify()
+        with self.lock:
+            self.ended += 1
+        self.signalled = False
+        self.notify()
+
+    # ******************************************************************************************
+    # Purpose:          Wake the event loop from a reader thread, once per batch
+    # ******************************************************************************************
+    def notify(self):
+        loop = self.loop
+        if loop is None or self.signalled:
+            return
+        self.signalled = True
+        try:
+            loop.call_soon_threadsafe(self.wakeup.set)
+        except RuntimeError:
+            # the loop stopped between the check and the call, the next run drains the messages
+            pass
+
+    # ******************************************************************************************
+    # Purpose:          Apply messages as they arrive until the panic button is pressed or every
+    #                   input has ended, with a udp endpoint only the panic button stops it
+    # Returns:          {bool}      -> False when the panic button was pressed
+    # ******************************************************************************************
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        transport = None
+        if self.endpoint is not None:
+            transport, protocol = await loop.create_datagram_endpoint(
+                lambda: MidiDatagramProtocol(self), local_addr=self.endpoint)
+        self.loop = loop
+        if not self.threads:
+            for midi_input in self.inputs:
+                thread = threading.Thread(target=self.forward, args=(midi_input,), daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+        # anything that arrived while the loop was not running is drained right away
+        self.wakeup.set()
+        try:
+            while True:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                self.signalled = False
+                batch = []
+                arrivals = []
+                while self.pending:
+                    received, mesg = self.pending.popleft()
+                    arrivals.append(received)
+                    batch.append(mesg)
+                running = handle_midi_batch(batch) if batch else True
+
+                # the capture keeps the arrival time of every message, and is only written
+                # once the batch is queued so the file never delays the synth
+                if midi_capture is not None:
+                    for received, mesg in zip(arrivals, batch):
+                        midi_capture.record(mesg, received)
+                if not running:
+                    return False
+                if transport is None and self.ended == len(self.inputs) and not self.pending:
+                    return True
+        finally:
+            self.loop = None
+            if transport is not None:
+                transport.close()
+
+    # ******************************************************************************************
+    # Purpose:          Close every input
+    # ******************************************************************************************
+    def close(self):
+        for midi_input in self.inputs:
+            try:
+                midi_input.close()
+            except ValueError:
+                # a midi file is still being played by its reader thread, the thread is a
+                # daemon and ends with the program
+                pass
+
+#               - - End Of MidiIngest Class --                #
+
+
+# **********************************************************************************************
+#   * Class:            DeviceAudioOutput
+#   * Purpose:          Audio output backend playing output_callback through a sounddevice
+#                       output stream
+#   * Data Members:     stream              -> sounddevice output stream, None until started
+# **********************************************************************************************
+class DeviceAudioOutput:
+    # ******************************************************************************************
+    # Purpose:          DeviceAudioOutput default constructor
+    # ******************************************************************************************
+    def __init__(self):
+        self.stream = None
+
+    # ******************************************************************************************
+    # Purpose:          Open the output stream with the synth's configuration and start it
+    # ******************************************************************************************
+    def start(self):
+        import sounddevice
+
+        self.stream = sounddevice.OutputStream(
+            samplerate=synth.sample_rate,
+            channels=1,
+            blocksize=synth.block_size,
+            callback=output_callback,
+        )
+        self.stream.start()
+
+    # ******************************************************************************************
+    # Purpose:          Stop and close the output stream
+    # ******************************************************************************************
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream.close()
+            self.stream = None
+
+#               - - End Of DeviceAudioOutput Class --                #
+
+
+# **********************************************************************************************
+#   * Class:            ClockedAudioOutput
+#   * Purpose:          Audio output backend that calls output_callback from its own thread,
+#                       paced by the clock like a sound card would, and either writes the
+#                       blocks to a 16 bit wav file or throws them away as a null sink
+#   * Data Members:     path                -> path of the wav file to write, None for a
+#                                              null sink
+#                       running             -> False once the backend has been told to stop
+#                       thread              -> thread calling output_callback, None until started
+# **********************************************************************************************
+class ClockedAudioOutput:
+    # ******************************************************************************************
+    # Purpose:          ClockedAudioOutput default constructor
+    # Parameters:       path        -> path of the wav file to write, None for a null sink
+    # ******************************************************************************************
+    def __init__(self, path=None):
+        self.path = path
+        self.running = False
+        self.thread = None
+
+    # ******************************************************************************************
+    # Purpose:          Start calling output_callback every block
+    # ******************************************************************************************
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # ******************************************************************************************
+    # Purpose:          Render a block every block time until stopped
+    # ******************************************************************************************
+    def run(self):
+        frames = synth.block_size
+        period = frames / synth.sample_rate
+        block = np.zeros((frames, 1), dtype=np.float32)
+        pcm = np.zeros(frames, dtype=np.int16)
+
+        output = None
+        if self.path is not None:
+            output = open_wav(self.path, synth.sample_rate)
+
+        deadline = time.perf_counter()
+        while self.running:
+            output_callback(block, frames, None, None)
+            if output is not None:
+                write_wav_block(output, block[:, 0], pcm)
+
+            deadline += period
+            delay = deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        if output is not None:
+            output.close()
+
+    # ******************************************************************************************
+    # Purpose:          Stop the thread and close the wav file
+    # ******************************************************************************************
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+#               - - End Of ClockedAudioOutput Class --                #
+
+
+# **********************************************************************************************
+#   * Class:            StreamAudioOutput
+#   * Purpose:          Audio output backend for running the synth as a headless service, blocks
+#                       of output_callback are streamed as pcm to stdout, a file or named pipe,
+#                       or the consumer connected to a local tcp socket. A render thread fills a
+#                       ring of blocks and a writer thread drains it into the consumer, paced
+#                       either by the clock or by how fast the consumer reads. When the consumer
+#                       falls a full ring behind the render thread either waits for it (block) or
+#                       keeps the clock and throws the new blocks away (drop), consumer pacing
+#                       always waits
+#   * Data Members:     target              -> 'stdout', a file path, or tcp:[HOST:]PORT
+#                       address             -> (host, port) of a tcp target, None otherwise
+#                       sample_format       -> 's16' or 'f32' little endian samples
+#                       framed              -> whether every consumer first gets a wav header
+#                       pace                -> 'realtime' or 'consumer'
+#                       policy              -> 'drop' or 'block' when the ring is full
+#                       frames              -> samples in every block
+#                       capacity            -> number of blocks the ring holds
+#                       blocks              -> (capacity, frames, 1) ring of rendered blocks
+#                       scratch             -> block rendered into when a block is dropped
+#                       level, pcm          -> buffers a block is converted to 16 bit in
+#                       write_index         -> count of blocks put into the ring
+#                       read_index          -> count of blocks taken out of the ring
+#                       condition           -> guards the indexes and wakes the waiting thread
+#                       running             -> whether the stream is running, cleared when it is
+#                                              stopped or a stdout or pipe consumer goes away
+#                       fd                  -> file descriptor of a stdout or file consumer
+#                       listener            -> listening socket of a tcp target
+#                       connection          -> socket of the connected tcp consumer
+#                       streamed            -> number of blocks written to consumers
+#                       dropped             -> number of blocks thrown away
+#                       threads             -> render and writer threads
+# **********************************************************************************************
+class StreamAudioOutput:
+    # ******************************************************************************************
+    # Purpose:          StreamAudioOutput default constructor, nothing is opened until started
+    # Parameters:       target          -> 'stdout', a file path, or tcp:[HOST:]PORT
+    #                   sample_format   -> 's16' or 'f32'
+    #                   framed          -> True to start every stream with a wav header
+    #                   pace            -> 'realtime' or 'consumer'
+    #                   policy          -> 'drop' or 'block'
+    #                   seconds         -> seconds of audio the ring holds
+    # ******************************************************************************************
+    def __init__(self, target='stdout', sample_format='s16', framed=False, pace='realtime',
+                 policy='drop', seconds=0.1):
+        self.target = target
+        self.address = parse_endpoint(target[4:]) if target.startswith('tcp:') else None
+        self.sample_format = sample_format
+        self.framed = framed
+        self.pace = pace
+        self.policy = policy
+        self.frames = synth.block_size
+        self.capacity = max(2, int(seconds * synth.sample_rate) // self.frames)
+        self.blocks = np.zeros((self.capacity, self.frames, 1), dtype=np.float32)
+        self.scratch = np.zeros((self.frames, 1), dtype=np.float32)
+        self.level = np.zeros(self.frames, dtype=np.float32)
+        self.pcm = np.zeros(self.frames, dtype=np.int16)
+        self.write_index = 0
+        self.read_index = 0
+        self.condition = threading.Condition()
+        self.running = False
+        self.fd = None
+        self.listener = None
+        self.connection = None
+        self.streamed = 0
+        self.dropped = 0
+        self.threads = []
+
+    # ******************************************************************************************
+    # Purpose:          Start the render and writer threads
+    # ******************************************************************************************
+    def start(self):
+        self.running = True
+        for target in (self.render, self.write):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    # ******************************************************************************************
+    # Purpose:          Render blocks into the ring until stopped, runs on the render thread
+    # ******************************************************************************************
+    def render(self):
+        frames = self.frames
+        period = frames / synth.sample_rate
+        deadline = time.perf_counter()
+        while self.running:
+            with self.condition:
+                full = self.write_index - self.read_index >= self.capacity
+                if full and (self.pace == 'consumer' or self.policy == 'block'):
+                    # backpressure, the clock starts over once the consumer has caught up
+                    self.condition.wait(0.1)
+                    deadline = time.perf_counter()
+                    continue
+
+            # a dropped block is still rendered so the engine keeps time with the clock
+            block = self.scratch if full else self.blocks[self.write_index % self.capacity]
+            output_callback(block, frames, None, None)
+            if full:
+                self.dropped += 1
+            else:
+                with self.condition:
+                    self.write_index += 1
+                    self.condition.notify_all()
+
+            if self.pace == 'realtime':
+                deadline += period
+                delay = deadline - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+    # ******************************************************************************************
+    # Purpose:          Write the ring into the consumer until stopped, runs on the writer
+    #                   thread. A tcp consumer that goes away is replaced by the next one to
+    #                   connect, a stdout or pipe consumer going away stops the stream
+    # ******************************************************************************************
+    def write(self):
+        while self.running:
+            if not self.connect():
+                continue
+            with self.condition:
+                while self.running and self.read_index == self.write_index:
+                    self.condition.wait(0.1)
+                if not self.running:
+                    break
+            try:
+                self.send(self.encode(self.blocks[self.read_index % self.capacity]))
+            except OSError:
+                self.disconnect()
+                continue
+            with self.condition:
+                self.read_index += 1
+                self.streamed += 1
+                self.condition.notify_all()
+
+    # ******************************************************************************************
+    # Purpose:          Open the consumer if it is not open yet
+    # Returns:          {bool}      -> whether a consumer is open
+    # ******************************************************************************************
+    def connect(self):
+        if self.fd is not None or self.connection is not None:
+            return True
+        if self.address is not None:
+            if self.listener is None:
+                self.listener = socket.create_server(self.address)
+                self.listener.settimeout(0.5)
+            try:
+                self.connection, address = self.listener.accept()
+            except socket.timeout:
+                return False
+            self.connection.settimeout(None)
+            print(f"Streaming to {address[0]}:{address[1]}", file=sys.stderr)
+        elif self.target == 'stdout':
+            self.fd = sys.__stdout__.fileno()
+        else:
+            # opening a named pipe waits here until a reader opens the other end
+            self.fd = os.open(self.target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+
+        # a consumer of a live stream starts from the newest audio, not what piled up for it
+        if self.pace == 'realtime':
+            with self.condition:
+                self.read_index = self.write_index
+                self.condition.notify_all()
+        try:
+            if self.framed:
+                self.send(wav_stream_header(synth.sample_rate, self.sample_format))
+        except OSError:
+            self.disconnect()
+            return False
+        return True
+
+    # ******************************************************************************************
+    # Purpose:          Close the consumer after it went away
+    # ******************************************************************************************
+    def disconnect(self):
+        if self.connection is not None:
+            print("Consumer disconnected, waiting for the next one", file=sys.stderr)
+            self.connection.close()
+            self.connection = None
+        else:
+            self.running = False
+
+    # ******************************************************************************************
+    # Purpose:          Convert a block into the bytes of the stream
+    # Parameters:       block       -> (frames, 1) float32 block
+    # Returns:          {memoryview}    -> the bytes, valid until the next call
+    # ******************************************************************************************
+    def encode(self, block):
+        if self.sample_format == 'f32':
+            return memoryview(block).cast('B')
+        np.multiply(block[:, 0], 32767, out=self.level)
+        np.clip(self.level, -32768, 32767, out=self.pcm, casting='unsafe')
+        return memoryview(self.pcm).cast('B')
+
+    # ******************************************************************************************
+    # Purpose:          Write bytes to the consumer, waiting for it as long as it takes
+    # Parameters:       data        -> bytes to write
+    # ******************************************************************************************
+    def send(self, data):
+        if self.connection is not None:
+            self.connection.sendall(data)
+            return
+        data = memoryview(data)
+        while len(data):
+            data = data[os.write(self.fd, data):]
+
+    # ******************************************************************************************
+    # Purpose:          Stop the threads and close the consumer
+    # ******************************************************************************************
+    def stop(self):
+        self.running = False
+        with self.condition:
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join(1.0)
+        self.threads = []
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+        if self.listener is not None:
+            self.listener.close()
+            self.listener = None
+        if self.fd is not None and self.target != 'stdout':
+            os.close(self.fd)
+        self.fd = None
+
+#               - - End Of StreamAudioOutput Class --                #
+
+
+# *********************************************************************************************
+# Purpose:      Create a midi input backend, nothing is opened until this is called
+# Parameters:   kind            -> 'port' for a midi device or existing virtual port, 'virtual'
+#                                  to create a new virtual port, 'file' to play a midi file,
+#                                  'capture' to replay a capture file, 'null' for no input
+#               name            -> port name for 'port' and 'virtual', file path for 'file'
+#                                  and 'capture'
+# Returns:      {object}        -> midi input backend with receive() and close()
+# *********************************************************************************************
+def open_midi_input(kind, name=None):
+    if kind == 'port':
+        return PortMidiInput(name or 'loopMIDI Port 0')
+    elif kind == 'virtual':
+        return PortMidiInput(name or 'synthTHIS', virtual=True)
+    elif kind == 'file':
+        return FileMidiInput(name)
+    elif kind == 'capture':
+        return CaptureMidiInput(name)
+    elif kind == 'null':
+        return NullMidiInput()
+    raise ValueError(f"unknown midi input backend: {kind}")
+
+
+# *********************************************************************************************
+# Purpose:      Create an audio output backend, nothing is opened until it is started
+# Parameters:   kind            -> 'device' for the sound card, 'file' to write a wav file in
+#                                  real time, 'null' to throw the audio away
+#               path            -> wav file path for 'file'
+# Returns:      {object}        -> audio output backend with start() and stop()
+# *********************************************************************************************
+def open_audio_output(kind, path=None):
+    if kind == 'device':
+        return DeviceAudioOutput()
+    elif kind == 'file':
+        return ClockedAudioOutput(path)
+    elif kind == 'null':
+        return ClockedAudioOutput()
+    raise ValueError(f"unknown audio output backend: {kind}")
+
+
+# *********************************************************************************************
+# Purpose:      Open a mono 16 bit wav file for writing
+# Parameters:   path            -> path of the .wav file to write
+#               rate            -> sample rate in sps of the file
+# Returns:      output          -> open wave object
+# *********************************************************************************************
+def open_wav(path, rate):
+    output = wave.open(path, 'wb')
+    output.setnchannels(1)
+    output.setsampwidth(2)
+    output.setframerate(rate)
+    return output
+
+
+# *********************************************************************************************
+# Purpose:      Convert a block of samples to 16 bit and append it to a wav file, the samples
+#               are scaled in place
+# Parameters:   output          -> open wave object
+#               samples         -> numpy array holding the samples, from -1 to 1
+#               pcm             -> int16 numpy array at least as long as samples to convert into
+# *********************************************************************************************
+def write_wav_block(output, samples, pcm):
+    frames = len(samples)
+    samples *= 32767
+    np.clip(samples, -32768, 32767, out=pcm[:frames], casting='unsafe')
+    output.writeframes(pcm[:frames].tobytes())
+
+
+# *********************************************************************************************
+# Purpose:      Header of a mono wav stream whose length is not known up front, the sizes are
+#               left at their largest value as streaming players expect
+# Parameters:   rate            -> sample rate in sps
+#               sample_format   -> 's16' for 16 bit pcm or 'f32' for 32 bit float samples
+# Returns:      {bytes}         -> the 44 byte header
+# *********************************************************************************************
+def wav_stream_header(rate, sample_format):
+    width = 4 if sample_format == 'f32' else 2
+    code = 3 if sample_format == 'f32' else 1
+    return (b'RIFF' + struct.pack('<I', 0xFFFFFFFF) + b'WAVE'
+            + b'fmt ' + struct.pack('<IHHIIHH', 16, code, 1, rate, rate * width, width, width * 8)
+            + b'data' + struct.pack('<I', 0xFFFFFFFF))
+
+
+# *********************************************************************************************
+# Purpose:      Playable messages of a midi file with the sample each one happens at
+# Parameters:   midi            -> mido MidiFile to read
+#               rate            -> sample rate in sps
+# Returns:      {generator}     -> (sample, mido message) pairs in time order
+# *********************************************************************************************
+def midi_file_events(midi, rate):
+    position = 0.0
+
+    # iterating a midi file gives each message with its delta time in seconds
+    for mesg in midi:
+        position += mesg.time
+        if mesg.type in ('note_on', 'note_off', 'pitchwheel', 'control_change'):
+            yield round(position * rate), mesg
+
+
+# *********************************************************************************************
+# Purpose:      Memory-map the records of a capture file, a record cut short by a crash at the
+#               end of the file is left out
+# Parameters:   path            -> path of the capture file
+# Returns:      records         -> numpy structured array of CAPTURE_DTYPE records
+# *********************************************************************************************
+def read_capture(path):
+    count = os.path.getsize(path) // CAPTURE_DTYPE.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=CAPTURE_DTYPE)
+    return np.memmap(path, dtype=CAPTURE_DTYPE, mode='r', shape=(count,))
+
+
+# *********************************************************************************************
+# Purpose:      Turn a capture record back into the midi message it was made from
+# Parameters:   record          -> one CAPTURE_DTYPE record
+# Returns:      {mido.Message}  -> the message
+# *********************************************************************************************
+def capture_message(record):
+    import mido
+
+    return mido.Message.from_bytes(record['data'][:record['size']].tolist())
+
+
+# *********************************************************************************************
+# Purpose:      Playable messages of a capture file with the sample each one happens at, the
+#               first message happens at sample 0
+# Parameters:   records         -> numpy structured array of CAPTURE_DTYPE records
+#               rate            -> sample rate in sps
+# Returns:      {generator}     -> (sample, mido message) pairs in time order
+# *********************************************************************************************
+def capture_events(records, rate):
+    if len(records) == 0:
+        return
+    stamps = records['time'] - records['time'][0]
+    samples = np.rint(stamps * (rate / 1e9)).astype(np.int64)
+    for when, record in zip(samples.tolist(), records):
+        mesg = capture_message(record)
+        if mesg.type in ('note_on', 'note_off', 'pitchwheel', 'control_change'):
+            yield when, mesg
+
+
+# *********************************************************************************************
+# Purpose:      Render timed midi messages through output_callback as fast as the cpu allows,
+#               each message is queued with its exact sample and applied inside the chunk
+# Parameters:   events          -> iterable of (sample, mido message) pairs in time order
+#               write           -> function called with every rendered chunk
+#               chunk           -> most samples to render in one call of output_callback
+#               length          -> samples to render in total, None to release the notes
+#                                  still held at the end and render until their release
+#                                  tails and the effects have rung out
+# Returns:      rendered        -> samples rendered
+# *********************************************************************************************
+def render_events(events, write, chunk=1024, length=None):
+    block = np.zeros((chunk, 1), dtype=np.float32)
+    mixer.prepare(chunk)
+    effects.prepare(chunk)
+    render_ahead.configure(0, chunk, synth.sample_rate)
+    rendered = 0
+
+    # render and write samples up to a sample number
+    def render_until(target):
+        nonlocal rendered
+        while rendered < target:
+            frames = min(chunk, target - rendered)
+            output_callback(block[:frames], frames, None, None)
+            write(block[:frames, 0])
+            rendered += frames
+
+    for when, mesg in events:
+        while when >= rendered + chunk or event_queue.space() == 0:
+            render_until(rendered + chunk)
+        handle_midi_message(mesg, when)
+
+    # let the last queued events play and the release tails of the last notes ring out
+    if length is not None:
+        render_until(length)
+        return rendered
+    while event_queue.space() <= event_queue.mask:
+        render_until(rendered + chunk)
+
+    # a note the file never ends would hold at its sustain level forever, so every key still
+    # down is let go at the end of the file and the ring out is capped at the longest release
+    mixer.release()
+    ring_end = rendered + mixer.release_tail() + CONTROL_RATE
+    while mixer.active_voices() and rendered < ring_end:
+        render_until(rendered + chunk)
+    render_until(rendered + effects.tail)
+
+    return rendered
+
+
+# *********************************************************************************************
+# Purpose:      Render a midi file into a 16 bit wav file without an audio device, as fast as
+#               the cpu allows. Audio is written to the file one chunk at a time so the whole
+#               render never has to be held in memory, and each midi message is applied at
+#               its exact sample through the event queue
+# Parameters:   midi_path       -> path of the .mid file to render
+#               wav_path        -> path of the .wav file to write
+#               chunk           -> most samples to render in one call of output_callback
+#               processes       -> worker processes to split the song across by midi channel,
+#                                  1 renders in this process
+# Returns:      speed           -> how many times faster than real time the render ran
+# *********************************************************************************************
+def render_midi_file(midi_path, wav_path, chunk=1024, processes=1):
+    import mido
+
+    if processes > 1:
+        return render_midi_file_parallel(midi_path, wav_path, processes, chunk)
+
+    midi = mido.MidiFile(midi_path)
+    rate = synth.sample_rate
+    pcm = np.zeros(chunk, dtype=np.int16)
+    output = open_wav(wav_path, rate)
+
+    start = time.perf_counter()
+    rendered = render_events(midi_file_events(midi, rate),
+                             lambda samples: write_wav_block(output, samples, pcm), chunk)
+    elapsed = time.perf_counter() - start
+    output.close()
+
+    seconds = rendered / rate
+    speed = seconds / elapsed if elapsed > 0 else float('inf')
+    print(f"Rendered {seconds:.2f} s of audio in {elapsed:.2f} s ({speed:.1f}x real time)")
+    return speed
+
+
+# *********************************************************************************************
+# Purpose:      Settings a worker process needs to render its parts exactly like this process,
+#               the effects are left to this process
+# Returns:      settings        -> dictionary of synth attributes and envelope globals
+# *********************************************************************************************
+def engine_settings():
+    return {
+        'osc_type': synth.osc_type,
+        'sample_rate': synth.sample_rate,
+        'polyphony': synth.polyphony,
+        'steal_policy': synth.steal_policy,
+        'attack': attack,
+        'decay': decay,
+        'sustain': sustain,
+        'release': release,
+        'envelope_curve': envelope_curve,
+        'parts': [(part.osc_type, part.adsr, part.volume, part.brightness) for part in parts],
+        'routes': modulation_routes,
+        'lfo_rates': (synth.lfo1_rate, synth.lfo2_rate),
+        'sample_file': synth.sample_file,
+        'filter': (synth.filter_type, synth.filter_cutoff, synth.filter_resonance,
+                   synth.filter_velocity, synth.filter_cc),
+    }
+
+
+# -- START - offline render constants -- #
+
+# RENDER_WINDOW             -> samples every part of a parallel render fills into the shared
+#                              memory buffer before this process mixes them into the wav file,
+#                              so the buffer stays the same size however long the song is
+RENDER_WINDOW = 65536
+
+# -- END - offline render constants -- #
+
+
+# *********************************************************************************************
+# Purpose:      Worker process side of a parallel render, renders a group of parts of the song
+#               one window at a time into its row of the shared memory mix buffer, without
+#               scaling by the voice count or any effects. The voice count of every rendered
+#               piece goes into the same row of the shared voice count buffer so the mixing
+#               process can scale the whole mix like a single process render. After filling a
+#               window the worker waits at the barrier until the window has been mixed
+# Parameters:   name            -> name of the shared memory block holding both buffers
+#               row             -> row of the buffers this worker renders into
+#               rows            -> number of rows in the buffers
+#               length          -> samples to render in total
+#               events          -> list of (sample, midi message bytes) pairs of the parts
+#               settings        -> dictionary from engine_settings
+#               chunk           -> most samples to render in one call of output_callback
+#               barrier         -> multiprocessing Barrier of every worker and the mixing
+#                                  process
+# *********************************************************************************************
+def render_part(name, row, rows, length, events, settings, chunk, barrier):
+    global attack, decay, sustain, release, envelope_curve, sample_clock, modulation_routes
+    global count_voices
+    import mido
+    from multiprocessing import shared_memory
+
+    synth.osc_type = settings['osc_type']
+    synth.sample_rate = settings['sample_rate']
+    synth.polyphony = settings['polyphony']
+    synth.steal_policy = settings['steal_policy']
+    (synth.filter_type, synth.filter_cutoff, synth.filter_resonance, synth.filter_velocity,
+     synth.filter_cc) = settings['filter']
+    load_filter(synth.filter_type)
+    modulation_routes = settings['routes']
+    synth.lfo1_rate, synth.lfo2_rate = settings['lfo_rates']
+    synth.sample_file = settings['sample_file']
+    instrument.load(synth.sample_file)
+    synth.log = False
+    attack = settings['attack']
+    decay = settings['decay']
+    sustain = settings['sustain']
+    release = settings['release']
+    envelope_curve = settings['envelope_curve']
+    for part, (osc_type, adsr, volume, brightness) in zip(parts, settings['parts']):
+        part.osc_type = osc_type
+        part.adsr = adsr
+        part.volume = volume
+        part.brightness = brightness
+    build_wavetables(synth.sample_rate)
+
+    # the effects run once on the whole mix in the mixing process
+    synth.delay_time = 0
+    synth.reverb_file = None
+    effects.configure()
+    mixer.configure(1)
+    mixer.clear()
+    event_queue.read_index = event_queue.write_index
+    sample_clock = 0
+
+    # the voice counts of the pieces of the chunk being rendered, in samples
+    counts = np.zeros(chunk, dtype=np.int32)
+    filled = 0
+
+    def count(frames, voices):
+        nonlocal filled
+        counts[filled:filled + frames] = voices
+        filled += frames
+
+    count_voices = count
+    memory = shared_memory.SharedMemory(name=name)
+    try:
+        out = np.ndarray((rows, RENDER_WINDOW), dtype=np.float32, buffer=memory.buf)[row]
+        voices = np.ndarray((rows, RENDER_WINDOW), dtype=np.int32, buffer=memory.buf,
+                            offset=rows * RENDER_WINDOW * 4)[row]
+        position = 0
+        written = 0
+
+        # copy every rendered chunk and its voice counts straight into the shared rows, and
+        # hand every full window over to the mixing process before rendering the next one
+        def write(samples):
+            nonlocal position, written, filled
+            taken = 0
+            while taken < len(samples):
+                frames = min(len(samples) - taken, RENDER_WINDOW - position)
+                out[position:position + frames] = samples[taken:taken + frames]
+                voices[position:position + frames] = counts[taken:taken + frames]
+                taken += frames
+                position += frames
+                written += frames
+                if position == RENDER_WINDOW or written == length:
+                    barrier.wait()
+                    if written < length:
+                        barrier.wait()
+                    position = 0
+            filled = 0
+
+        messages = ((when, mido.Message.from_bytes(data)) for when, data in events)
+        render_events(messages, write, chunk, length)
+        del out, voices
+    except BaseException:
+        barrier.abort()
+        raise
+    finally:
+        count_voices = None
+        memory.close()
+
+
+# *********************************************************************************************
+# Purpose:      Render a midi file on worker processes, the midi channels of the song are
+#               shared out between the workers by how many notes they play and every worker
+#               renders its parts into its own row of a shared memory buffer one window at a
+#               time. This process sums the rows of every window, scales the mix by the voice
+#               count of all the parts together and runs the effects on it like a single
+#               process render, while the workers wait, so memory stays bounded however long
+#               the song is
+# Parameters:   midi_path       -> path of the .mid file to render
+#               wav_path        -> path of the .wav file to write
+#               processes       -> most worker processes to use
+#               chunk           -> most samples to render in one call of output_callback
+# Returns:      speed           -> how many times faster than real time the render ran
+# *********************************************************************************************
+def render_midi_file_parallel(midi_path, wav_path, processes, chunk=1024):
+    import mido
+    import multiprocessing
+    from multiprocessing import shared_memory
+
+    start = time.perf_counter()
+    midi = mido.MidiFile(midi_path)
+    rate = synth.sample_rate
+
+    parts = dict()
+    held = set()
+    last = 0
+    for when, mesg in midi_file_events(midi, rate):
+        parts.setdefault(mesg.channel, []).append((when, mesg.bytes()))
+        if mesg.type == 'note_on' and mesg.velocity > 0:
+            held.add((mesg.channel, mesg.note))
+        elif mesg.type in ('note_on', 'note_off'):
+            held.discard((mesg.channel, mesg.note))
+        last = when
+
+    # like a single process render, the notes the file never ends are let go at its end and
+    # there is room for the longest release of any part and the effects to ring out
+    for channel, note in sorted(held):
+        parts[channel].append((last, mido.Message('note_off', channel=channel, note=note).bytes()))
+    effects.configure()
+    effects.prepare(chunk)
+    length = last + mixer.release_tail() + CONTROL_RATE + chunk + effects.tail
+
+    # the busiest channels are handed out first, each to the worker with the fewest events
+    rows = max(1, min(processes, len(parts)))
+    groups = [[] for row in range(rows)]
+    for channel in sorted(parts, key=lambda channel: -len(parts[channel])):
+        group = min(groups, key=len)
+        group.extend(parts[channel])
+    for group in groups:
+        group.sort(key=lambda event: event[0])
+
+    output = open_wav(wav_path, rate)
+    memory = shared_memory.SharedMemory(create=True, size=rows * RENDER_WINDOW * 8)
+    workers = []
+    try:
+        mix = np.ndarray((rows, RENDER_WINDOW), dtype=np.float32, buffer=memory.buf)
+        voices = np.ndarray((rows, RENDER_WINDOW), dtype=np.int32, buffer=memory.buf,
+                            offset=rows * RENDER_WINDOW * 4)
+        mix.fill(0.0)
+        voices.fill(0)
+        settings = engine_settings()
+        barrier = multiprocessing.Barrier(rows + 1)
+        for row, events in enumerate(groups):
+            worker = multiprocessing.Process(target=render_part,
+                                             args=(memory.name, row, rows, length, events,
+                                                   settings, chunk, barrier))
+            worker.start()
+            workers.append(worker)
+
+        block = np.zeros(chunk, dtype=np.float32)
+        total = np.zeros(chunk, dtype=np.int32)
+        pcm = np.zeros(chunk, dtype=np.int16)
+        try:
+            for window in range(0, length, RENDER_WINDOW):
+                size = min(RENDER_WINDOW, length - window)
+                barrier.wait()
+                for begin in range(0, size, chunk):
+                    frames = min(chunk, size - begin)
+                    np.add.reduce(mix[:, begin:begin + frames], axis=0, out=block[:frames])
+                    np.add.reduce(voices[:, begin:begin + frames], axis=0, out=total[:frames])
+                    np.maximum(total[:frames], 8, out=total[:frames])
+                    block[:frames] /= total[:frames]
+                    if effects.effects:
+                        effects.process(block[:frames])
+                    write_wav_block(output, block[:frames], pcm)
+                if window + size < length:
+                    barrier.wait()
+        except threading.BrokenBarrierError:
+            raise RuntimeError('a part of the parallel render failed') from None
+        except BaseException:
+            barrier.abort()
+            raise
+        del mix, voices
+    finally:
+        output.close()
+        for worker in workers:
+            worker.join()
+        memory.close()
+        memory.unlink()
+
+    elapsed = time.perf_counter() - start
+    seconds = length / rate
+    speed = seconds / elapsed if elapsed > 0 else float('inf')
+    print(f"Rendered {seconds:.2f} s of audio from {len(parts)} channels on "
+          f"{rows} processes in {elapsed:.2f} s ({speed:.1f}x real time)")
+    return speed
+
+
+# *********************************************************************************************
+# Purpose:      Replay a capture file through the engine and print the output callback
+#               telemetry, as a repeatable stress test of a captured session. As fast as
+#               possible every message is queued at its exact sample and the blocks are rendered
+#               back to back, in real time the messages arrive through the live midi path while
+#               a clocked output renders a block every block time
+# Parameters:   capture_path    -> path of the capture file to replay
+#               wav_path        -> path of a .wav file to write, None for a null sink
+#               realtime        -> True to replay at the speed the session was captured
+#               frames          -> samples in every block handed to output_callback
+# Returns:      summary         -> dictionary of the telemetry summary of the replay
+# *********************************************************************************************
+def replay_capture(capture_path, wav_path=None, realtime=False, frames=1024):
+    rate = synth.sample_rate
+    reporter = TelemetryReporter(telemetry)
+    start = time.perf_counter()
+
+    # a capture often stops with notes still held, so the replay only rings out for as long as
+    # the longest release and the effects take instead of waiting for every voice to end
+    ring_out = effects.tail + max(part.envelope()[2] - part.envelope()[1] for part in parts)
+
+    if realtime:
+        synth.block_size = frames
+        render_ahead.configure(synth.latency, frames, rate)
+        mixer.prepare(max(frames, QUANTUM_LARGEST))
+        effects.prepare(max(frames, QUANTUM_LARGEST))
+        midi_input = CaptureMidiInput(capture_path)
+        audio_output = ClockedAudioOutput(wav_path)
+        reporter.start()
+        render_ahead.start()
+        audio_output.start()
+        while process_midi_event(midi_input):
             pass
-    elif option == 2: synth.current_setup()
-    elif option == 3: synth.configuration_tree()
-    elif option == 4: quit()
+        time.sleep((ring_out + render_ahead.depth + frames) / rate)
+        audio_output.stop()
+        render_ahead.stop()
+        midi_input.close()
+        print(f"Replayed {time.perf_counter() - start:.2f} s of midi in real time")
     else:
-        print("Invalid option, try again...")
-        break
-    
\ No newline at end of file
+        pcm = np.zeros(frames, dtype=np.int16)
+        output = None if wav_path is None else open_wav(wav_path, rate)
+        blocks = 0
+
+        # drain the telemetry ring long before the blocks rendered back to back fill it
+        def write(samples):
+            nonlocal blocks
+            if output is not None:
+                write_wav_block(output, samples, pcm)
+            blocks += 1
+            if blocks % 1024 == 0:
+                reporter.collect()
+
+        records = read_capture(capture_path)
+        length = ring_out
+        if len(records):
+            length += round((int(records['time'][-1]) - int(records['time'][0])) * rate / 1e9)
+        rendered = render_events(capture_events(records, rate), write, frames, length)
+        elapsed = time.perf_counter() - start
+        if output is not None:
+            output.close()
+        seconds = rendered / rate
+        speed = seconds / elapsed if elapsed > 0 else float('inf')
+        print(f"Replayed {seconds:.2f} s of audio in {elapsed:.2f} s ({speed:.1f}x real time)")
+
+    reporter.report()
+    return reporter.summary()
+
+
+# *********************************************************************************************
+# Purpose:      Listen for midi while a stream is running, until the panic button is pressed,
+#               every input has ended or the stream stopped because its consumer went away
+# Parameters:   ingest          -> MidiIngest to listen with
+#               output          -> StreamAudioOutput being streamed to
+# Returns:      {bool}          -> False when the panic button was pressed
+# *********************************************************************************************
+async def serve_midi(ingest, output):
+    listening = asyncio.ensure_future(ingest.run())
+    while output.running and not listening.done():
+        await asyncio.sleep(0.1)
+    if not listening.done():
+        listening.cancel()
+        return True
+    return listening.result()
+
+
+# *********************************************************************************************
+# Purpose:      Run the synth as a headless service without the configuration menu, the output
+#               is streamed until the panic button is pressed, a stdout or pipe consumer goes
+#               away or the server is interrupted. Status messages go to stderr so they never
+#               end up in a stream on stdout
+# Parameters:   output          -> StreamAudioOutput to stream to
+#               ingest          -> MidiIngest to listen with
+# *********************************************************************************************
+def run_server(output, ingest):
+    render_ahead.configure(synth.latency, synth.block_size, synth.sample_rate)
+    mixer.configure(synth.render_threads)
+    mixer.prepare(max(synth.block_size, QUANTUM_LARGEST))
+    effects.prepare(max(synth.block_size, QUANTUM_LARGEST))
+    build_wavetables(synth.sample_rate)
+
+    render_ahead.start()
+    output.start()
+    print(f"Streaming {output.sample_format}{' wav' if output.framed else ''} at "
+          f"{synth.sample_rate} sps to {output.target}, {output.pace} pace, "
+          f"{output.policy} when the consumer falls behind", file=sys.stderr)
+    try:
+        if asyncio.run(serve_midi(ingest, output)):
+            # every input has ended, the stream carries on until it is stopped
+            while output.running:
+                time.sleep(0.1)
+    except KeyboardInterrupt:
+        pass
+    output.stop()
+    render_ahead.stop()
+    ingest.close()
+    print(f"Streamed {output.streamed} blocks, dropped {output.dropped}", file=sys.stderr)
+    if midi_capture is not None:
+        midi_capture.close()
+        print(f"Captured {midi_capture.count} midi messages to {midi_capture.path}",
+              file=sys.stderr)
+
+
+# *********************************************************************************************
+# Purpose:      Time one benchmark case by driving output_callback into a null audio sink,
+#               every call is timed on its own since a callback that renders a whole quantum
+#               can miss its deadline while the mean still looks fine
+# Parameters:   voice_count     -> number of voices to keep sounding
+#               frames          -> block size handed to output_callback
+#               workload        -> 'steady' for voices held in sustain, 'envelope' for voices
+#                                  retriggered so they are always in their attack or release
+#               seconds         -> seconds of audio to render for the measurement
+# Returns:      {dict}          -> measured ns per sample, p99 and max time per callback and
+#                                  the real time headroom left by each of them
+# *********************************************************************************************
+def benchmark_case(voice_count, frames, workload, seconds):
+    global sample_clock
+
+    rate = synth.sample_rate
+    sink = np.zeros((frames, 1), dtype=np.float32)
+    keys = range(voice_count)
+    mixer.clear()
+    render_ahead.configure(synth.latency, frames, rate)
+    mixer.prepare(max(frames, render_ahead.quantum))
+    synth.polyphony = voice_count
+    event_queue.read_index = event_queue.write_index
+    sample_clock = 0
+
+    for key in keys:
+        queue_event(EVENT_NOTE_ON, 0, key, 127, 0)
+
+    # let every voice reach its sustain before a steady state measurement
+    if workload == 'steady':
+        while sample_clock < (attack * 2) * rate:
+            output_callback(sink, frames, None, None)
+
+    # retrigger every voice once per attack time, swapping between note on and note off
+    retrigger = max(1, int(attack * rate) // frames)
+    blocks = max(10, int(seconds * rate) // frames)
+    held = True
+    durations = np.zeros(blocks, dtype=np.float64)
+
+    for block in range(blocks):
+        if workload == 'envelope' and block % retrigger == 0:
+            held = not held
+            kind = EVENT_NOTE_ON if held else EVENT_NOTE_OFF
+            for key in keys:
+                event_queue.push(sample_clock, kind, 0, key, 127)
+        start = time.perf_counter()
+        output_callback(sink, frames, None, None)
+        durations[block] = time.perf_counter() - start
+
+    per_block = durations.mean()
+    p99 = float(np.percentile(durations, 99))
+    longest = float(durations.max())
+    deadline = frames / rate
+    return {
+        'quantum': render_ahead.quantum,
+        'ns_per_sample': per_block / frames * 1e9,
+        'block_us': per_block * 1e6,
+        'p99_us': p99 * 1e6,
+        'max_us': longest * 1e6,
+        'deadline_us': deadline * 1e6,
+        'headroom': 1.0 - p99 / deadline,
+        'max_headroom': 1.0 - longest / deadline,
+    }
+
+
+# *********************************************************************************************
+# Purpose:      Sweep the render path over voice counts, block sizes, oscillator types, sample
+#               rates, workloads and latency budgets without any audio or midi device, print
+#               every case and save the results as json so runs of different versions can be
+#               compared
+# Parameters:   path            -> path of the json file to write
+#               voice_counts    -> list of voice counts to sweep
+#               block_sizes     -> list of block sizes to sweep
+#               osc_types       -> list of oscillator types to sweep
+#               sample_rates    -> list of sample rates to sweep
+#               workloads       -> list of workloads to sweep, 'steady' and/or 'envelope'
+#               latencies       -> list of latency budgets in seconds to sweep
+#               seconds         -> seconds of audio to render for each case
+#               compare         -> path of an earlier json result to compare against, or None
+# Returns:      results         -> dictionary that was written to the json file
+# *********************************************************************************************
+def run_benchmark(path, voice_counts, block_sizes, osc_types, sample_rates, workloads,
+                  latencies, seconds=0.25, compare=None):
+    previous = dict()
+    if compare is not None:
+        with open(compare) as file:
+            for case in json.load(file)['cases']:
+                previous[(case['voices'], case['block_size'], case['osc_type'],
+                          case['sample_rate'], case['workload'], case.get('latency'))] = case
+
+    cases = []
+    polyphony = synth.polyphony
+    budget = synth.latency
+    print(f"{'voices':>6} {'block':>5} {'osc':>9} {'rate':>6} {'workload':>8} {'latency':>7} "
+          f"{'quantum':>7} {'ns/sample':>10} {'p99 us':>9} {'max us':>9} {'headroom':>9} "
+          f"{'worst':>8}")
+
+    for rate in sample_rates:
+        synth.sample_rate = rate
+        build_wavetables(rate)
+        for osc in osc_types:
+            synth.osc_type = osc
+            for workload in workloads:
+                for latency in latencies:
+                    synth.latency = latency
+                    for frames in block_sizes:
+                        for voice_count in voice_counts:
+                            case = {'voices': voice_count, 'block_size': frames,
+                                    'osc_type': osc, 'sample_rate': rate, 'workload': workload,
+                                    'latency': latency}
+                            case.update(benchmark_case(voice_count, frames, workload, seconds))
+                            cases.append(case)
+
+                            line = (f"{voice_count:>6} {frames:>5} {osc:>9} {rate:>6} "
+                                    f"{workload:>8} {latency * 1000:>5g}ms {case['quantum']:>7} "
+                                    f"{case['ns_per_sample']:>10.1f} {case['p99_us']:>9.1f} "
+                                    f"{case['max_us']:>9.1f} {case['headroom']:>8.1%} "
+                                    f"{case['max_headroom']:>8.1%}")
+                            old = previous.get((voice_count, frames, osc, rate, workload,
+                                                latency))
+                            if old is not None:
+                                line += f"  {old['ns_per_sample'] / case['ns_per_sample']:.2f}x"
+                            print(line)
+
+    mixer.clear()
+    render_ahead.configure(0, 0, synth.sample_rate)
+    synth.polyphony = polyphony
+    synth.latency = budget
+    results = {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'seconds_per_case': seconds,
+        'cases': cases,
+    }
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=1)
+    print(f"Saved {len(cases)} benchmark cases to {path}")
+    return results
+
+
+# *********************************************************************************************
+# Purpose:      Add the multitimbral part options to a command line parser
+# Parameters:   parser          -> argparse parser to add the options to
+# *********************************************************************************************
+def add_part_arguments(parser):
+    parser.add_argument('--part', action='append', type=configure_part, default=[],
+                        metavar='CHANNEL:OSC[:A:D:S:R]',
+                        help="oscillator, and optionally envelope, of one midi channel")
+    parser.add_argument('--adsr', type=parse_adsr, metavar='A:D:S:R',
+                        help="envelope of every channel without an envelope of its own")
+    parser.add_argument('--curve', default=envelope_curve, choices=['linear', 'exponential'],
+                        help="shape of the envelope segments of every channel")
+    parser.add_argument('--threads', type=int, default=synth.render_threads,
+                        help="worker threads the midi channels are rendered on")
+    parser.add_argument('--mod', action='append', type=parse_route,
+                        metavar='SOURCE:DEST:AMOUNT[:VIA]',
+                        help="modulation route replacing the default routes, none for no routes")
+    parser.add_argument('--lfo-rates', type=float, nargs=2,
+                        default=[synth.lfo1_rate, synth.lfo2_rate],
+                        help="rates in hz of the sine and the triangle lfo")
+    parser.add_argument('--samples',
+                        help="wav sample or json zone map the sample oscillator plays")
+
+
+# *********************************************************************************************
+# Purpose:      Copy the modulation options of the command line into the synth
+# Parameters:   arguments       -> parsed command line arguments
+# *********************************************************************************************
+def apply_modulation_arguments(arguments):
+    global modulation_routes
+
+    if arguments.mod is not None:
+        modulation_routes = [route for route in arguments.mod if route is not None]
+    synth.lfo1_rate, synth.lfo2_rate = arguments.lfo_rates
+
+
+# *********************************************************************************************
+# Purpose:      Copy the envelope options of the command line into the synth
+# Parameters:   arguments       -> parsed command line arguments
+# *********************************************************************************************
+def apply_envelope_arguments(arguments):
+    global attack, decay, sustain, release, envelope_curve
+
+    if arguments.adsr is not None:
+        attack, decay, sustain, release = arguments.adsr
+    envelope_curve = arguments.curve
+
+
+# *********************************************************************************************
+# Purpose:      Add the voice filter options to a command line parser
+# Parameters:   parser          -> argparse parser to add the options to
+# *********************************************************************************************
+def add_filter_arguments(parser):
+    parser.add_argument('--filter', default=synth.filter_type,
+                        choices=['off', 'lowpass', 'highpass'],
+                        help="resonant filter every voice runs through")
+    parser.add_argument('--cutoff', type=float, default=synth.filter_cutoff,
+                        help="filter cutoff in hz at full velocity")
+    parser.add_argument('--resonance', type=float, default=synth.filter_resonance,
+                        help="filter q, from 0.5 to 20")
+    parser.add_argument('--filter-velocity', type=float, default=synth.filter_velocity,
+                        help="octaves the cutoff falls from full velocity to the softest note")
+    parser.add_argument('--filter-cc', type=int, default=synth.filter_cc,
+                        help="midi cc moving the cutoff of its channel")
+
+
+# *********************************************************************************************
+# Purpose:      Copy the voice filter options of the command line into the synth
+# Parameters:   arguments       -> parsed command line arguments
+# *********************************************************************************************
+def apply_filter_arguments(arguments):
+    synth.filter_type = arguments.filter
+    synth.filter_cutoff = min(max(arguments.cutoff, FILTER_LOWEST), 20000.0)
+    synth.filter_resonance = min(max(arguments.resonance, 0.5), 20.0)
+    synth.filter_velocity = min(max(arguments.filter_velocity, 0.0), 8.0)
+    synth.filter_cc = arguments.filter_cc
+    load_filter(synth.filter_type)
+
+
+# *********************************************************************************************
+# Purpose:      Add the effects bus options to a command line parser
+# Parameters:   parser          -> argparse parser to add the options to
+# *********************************************************************************************
+def add_effect_arguments(parser):
+    parser.add_argument('--reverb', help="wav impulse response of the convolution reverb")
+    parser.add_argument('--reverb-level', type=float, default=synth.reverb_level,
+                        help="gain of the reverb added to the dry signal")
+    parser.add_argument('--delay', type=float, default=synth.delay_time,
+                        help="seconds between the echoes of the delay line, 0 turns it off")
+    parser.add_argument('--delay-feedback', type=float, default=synth.delay_feedback,
+                        help="share of each echo fed back into the delay line")
+    parser.add_argument('--delay-level', type=float, default=synth.delay_level,
+                        help="gain of the echoes added to the dry signal")
+
+
+# *********************************************************************************************
+# Purpose:      Copy the effects bus options of the command line into the synth and build the
+#               effects
+# Parameters:   arguments       -> parsed command line arguments
+# *********************************************************************************************
+def apply_effect_arguments(arguments):
+    synth.reverb_file = arguments.reverb
+    synth.reverb_level = min(max(arguments.reverb_level, 0.0), 1.0)
+    synth.delay_time = min(max(arguments.delay, 0.0), 2.0)
+    synth.delay_feedback = min(max(arguments.delay_feedback, 0.0), 0.95)
+    synth.delay_level = min(max(arguments.delay_level, 0.0), 1.0)
+    effects.configure()
+
+
+# *********************************************************************************************
+# Purpose:      Add the midi input options to a command line parser
+# Parameters:   parser          -> argparse parser to add the options to
+#               backend         -> default midi input backend
+# *********************************************************************************************
+def add_midi_arguments(parser, backend):
+    parser.add_argument('--midi', default=backend,
+                        choices=['port', 'virtual', 'file', 'capture', 'null'],
+                        help="midi input backend")
+    parser.add_argument('--midi-name',
+                        help="midi port name, or file path for the file and capture backends")
+    parser.add_argument('--midi-port', action='append', default=[], metavar='NAME',
+                        help="another midi port to listen to at the same time")
+    parser.add_argument('--midi-udp', type=parse_endpoint, metavar='[HOST:]PORT',
+                        help="local udp endpoint to listen for raw midi or osc midi on")
+    parser.add_argument('--capture', help="file to capture every incoming midi message into")
+
+
+# *********************************************************************************************
+# Purpose:      Open the midi inputs of the command line, and the capture file when asked for
+# Parameters:   arguments       -> parsed command line arguments
+# Returns:      ingest          -> MidiIngest listening to every input
+# *********************************************************************************************
+def open_midi_arguments(arguments):
+    global midi_capture
+
+    midi_input = open_midi_input(arguments.midi, arguments.midi_name)
+    inputs = [midi_input] + [PortMidiInput(name) for name in arguments.midi_port]
+    if arguments.capture is not None:
+        midi_capture = MidiCapture(arguments.capture)
+    return MidiIngest(inputs, arguments.midi_udp)
+
+
+# *********************************************************************************************
+# Purpose:      Parse a network endpoint from the command line, used as an argparse type
+# Parameters:   text            -> PORT or HOST:PORT, the host defaults to the local machine
+# Returns:      {tuple}         -> (host, port)
+# *********************************************************************************************
+def parse_endpoint(text):
+    host, colon, port = text.rpartition(':')
+    if not port.isdigit() or not 0 <= int(port) <= 65535:
+        raise argparse.ArgumentTypeError(f"expected [HOST:]PORT, got {text}")
+    return (host or '127.0.0.1', int(port))
+
+
+# *********************************************************************************************
+# Purpose:      Read the command line, with no command the interactive synth is started
+# Returns:      {argparse.Namespace}    -> parsed command line arguments
+# *********************************************************************************************
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="synthTHIS - a simple python synthesizer")
+    commands = parser.add_subparsers(dest='command')
+
+    render = commands.add_parser('render', help="render a midi file into a wav file offline")
+    render.add_argument('midi', help="path of the .mid file to render")
+    render.add_argument('wav', help="path of the .wav file to write")
+    render.add_argument('--osc', default=synth.osc_type, choices=list(osc_ids),
+                        help="oscillator type to render with")
+    render.add_argument('--rate', type=int, default=synth.sample_rate, choices=[44100, 48000],
+                        help="sample rate of the wav file")
+    render.add_argument('--processes', type=int, default=1,
+                        help="worker processes to split the song across by midi channel")
+    add_part_arguments(render)
+    add_filter_arguments(render)
+    add_effect_arguments(render)
+
+    replay = commands.add_parser('replay', help="replay a midi capture through the engine")
+    replay.add_argument('capture', help="path of the capture file to replay")
+    replay.add_argument('--wav', help="wav file to write the replay to instead of a null sink")
+    replay.add_argument('--realtime', action='store_true',
+                        help="replay at the speed it was captured instead of as fast as possible")
+    replay.add_argument('--block', type=int, default=synth.block_size,
+                        help="samples in every block handed to the output callback")
+    replay.add_argument('--osc', default=synth.osc_type, choices=list(osc_ids),
+                        help="oscillator type to replay with")
+    replay.add_argument('--rate', type=int, default=synth.sample_rate, choices=[44100, 48000],
+                        help="sample rate to replay at")
+    add_part_arguments(replay)
+    add_filter_arguments(replay)
+    add_effect_arguments(replay)
+
+    add_midi_arguments(parser, 'port')
+    parser.add_argument('--audio', default='device', choices=['device', 'file', 'null'],
+                        help="audio output backend of the interactive synth")
+    parser.add_argument('--audio-file', help="wav path for the file audio backend")
+    add_part_arguments(parser)
+    add_filter_arguments(parser)
+    add_effect_arguments(parser)
+
+    serve = commands.add_parser('serve', help="stream the synth as pcm without an audio device")
+    serve.add_argument('--out', default='stdout', metavar='TARGET',
+                       help="stdout, a file or named pipe path, or tcp:[HOST:]PORT")
+    serve.add_argument('--format', default='s16', choices=['s16', 'f32'],
+                       help="little endian sample format of the stream")
+    serve.add_argument('--wav', action='store_true',
+                       help="start every stream with a wav header of unknown length")
+    serve.add_argument('--pace', default='realtime', choices=['realtime', 'consumer'],
+                       help="render with the clock or as fast as the consumer reads")
+    serve.add_argument('--policy', default='drop', choices=['drop', 'block'],
+                       help="drop new blocks or wait when a realtime consumer falls behind")
+    serve.add_argument('--buffer', type=float, default=0.1,
+                       help="seconds of audio buffered for the consumer")
+    serve.add_argument('--block', type=int, default=256,
+                       help="samples in every block of the stream")
+    serve.add_argument('--osc', default=synth.osc_type, choices=list(osc_ids),
+                       help="oscillator type to play with")
+    serve.add_argument('--rate', type=int, default=synth.sample_rate, choices=[44100, 48000],
+                       help="sample rate of the stream")
+    add_midi_arguments(serve, 'null')
+    add_part_arguments(serve)
+    add_filter_arguments(serve)
+    add_effect_arguments(serve)
+
+    bench = commands.add_parser('benchmark', help="time the render path without audio devices")
+    bench.add_argument('json', help="path of the .json file to save the results in")
+    bench.add_argument('--voices', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32, 64, 128],
+                       help="voice counts to sweep")
+    bench.add_argument('--blocks', type=int, nargs='+', default=[1, 16, 64, 256, 1024],
+                       help="block sizes to sweep")
+    bench.add_argument('--osc', nargs='+', default=[osc for osc in osc_ids if osc != 'sample'],
+                       choices=list(osc_ids), help="oscillator types to sweep")
+    bench.add_argument('--samples', help="wav sample or json zone map for the sample oscillator")
+    bench.add_argument('--rates', type=int, nargs='+', default=[44100, 48000],
+                       help="sample rates to sweep")
+    bench.add_argument('--workloads', nargs='+', default=['steady', 'envelope'],
+                       choices=['steady', 'envelope'], help="workloads to sweep")
+    bench.add_argument('--latencies', type=float, nargs='+', default=[synth.latency],
+                       help="latency budgets in seconds to sweep, 0 renders every block directly")
+    bench.add_argument('--seconds', type=float, default=0.25,
+                       help="seconds of audio to render for each case")
+    bench.add_argument('--compare', help="earlier .json result to print speedups against")
+
+    return parser.parse_args()
+
+
+# ***************************************************************************
+#   Main function for calling methods and printing results
+# ***************************************************************************
+def main():
+    arguments = parse_arguments()
+
+    if arguments.command in ('render', 'replay', 'serve'):
+        synth.osc_type = arguments.osc
+        synth.sample_rate = arguments.rate
+        synth.render_threads = max(1, min(arguments.threads, MIDI_CHANNELS))
+        mixer.configure(synth.render_threads)
+        apply_filter_arguments(arguments)
+        apply_effect_arguments(arguments)
+        apply_modulation_arguments(arguments)
+        apply_envelope_arguments(arguments)
+        synth.sample_file = arguments.samples
+        instrument.load(synth.sample_file)
+        build_wavetables(synth.sample_rate)
+        if arguments.command == 'render':
+            render_midi_file(arguments.midi, arguments.wav, processes=arguments.processes)
+        elif arguments.command == 'serve':
+            # the stream may own stdout, everything printed goes to stderr instead
+            synth.block_size = max(1, arguments.block)
+            output = StreamAudioOutput(arguments.out, arguments.format, arguments.wav,
+                                       arguments.pace, arguments.policy, arguments.buffer)
+            sys.stdout = sys.stderr
+            run_server(output, open_midi_arguments(arguments))
+        else:
+            replay_capture(arguments.capture, arguments.wav, arguments.realtime,
+                           max(1, arguments.block))
+        return
+
+    if arguments.command == 'benchmark':
+        instrument.load(arguments.samples)
+        run_benchmark(arguments.json, arguments.voices, arguments.blocks, arguments.osc,
+                      arguments.rates, arguments.workloads, arguments.latencies,
+                      arguments.seconds, arguments.compare)
+        return
+
+    synth.render_threads = max(1, min(arguments.threads, MIDI_CHANNELS))
+    apply_filter_arguments(arguments)
+    apply_effect_arguments(arguments)
+    apply_modulation_arguments(arguments)
+    apply_envelope_arguments(arguments)
+    synth.sample_file = arguments.samples
+    instrument.load(synth.sample_file)
+
+    # --   midi startup  -- #
+    ingest = open_midi_arguments(arguments)
+
+    synth.startup_display()
+    synth.current_setup()
+    build_wavetables(synth.sample_rate)
+    render_ahead.configure(synth.latency, synth.block_size, synth.sample_rate)
+    mixer.configure(synth.render_threads)
+    mixer.prepare(max(synth.block_size, QUANTUM_LARGEST))
+    effects.prepare(max(synth.block_size, QUANTUM_LARGEST))
+
+    # output stream setup
+    audio_output = open_audio_output(arguments.audio, arguments.audio_file)
+    render_ahead.start()
+    audio_output.start()
+
+    # callback telemetry reporter
+    reporter = TelemetryReporter(telemetry)
+    reporter.start()
+
+    run = True
+    while run is True:
+        print("Would you like to:")
+        print("\t1 - start synth")
+        print("\t2 - check synth configuration")
+        print("\t3 - change synth configuration")
+        print("\t4 - exit program")
+        print("\t5 - check output callback telemetry")
+        print("\t6 - save output callback telemetry to a file")
+        option = int(input("Enter the number of the desired option: "))
+
+        if option == 1:
+            asyncio.run(ingest.run())
+        elif option == 2: synth.current_setup()
+        elif option == 3: synth.configuration_tree()
+        elif option == 4: run = False
+        elif option == 5: reporter.report()
+        elif option == 6:
+            path = input("Enter the path of the file to save to: ")
+            reporter.dump(path)
+            print(f"Telemetry saved to {path}")
+        else:
+            print("Invalid option, try again...")
+            break
+
+    audio_output.stop()
+    render_ahead.stop()
+    ingest.close()
+    if midi_capture is not None:
+        midi_capture.close()
+        print(f"Captured {midi_capture.count} midi messages to {midi_capture.path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import synthTHIS
+
+
+# *********************************************************************************************
+# Purpose:      Run a signal through a reverb in blocks of the given sizes, in turn
+# Parameters:   reverb          -> ConvolutionReverb to run the signal through
+#               signal          -> numpy array holding the dry signal
+#               sizes           -> list of block sizes to cycle through
+# Returns:      out             -> numpy array holding the processed signal
+# *********************************************************************************************
+def process_blocks(reverb, signal, sizes):
+    out = signal.copy()
+    position = 0
+    turn = 0
+    while position < len(out):
+        frames = min(sizes[turn % len(sizes)], len(out) - position)
+        reverb.process(out[position:position + frames])
+        position += frames
+        turn += 1
+    return out
+
+
+# *********************************************************************************************
+# Purpose:      The reverb adds exactly the convolution of its input with the impulse response
+#               scaled by its level, whatever blocks the input arrives in, for impulse responses
+#               shorter than its direct part as well as ones spanning many partitions
+# *********************************************************************************************
+@pytest.mark.parametrize('length', [1, 100, 1000, 5000, 20000])
+@pytest.mark.parametrize('sizes', [[64], [1, 7, 300, 1024, 33], [16, 512, 5, 129]])
+def test_matches_direct_convolution(length, sizes):
+    generator = np.random.default_rng(length + len(sizes))
+    impulse = generator.standard_normal(length) * np.exp(-np.arange(length) / (length / 4 + 1))
+    signal = generator.standard_normal(length + 6000)
+
+    reverb = synthTHIS.ConvolutionReverb(impulse, level=0.5)
+    reverb.prepare(max(sizes))
+    out = process_blocks(reverb, signal, sizes)
+
+    expected = signal + 0.5 * np.convolve(signal, impulse)[:len(signal)]
+    np.testing.assert_allclose(out, expected, rtol=0, atol=1e-9)
+
+
+# *********************************************************************************************
+# Purpose:      A block larger than the reverb was prepared for still comes out right
+# *********************************************************************************************
+def test_grows_past_prepared_block():
+    generator = np.random.default_rng(7)
+    impulse = generator.standard_normal(3000)
+    signal = generator.standard_normal(9000)
+
+    reverb = synthTHIS.ConvolutionReverb(impulse, level=1.0)
+    reverb.prepare(64)
+    out = process_blocks(reverb, signal, [64, 2000, 3])
+
+    expected = signal + np.convolve(signal, impulse)[:len(signal)]
+    np.testing.assert_allclose(out, expected, rtol=0, atol=1e-9)